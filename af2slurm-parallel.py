@@ -2,10 +2,14 @@
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import os
 import socket
-from glob import glob
 from pathlib import Path
-from Bio import SeqIO
-from math import ceil
+import heapq
+from executors import EXECUTORS, create_executor
+from job_journal import JobJournal
+from msa_cache import CACHEABLE_MSA_MODES, MSACache, create_store_command, prepare_msa_inputs
+from partition_routing import RoutingTable, combine_features, job_features
+from result_cache import ResultCache, apply_result_cache
+from runtime_db import RuntimeDB, query_lengths, settings_key
 
 
 def parse_cmd_args():
@@ -26,6 +30,18 @@ def parse_cmd_args():
     parser.add_argument(
         "--filter-proteinmpnn", help="Filter best X fasta sequences sorted by 'Score'", type=int, default=1000
     )
+    parser.add_argument(
+        "--fasta-parser",
+        help="builtin: fast reader without dependencies. biopython: read the fasta with Bio.SeqIO (needs Biopython)",
+        default="builtin",
+        choices=["builtin", "biopython"],
+    )
+    parser.add_argument(
+        "--keep-duplicates",
+        help="Keep ProteinMPNN sequences that are identical to a better scoring one (by default only the best is kept)",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "--target",
         help="target sequence to predict along with your designed binder",
@@ -38,6 +54,43 @@ def parse_cmd_args():
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--executor",
+        help="Run the array job with slurm, or in a pool of --local-workers processes on this host and wait for it "
+        "(see executors.py)",
+        default="slurm",
+        choices=EXECUTORS,
+    )
+    parser.add_argument("--local-workers", help="With --executor local, run up to X tasks at the same time", type=int, default=1)
+    parser.add_argument(
+        "--msa-cache-dir",
+        help="Reuse MSAs of chains that were already predicted (with the same --msa-mode) from this directory "
+        "and add new MSAs to it. Complexes are only taken from the cache with --pair-mode unpaired (the default with --target)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--result-cache-dir",
+        help="Keep an index of predictions in this directory and link existing results instead of predicting the same "
+        "sequences with the same settings again",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--job-journal",
+        help="Record the submitted array job in this sqlite file (see job_journal.py status)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--runtime-db",
+        help="Record the runtime of every array task in this sqlite file and set sbatch --time from the runtimes of "
+        "earlier tasks with the same settings, so the tasks can be backfilled (see runtime_db.py show)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument("--time-margin", help="With --runtime-db, set --time to X times the estimated runtime", type=float, default=1.5)
+    parser.add_argument("--time-padding-s", help="With --runtime-db, add X seconds to the time limit", type=float, default=600)
 
     ### Control grouping
     parser.add_argument(
@@ -55,6 +108,23 @@ def parse_cmd_args():
         type=int,
         default=10,
     )
+    parser.add_argument(
+        "--grouping",
+        help="input-order: walk the sequences in input order and start a new group when a limit is hit. "
+        "length-packed: sort by length, bucket into --recompile-padding wide length windows and pack each bucket into "
+        "as few groups as the limits allow (fewer groups and fewer recompiles)",
+        type=str,
+        default="input-order",
+        choices=["input-order", "length-packed"],
+    )
+    parser.add_argument(
+        "--array-tasks",
+        help="Balance the groups over X array tasks by their estimated runtime (quadratic in the sequence length, times "
+        "--num-models, --num-seeds and --num-recycle). Groups that would take longer than the average task are split. "
+        "0: one array task per group",
+        type=int,
+        default=0,
+    )
     #####
 
     ### Control slurm
@@ -71,6 +141,14 @@ def parse_cmd_args():
     parser.add_argument("--gres", help="GPU to use.", type=str, default="gpu:A40:1")
     #assumes --ntasks=1 is also given
     parser.add_argument("--cpus-per-task", help="How many cpus per task", type=int, default=2)
+    parser.add_argument(
+        "--route",
+        help="Routing rule like 'residues<=400 chains=1 -> --partition=gpu-short --gres=gpu:1'. The slurm options of "
+        "the first rule that matches the largest query replace --partition, --gres and --cpus-per-task. Conditions on "
+        "residues, chains, total_residues, queries, msa_mode, pair_mode and model_type. Can be given several times",
+        action="append",
+        default=[],
+    )
     
 
     ### Colabfold batch settings
@@ -169,9 +247,10 @@ def parse_cmd_args():
         choices=["auto", "plddt", "ptm", "iptm", "multimer"],
     )
     parser.add_argument("--pair-mode",
-        help="rank models by auto, unpaired, paired, unpaired_paired",
+        help="rank models by auto, unpaired, paired, unpaired_paired. Defaults to unpaired_paired, and to unpaired "
+        "with --target and --msa-cache-dir, so the cached MSAs of the target and the binders are used",
         type=str,
-        default="unpaired_paired",
+        default=None,
         choices=["unpaired", "paired", "unpaired_paired"],
     )
     parser.add_argument("--sort-queries-by",
@@ -243,6 +322,10 @@ def parse_cmd_args():
     )
 
     args = parser.parse_args()
+    try:
+        RoutingTable(args.route)
+    except ValueError as e:
+        parser.error(str(e))
     return args
 
 """
@@ -250,11 +333,21 @@ default parameters:
 python af2slurm-parallel.py <path/to/fasta/file> <output/directory> \
 
     --dry-run False \
+    --fasta-parser builtin \
+    --keep-duplicates False \
+    --msa-cache-dir None \
+    --result-cache-dir None \
+    --job-journal None \
+    --runtime-db None \
+    --time-margin 1.5 \
+    --time-padding-s 600 \
 
     ### Control grouping ###
     --max-group-size 30 \
     --max-group-size-AA 10000 \
     --max-size-change 10 \
+    --grouping input-order \
+    --array-tasks 0 \
 
     ### Slurm controls ###
     --job-name "" \
@@ -262,6 +355,7 @@ python af2slurm-parallel.py <path/to/fasta/file> <output/directory> \
     --partition gpu \
     --gres gpu:A40:1 \
     --cpus-per-task 2 \
+    --route None \
 
     ### Colabfold batch settings ###
     --stop-at-score 100 \
@@ -297,6 +391,44 @@ python af2slurm-parallel.py <path/to/fasta/file> <output/directory> \
     --disable-unified-memory False
 """
 
+class FastaRecord:
+    """Lightweight replacement of Biopython's SeqRecord, with the same id, description and seq attributes.
+    Like in Biopython, description is the whole header line, id included.
+    """
+
+    __slots__ = ("id", "description", "seq")
+
+    def __init__(self, seq, id, description=""):
+        self.seq = seq
+        self.id = id
+        self.description = description
+
+    def __len__(self):
+        return len(self.seq)
+
+
+# Read a fasta file record by record, the same way Bio.SeqIO.parse(fasta_file, 'fasta') does (text before the first
+# header is skipped, newer Biopython versions refuse such files)
+def read_fasta_records(fasta_file, parser="builtin"):
+    if parser == "biopython":
+        from Bio import SeqIO  # only imported when asked for, the import alone takes a while on shared filesystems
+
+        yield from SeqIO.parse(fasta_file, 'fasta')
+        return
+
+    header, lines = None, []
+    with open(fasta_file) as f:
+        for line in f:
+            if line[0] == '>':
+                if header is not None:
+                    yield FastaRecord("".join(lines).replace(" ", ""), header.split(None, 1)[0] if header else "", header)
+                header, lines = line[1:].strip(), []
+            elif header is not None:
+                lines.append(line.strip())
+    if header is not None:
+        yield FastaRecord("".join(lines).replace(" ", ""), header.split(None, 1)[0] if header else "", header)
+
+
 # Define a function to write a list of sequences to a FASTA file
 def write_to_fasta(name, list_of_seq):
     with open(name, 'w') as out_file:
@@ -311,6 +443,202 @@ def parse_fasta_description(desc):
     return data
 
 
+# Clean up a ProteinMPNN sequence for colabfold: chain breaks '/' become ':' and the target is appended as extra chain
+def clean_proteinmpnn_sequence(seq, target_sequence=None):
+    seq = str(seq).replace(' ','').replace('-','').replace('/',':')
+    return f"{seq}:{target_sequence}" if target_sequence else seq
+
+
+# Stream a ProteinMPNN fasta and keep the native sequence plus the best scoring designs
+def select_top_proteinmpnn(fasta_file, keep, target_sequence=None, deduplicate=True, fasta_parser="builtin"):
+    """Returns [native] + the keep-1 designs with the lowest score as FastaRecords, sorted by score.
+    Only a bounded heap of the current best designs is held in memory, so files with millions of sequences can be
+    filtered. With deduplicate, identical sequences are only kept once (the best scoring copy).
+    """
+    records = read_fasta_records(fasta_file, fasta_parser)
+    first = next(records)
+    native = FastaRecord(clean_proteinmpnn_sequence(first.seq, target_sequence), id="Original_sequence", description="")
+    keep_designs = max(keep - 1, 0)
+
+    # heap[0] is always the worst kept design: highest score, and the later one of equal scores. With deduplicate, an
+    # entry replaced by a better copy of its sequence stays in the heap until it is popped (or the heap is compacted)
+    heap = []  # (-score, -index, sequence, new_id)
+    best = {}  # sequence -> (-score, -index) of its entry in the heap, for sequences currently kept
+
+    def stale(entry):
+        return deduplicate and best.get(entry[2]) != entry[:2]
+
+    for index, record in enumerate(records):
+        info = parse_fasta_description(record.description)
+        score = float(info['score'])
+        sequence = clean_proteinmpnn_sequence(record.seq, target_sequence)
+        entry = (-score, -index, sequence, f"{info['sample']}|{info['score']} {info['T']} {info['global_score']}")
+
+        if deduplicate and sequence in best:
+            if score < -best[sequence][0]:  # a better copy, the one in the heap becomes stale
+                heapq.heappush(heap, entry)
+                best[sequence] = entry[:2]
+                if len(heap) > 2 * keep_designs:
+                    heap = [e for e in heap if not stale(e)]
+                    heapq.heapify(heap)
+            continue
+
+        while heap and stale(heap[0]):
+            heapq.heappop(heap)
+        if (len(best) if deduplicate else len(heap)) < keep_designs:
+            heapq.heappush(heap, entry)
+        elif keep_designs > 0 and entry > heap[0]:
+            removed = heapq.heappushpop(heap, entry)
+            if deduplicate:
+                del best[removed[2]]
+        else:
+            continue
+        if deduplicate:
+            best[sequence] = entry[:2]
+
+    designs = sorted((e for e in heap if not stale(e)), reverse=True)  # best score first, ties in input order
+    selected = [native]
+    for _, _, sequence, new_id in designs:
+        selected.append(FastaRecord(sequence, id=new_id.partition(' ')[0], description=new_id))
+    return selected[:keep]
+
+
+# Group sequences in input order, starting a new group whenever one of the limits is exceeded
+def group_sequences_in_order(seq_list, max_group_size, max_group_total_AA, max_size_change):
+    # Initialize a new group with the first sequence
+    seq = seq_list[0]
+    group_index = 0
+    groups = [[seq]]
+    group_size = 1
+    group_total_AA = len(seq)
+    last_added_length = len(seq)
+
+    # Iterate over the remaining sequences and cluster them into groups
+    for seq in seq_list[1:]:
+        # If there is a change in criteria, create a new group
+        size_change = len(seq) / last_added_length
+        if group_size > max_group_size or group_total_AA > max_group_total_AA or size_change > max_size_change:
+            group_index += 1
+            groups.append([seq])
+            group_size = 1
+            group_total_AA = len(seq)
+            last_added_length = len(seq)
+        else:
+            groups[group_index].append(seq)
+            group_size += 1
+            group_total_AA += len(seq)
+            last_added_length = len(seq)
+    return groups
+
+
+# Bucket sequences into length windows of recompile_padding and bin-pack each bucket into groups
+def group_sequences_length_packed(seq_list, max_group_size, max_group_total_AA, recompile_padding):
+    """ColabFold pads every input to the length of the first query plus recompile_padding and only recompiles once a
+    longer query comes along. Sequences within one such length window therefore share a compiled model.
+    Each window is packed with first-fit decreasing into as few groups as max_group_size and max_group_total_AA allow,
+    then partially filled groups of neighbouring windows are merged if they still fit the limits.
+    """
+    seqs = sorted(seq_list, key=len)
+
+    # Split into length windows the same way colabfold_batch decides when to recompile
+    buckets = []
+    for seq in seqs:
+        if buckets and len(seq) <= len(buckets[-1][0]) + recompile_padding:
+            buckets[-1].append(seq)
+        else:
+            buckets.append([seq])
+
+    groups = []
+    for bucket in buckets:
+        bins = []  # [total_AA, [seqs]]
+        for seq in sorted(bucket, key=len, reverse=True):
+            for b in bins:
+                if len(b[1]) < max_group_size and b[0] + len(seq) <= max_group_total_AA:
+                    b[0] += len(seq)
+                    b[1].append(seq)
+                    break
+            else:
+                bins.append([len(seq), [seq]])
+        groups += [sorted(b[1], key=len) for b in bins]
+
+    # Merging leftovers of neighbouring windows saves array tasks, the recompiles just move into the merged group
+    merged = []
+    for group in groups:
+        if (
+            merged
+            and len(merged[-1]) + len(group) <= max_group_size
+            and sum(len(seq) for seq in merged[-1] + group) <= max_group_total_AA
+        ):
+            merged[-1] = merged[-1] + group
+        else:
+            merged.append(group)
+    return merged
+
+
+# Count how often colabfold_batch compiles the model when predicting a group
+def count_compiles(lengths, recompile_padding, sort_by_length=True):
+    if sort_by_length:
+        lengths = sorted(lengths)
+    compiles = 0
+    pad_length = 0
+    for length in lengths:
+        if length > pad_length:
+            compiles += 1
+            pad_length = length + recompile_padding
+    return compiles
+
+
+def print_packing_report(groups, recompile_padding, sort_by_length=True):
+    compiles = [count_compiles([len(seq) for seq in g], recompile_padding, sort_by_length) for g in groups]
+    print(f"Packed {sum(len(g) for g in groups)} sequences into {len(groups)} groups")
+    for n, (g, c) in enumerate(zip(groups, compiles)):
+        lengths = [len(seq) for seq in g]
+        print(f"  g{n:04d}: {len(g):4d} sequences, {sum(lengths):6d} AA, lengths {min(lengths)}-{max(lengths)}, {c} compiles")
+    print(f"Expected compiles: {sum(compiles)} ({sum(compiles) - len(groups)} recompiles within groups)")
+
+
+# Estimated relative runtime of predicting one sequence: quadratic in its length, times models, seeds and recycles
+def estimate_cost(seq, num_models, num_seeds, num_recycle):
+    recycles = num_recycle if num_recycle is not None else 3  # colabfold's default
+    return len(seq) ** 2 * num_models * num_seeds * (recycles + 1)
+
+
+# Split the groups that cost more than an average task and distribute them over num_tasks array tasks
+def balance_array_tasks(groups, num_tasks, cost):
+    """Returns (groups, tasks), where tasks is a list of group indices per array task.
+    Groups are split into consecutive pieces (so the recompiles within them stay the same) until none costs more than
+    total cost / num_tasks. The pieces are then assigned longest first to the task with the lowest total cost so far.
+    """
+    target = sum(cost(seq) for g in groups for seq in g) / num_tasks
+    pieces = []
+    for g in groups:
+        piece, piece_cost = [], 0
+        for seq in g:
+            if piece and piece_cost + cost(seq) > target:
+                pieces.append(piece)
+                piece, piece_cost = [], 0
+            piece.append(seq)
+            piece_cost += cost(seq)
+        pieces.append(piece)
+
+    piece_costs = [sum(cost(seq) for seq in piece) for piece in pieces]
+    loads = [(0, task) for task in range(min(num_tasks, len(pieces)))]  # heap of (total cost, task index)
+    tasks = [[] for _ in loads]
+    for n in sorted(range(len(pieces)), key=lambda n: -piece_costs[n]):
+        load, task = heapq.heappop(loads)
+        tasks[task].append(n)
+        heapq.heappush(loads, (load + piece_costs[n], task))
+    return pieces, [sorted(task) for task in tasks]
+
+
+def print_balance_report(label, groups, tasks, cost):
+    group_costs = [sum(cost(seq) for seq in g) for g in groups]
+    task_costs = [sum(group_costs[n] for n in task) for task in tasks]
+    mean = sum(task_costs) / len(task_costs)
+    print(f"{label}: {len(groups)} groups in {len(tasks)} array tasks, estimated cost per task "
+          f"min {min(task_costs) / mean:.2f}x, max {max(task_costs) / mean:.2f}x of the mean")
+
+
 def main():
     args = parse_cmd_args()
     
@@ -326,133 +654,207 @@ def main():
     MAX_GROUP_SIZE = args.max_group_size #--max-group-size 30 {args.save_recycles}
     MAX_GROUP_TOTAL_AA = args.max_group_size_AA #--max-group-size-AA
     MAX_SIZE_CHANGE = args.max_size_change #--max-size-change
-    GROUPS = []
+
+    if args.pair_mode is None:
+        # every binder:target query is a complex, and cached MSAs are unpaired
+        args.pair_mode = "unpaired" if args.msa_cache_dir and target_sequence else "unpaired_paired"
+        if args.pair_mode == "unpaired":
+            print("Predicting with --pair-mode unpaired, so the binders are served from the MSA cache. "
+                  "Set --pair-mode unpaired_paired to search paired MSAs instead")
+    elif args.msa_cache_dir and target_sequence and args.pair_mode != "unpaired":
+        print(f"WARNING: with --target and --pair-mode {args.pair_mode}, no query is taken from the MSA cache. "
+              "Use --pair-mode unpaired to reuse the MSAs of the target and of binders predicted before")
 
     # Create the output directory if it doesn't exist
     os.makedirs(out_dir, exist_ok=True)
 
     # If ProteinMPNN is input, sort by score and take best X
     if proteinmppn:
-         # Read in a list of sequences from a FASTA file and sort them by score
-        seqs = list(SeqIO.parse(open(fasta_file), 'fasta'))
-        
-        # Sort without first sequence
-        first = seqs[0]
-        seqs = seqs[1:]
-        seqs = sorted(seqs, key=lambda seq: float(parse_fasta_description(seq.description)['score']))
-        seqs = [first] + seqs
-    
-        # Take the top X sequences and the native sequence
-        seqs = seqs[:filter_proteinmpnn]
+        # Stream the sequences and keep the native sequence and the top X by score
+        seq_list = select_top_proteinmpnn(
+            fasta_file, filter_proteinmpnn, target_sequence, deduplicate=not args.keep_duplicates, fasta_parser=args.fasta_parser
+        )
 
         # Write the selected sequences to a new FASTA file with modified IDs
-        with open(f'{out_dir}/{job_name}.fasta', 'w') as seq_list:
-            seq_list.write(f">Original_sequence\n{str(seqs[0].seq).replace(' ','').replace('-','').replace('/',':')}{f':{target_sequence}' if target_sequence else ''}\n")
-            for seq in seqs[1:]:
-                info = parse_fasta_description(seq.description)
-                new_id = f"{info['sample']}|{info['score']} {info['T']} {info['global_score']}"
-                seq_list.write(f">{new_id}\n{str(seq.seq).replace(' ','').replace('-','').replace('/',':')}{f':{target_sequence}' if target_sequence else ''}\n")
-        
-        # Read in a list of sequences from the new FASTA file
-        seq_list = list(SeqIO.parse(open(seq_list.name), 'fasta'))
+        with open(f'{out_dir}/{job_name}.fasta', 'w') as selected_file:
+            for seq in seq_list:
+                selected_file.write(f">{seq.description or seq.id}\n{seq.seq}\n")
     else:
-        seq_list = list(SeqIO.parse(open(fasta_file), 'fasta'))
+        seq_list = list(read_fasta_records(fasta_file, args.fasta_parser))
 
-    # Initialize a new group with the first sequence
-    seq = seq_list[0]
-    group_index = 0
-    GROUPS.append([seq])
-    group_size = 1
-    group_total_AA = len(seq)
-    last_added_length = len(seq)
+    # Cluster the sequences into groups
+    if args.grouping == "length-packed":
+        GROUPS = group_sequences_length_packed(seq_list, MAX_GROUP_SIZE, MAX_GROUP_TOTAL_AA, args.recompile_padding)
+    else:
+        GROUPS = group_sequences_in_order(seq_list, MAX_GROUP_SIZE, MAX_GROUP_TOTAL_AA, MAX_SIZE_CHANGE)
+    print_packing_report(GROUPS, args.recompile_padding, sort_by_length=args.sort_queries_by == "length")
 
-    # Iterate over the remaining sequences and cluster them into groups
-    for seq in seq_list[1:]:
-        # If there is a change in criteria, create a new group
-        size_change = len(seq) / last_added_length
-        if group_size > MAX_GROUP_SIZE or group_total_AA > MAX_GROUP_TOTAL_AA or size_change > MAX_SIZE_CHANGE:
-            group_index += 1
-            GROUPS.append([seq])
-            group_size = 1
-            group_total_AA = len(seq)
-            last_added_length = len(seq)
-        else:
-            GROUPS[group_index].append(seq)
-            group_size += 1
-            group_total_AA += len(seq)
-            last_added_length = len(seq)
+    # Pack the groups into array tasks with about the same estimated runtime
+    TASKS = None
+    if args.array_tasks:
+        cost = lambda seq: estimate_cost(seq, args.num_models, args.num_seeds, args.num_recycle)
+        print_balance_report("One task per group", GROUPS, [[n] for n in range(len(GROUPS))], cost)
+        GROUPS, TASKS = balance_array_tasks(GROUPS, args.array_tasks, cost)
+        print_balance_report("Balanced", GROUPS, TASKS, cost)
 
     #Write each group to a separate file and generate commands to run the ColabFold program on each file
+    # (only these, out_dir also has the --proteinmpnn selection and maybe groups of an earlier run)
+    fastas = []
     for n, g in enumerate(GROUPS):
         write_to_fasta(out_dir / f"g{n:04d}.fasta", g)
+        fastas.append(str(out_dir / f"g{n:04d}.fasta"))
+
+    colabfold_options = (
+        f'--stop-at-score {args.stop_at_score} '
+        f'--num-recycle {args.num_recycle} '
+        f'--recycle-early-stop-tolerance {args.recycle_early_stop_tolerance} '
+        f'--num-ensemble {args.num_ensemble} '
+        f'--num-seeds {args.num_seeds} '
+        f'--random-seed {args.random_seed} '
+        f'--num-models {args.num_models} '
+        f'--recompile-padding {args.recompile_padding} '
+        f'--model-order {args.model_order} '
+        f'--msa-mode {args.msa_mode} '
+        f'--model-type {args.model_type} '
+        f'--amber {args.amber} '
+        f'--num-relax {args.num_relax} '
+        f'--templates {args.templates} '
+        f'--custom-template-path {args.custom_template_path} '
+        f'--rank {args.rank} '
+        f'--pair-mode {args.pair_mode} '
+        f'--sort-queries-by {args.sort_queries_by} '
+        f'--save-single-representations {args.save_single_representations} '
+        f'--save-pair-representations {args.save_pair_representations} '
+        f'--use-dropout {args.use_dropout} '
+        f'--max-seq {args.max_seq} '
+        f'--max-extra-seq {args.max_extra_seq} '
+        f'--max-msa {args.max_msa} '
+        f'--disable-cluster-profile {args.disable_cluster_profile} '
+        f'--zip {args.zip} '
+        f'--use-gpu-relax {args.use_gpu_relax} '
+        f'--save-all {args.save_all} '
+        f'--save-recycles {args.save_recycles} '
+        f'--overwrite-existing-results {args.overwrite_existing_results} '
+        f'--disable-unified-memory {args.disable_unified_memory}'
+    )
+
+    # Reuse cached MSAs: cached queries are predicted from .a3m inputs, the MSAs of the others are stored after the job
+    msa_cache = None
+    if args.msa_cache_dir and args.msa_mode in CACHEABLE_MSA_MODES:
+        msa_cache = MSACache(args.msa_cache_dir, args.msa_mode)
 
-    fastas = sorted(glob(f'{out_dir}/*.fasta'))
+    # Link results of sequences that were already predicted with the same settings instead of predicting them again
+    colabfold_path = '/home/aljubetic/AF2/CF2/bin/colabfold_batch'
+    result_cache = None
+    if args.result_cache_dir:
+        result_cache = ResultCache(args.result_cache_dir, colabfold_path, colabfold_options)
+    to_register = []
+
+    #Generate the command for each fasta file
+    task_lines, task_fastas, task_sizes = {}, {}, {}
+    for fasta in fastas:
+        fasta_name = Path(fasta).stem
+        predict_fasta = Path(fasta)
+        if result_cache is not None:
+            os.makedirs(out_dir / "result_cache_inputs", exist_ok=True)
+            predict_fasta = apply_result_cache(
+                fasta, out_dir / fasta_name, result_cache, out_dir / "result_cache_inputs" / f"{fasta_name}.fasta"
+            )
+            if predict_fasta is None:
+                print(f"{fasta_name}: all sequences were predicted before, results linked to {out_dir / fasta_name}")
+                continue
+            to_register.append((predict_fasta, out_dir / fasta_name))
+
+        inputs, store_fasta = [predict_fasta], None
+        if msa_cache is not None:
+            inputs, store_fasta = prepare_msa_inputs(
+                predict_fasta, out_dir / "msa_cache_inputs" / fasta_name, msa_cache, args.pair_mode
+            )
+        commands = [
+            f'{colabfold_path} {colabfold_options} {input_path} {out_dir / fasta_name}'
+            for input_path in inputs
+        ]
+        if msa_cache is not None and store_fasta is not None:
+            commands.append(create_store_command(args.msa_cache_dir, args.msa_mode, store_fasta, out_dir / fasta_name))
+        task_lines[fasta_name] = f'. /home/aljubetic/bin/set_up_AF2.sh && mkdir -p {out_dir / fasta_name} && ' + ' && '.join(commands)
+        task_fastas[fasta_name] = predict_fasta
+        if args.runtime_db:
+            task_sizes[fasta_name] = sum(length ** 2 for length in query_lengths(predict_fasta))
+
+    # Array task J runs lines (J-1)*GROUP_SIZE+1 .. J*GROUP_SIZE, so the shorter tasks are padded with no-op lines
+    GROUP_SIZE=1
+    if TASKS is None:
+        tasks = [[name] for name in task_lines]
+    else:
+        # groups whose sequences were all predicted before have no task line
+        tasks = [[f"g{n:04d}" for n in task if f"g{n:04d}" in task_lines] for task in TASKS]
+        tasks = [task for task in tasks if task]
+        GROUP_SIZE = max((len(task) for task in tasks), default=1)
 
     #Create a file to store the commands
     #print(f'{out_dir}/run.tasks')
     with open(f'{out_dir}/run.tasks', 'w') as f:
-        for fasta in fastas:
-            fasta_name = Path(fasta).stem
-            f.write(f'. /home/aljubetic/bin/set_up_AF2.sh && mkdir -p {out_dir / fasta_name} && ' \
-                f'/home/aljubetic/AF2/CF2/bin/colabfold_batch ' \
-                f'--stop-at-score {args.stop_at_score} ' \
-                f'--num-recycle {args.num_recycle} ' \
-                f'--recycle-early-stop-tolerance {args.recycle_early_stop_tolerance} ' \
-                f'--num-ensemble {args.num_ensemble} ' \
-                f'--num-seeds {args.num_seeds} ' \
-                f'--random-seed {args.random_seed} ' \
-                f'--num-models {args.num_models} ' \
-                f'--recompile-padding {args.recompile_padding} ' \
-                f'--model-order {args.model_order} ' \
-                f'--msa-mode {args.msa_mode} ' \
-                f'--model-type {args.model_type} ' \
-                f'--amber {args.amber} ' \
-                f'--num-relax {args.num_relax} ' \
-                f'--templates {args.templates} ' \
-                f'--custom-template-path {args.custom_template_path} ' \
-                f'--rank {args.rank} ' \
-                f'--pair-mode {args.pair_mode} ' \
-                f'--sort-queries-by {args.sort_queries_by} ' \
-                f'--save-single-representations {args.save_single_representations} ' \
-                f'--save-pair-representations {args.save_pair_representations} ' \
-                f'--use-dropout {args.use_dropout} ' \
-                f'--max-seq {args.max_seq} ' \
-                f'--max-extra-seq {args.max_extra_seq} ' \
-                f'--max-msa {args.max_msa} ' \
-                f'--disable-cluster-profile {args.disable_cluster_profile} ' \
-                f'--zip {args.zip} ' \
-                f'--use-gpu-relax {args.use_gpu_relax} ' \
-                f'--save-all {args.save_all} ' \
-                f'--save-recycles {args.save_recycles} ' \
-                f'--overwrite-existing-results {args.overwrite_existing_results} ' \
-                f'--disable-unified-memory {args.disable_unified_memory}\n')
+        for task in tasks:
+            f.writelines(task_lines[name] + '\n' for name in task)
+            f.writelines(':\n' for _ in range(GROUP_SIZE - len(task)))
 
     #Read the commands from the file
     with open(f'{out_dir}/run.tasks') as cmds:
         lines = cmds.read()
+        if not lines:
+            print("Nothing to submit, all sequences were predicted before")
+            return
         lines = lines.split('\n')
     
     # Prepare params for the jobs
     job_name = args.job_name if args.job_name else fasta_file
     output_file = args.output if args.output else f"{fasta_name}.out"
-    slurm_params =  f'--partition={args.partition} --gres={args.gres} --ntasks=1 ' \
-                    f'--cpus-per-task={args.cpus_per_task} --job-name={out_dir}/{job_name} ' \
+    resources = f'--partition={args.partition} --gres={args.gres} --cpus-per-task={args.cpus_per_task}'
+    if args.route:
+        # the whole array job goes to one partition, so the largest query decides
+        features = combine_features([job_features(path, colabfold_options) for path in task_fastas.values()])
+        resources = RoutingTable(args.route).route(resources, features, fasta_file)
+        print(f"Routing ({', '.join(f'{name}={value}' for name, value in features.items())}): {resources}")
+    slurm_params =  f'{resources} --ntasks=1 ' \
+                    f'--job-name={out_dir}/{job_name} ' \
                     f'--output={output_file} -e {job_name}.err '
 
-    GROUP_SIZE=1
+    # Set --time from the runtimes of earlier jobs with the same settings, so the array tasks can be backfilled
+    runtime_db, runtimes = None, []
+    if args.runtime_db:
+        runtime_db = RuntimeDB(args.runtime_db, margin=args.time_margin, padding_s=args.time_padding_s)
+        runtime_db.harvest()
+        settings = settings_key(colabfold_path, colabfold_options, resources)
+        runtimes = [(settings, sum(task_sizes[name] for name in task)) for task in tasks]
+        slurm_params += runtime_db.time_limit(slurm_params, runtimes)
+
     task_list = f'{out_dir}/run.tasks'
-    num_tasks = ceil(len(lines)/GROUP_SIZE)
+    num_tasks = len(tasks)
     #print(num_tasks)
     
     #Submit
     dry_run = args.dry_run
     
 
-    cmd_string = f"export GROUP_SIZE=1; sbatch {slurm_params} -a 1-{num_tasks} scripts/wrapper_slurm_array_job_group.sh {task_list}"
+    cmd_string = f"export GROUP_SIZE={GROUP_SIZE}; sbatch {slurm_params} -a 1-{num_tasks} scripts/wrapper_slurm_array_job_group.sh {task_list}"
     if dry_run:
         print(cmd_string)
     else:
-        os.system(cmd_string)
+        journal = JobJournal(args.job_journal) if args.job_journal else None
+        executor = create_executor(args.executor, args.local_workers, journal)
+        sbatch_output = executor.submit(cmd_string)
+        print(sbatch_output)
+        if journal is not None:
+            journal.record(sbatch_output, job_name, "af2slurm-parallel", fasta_file, out_dir)
+        if runtime_db is not None:
+            for index, runtime in enumerate(runtimes, start=1):
+                runtime_db.record(sbatch_output, *runtime, array_task=index)
+        if result_cache is not None:
+            for predict_fasta, result_dir in to_register:
+                result_cache.register(predict_fasta, result_dir)
+        executor.close()  # the local executor runs the tasks in this process, wait for them
+        if journal is not None and args.executor == "local":
+            journal.refresh()  # record the states of the local tasks
 
 
 if __name__ == "__main__":
@@ -1,14 +1,39 @@
 #!python
 from configargparse import ArgParser, ArgumentDefaultsHelpFormatter
-import subprocess
-from time import sleep
-from glob import glob
 import os
-import shutil
+from functools import partial
 from pathlib import Path
 import re
 import logging
-from typing import Tuple
+import time
+from typing import List, Tuple
+from job_journal import JobJournal, parse_slurm_id
+from msa_cache import CACHEABLE_MSA_MODES, MSACache, create_store_command, parse_msa_settings, prepare_msa_inputs
+from partition_routing import RoutingTable, job_features
+from result_archive import compact_completed
+from result_cache import ResultCache, apply_result_cache
+from executors import EXECUTORS, SLURM, create_executor
+from runtime_db import RuntimeDB, query_lengths, settings_key
+from scheduling import POLICIES, Scheduler, split_priority
+from watcher_metrics import METRICS, MetricsExporter
+from watcher_utils import (
+    AdmissionControl,
+    ClaimDirectory,
+    FolderScanner,
+    create_folder_watcher,
+    create_unique_file,
+    keep_original,
+    normalize_input,
+    parse_in_flight_limits,
+    parse_partition,
+    read_input_args,
+    run_pipeline,
+    submit_with_admission,
+    wait_for_files,
+)
+
+ARRAY_WRAPPER_SCRIPT = Path(__file__).resolve().parent / "scripts" / "wrapper_slurm_array_job.sh"
+COLABFOLD_ARGS_LINE = re.compile(r"^\s*#\s*(-|priority=)")
 
 
 def move_over_fasta_file(
@@ -28,47 +53,32 @@ def move_over_fasta_file(
     out_pathname = out_sub_folder / file_path.name
     os.makedirs(out_sub_folder, exist_ok=True)
 
-    #copy original input file (with arguments) and add ".original"
-    shutil.copy(file_path, str(out_pathname)+".original")
-
-    # Extract colab_args
-    with open(file_path) as source_file:
-        # skip empty lines at the start of the file
-        lines = source_file.read()
-        lines = lines.lstrip(" \n").splitlines()
-        first_line = lines[0].strip()
-
-        match_colabfold_args_line = re.compile(r"^\s*#\s*-\s*")
-        if match_colabfold_args_line.match(first_line):  # if the first line matches the pattern
-            colab_args = first_line.lstrip(
-                "#"
-            ).strip()  # Remove only the # symbol from the beginning of the line
-            del lines[0]  # Remove the first line from the list
-        else:
-            colab_args = ""
-
-    # add fasta header if it is missing. Just use the name of the file. DO NOT DO THIS ON .a3m files
-    if lines[0][0] != ">" and file_path.suffix != ".a3m":
-        lines.insert(0, ">" + stem_name)
-
-    def filter_stars_spaces(line):
-        if len(line)>0 and line[0] == ">":  # if fasta header, don't do any replacements
-            return line
-        # get rid of stars and spaces in the sequence
-        return line.replace("*", "").replace(" ", "")
-
-    if file_path.suffix != ".a3m":  # no filtering should be needed for .a3m files
-        lines = [filter_stars_spaces(l) for l in lines]
-
-    with open(out_pathname, "w+") as target_file:
-        target_file.write("\n".join(lines))
+    # Extract colab_args and write the cleaned up copy, line by line so large MSAs don't have to fit into memory.
+    # Add the fasta header if it is missing (just use the name of the file) and get rid of stars and spaces in
+    # the sequence. No changes are needed for .a3m files
+    colab_args = normalize_input(
+        file_path, out_pathname, COLABFOLD_ARGS_LINE, None if file_path.suffix == ".a3m" else stem_name
+    )
+    if colab_args is None:
+        logging.warning(f"WARNING: {file_path} is an empty file!")
+        return None, None, None
+    colab_args, _ = split_priority(colab_args)  # only used by the scheduler
+
+    # keep the original input file (with arguments) as ".original", by renaming or linking it if possible
+    moved = keep_original(file_path, str(out_pathname)+".original", move=not dry_run)
 
-    if not dry_run:
+    if not dry_run and not moved:
         os.remove(file_path)
 
     return out_pathname, out_sub_folder, colab_args
 
 
+def skip_empty_file(fasta_path, args):
+    logging.info(f"Skipping {fasta_path} because it is empty")
+    # Rename the empty file to .empty to avoid further processing
+    os.rename(fasta_path, os.path.join(args.in_folder, os.path.basename(fasta_path) + ".empty"))
+
+
 def create_slurm_submit_line(file_name, slurm_options, colabfold_options):
     file_name = Path(file_name)
     # submit line is composed of: sbatch + slurm_args (config file),
@@ -76,21 +86,222 @@ def create_slurm_submit_line(file_name, slurm_options, colabfold_options):
     return f"""sbatch  {slurm} --wrap="{colabfold_options}" """
 
 
-def move_and_submit_fasta(fasta_path, args, dry_run=False):
+def route_slurm_args(predict_fasta, colabfold_arguments, args, routing=None):
+    """Returns slurm_args with the partition, gres and CPUs of the first matching route"""
+    if routing is None:
+        return args.slurm_args
+    features = job_features(predict_fasta, colabfold_arguments)
+    return routing.route(args.slurm_args, features, predict_fasta)
+
+
+def routed_partition(fasta_path, args, routing) -> str:
+    """Partition an input file will be routed to, for the in-flight limits"""
+    try:
+        colabfold_arguments = split_priority(read_input_args(fasta_path, COLABFOLD_ARGS_LINE) or "")[0]
+        return parse_partition(routing.route(args.slurm_args, job_features(fasta_path, colabfold_arguments)))
+    except OSError:  # removed in the meantime, admit drops it
+        return parse_partition(args.slurm_args)
+
+
+def estimate_time_limit(predict_fasta, colabfold_arguments, slurm_args, args, runtime_db):
+    """Returns (--time option or "", (settings, size) to record in the runtime database), or ("", None) without one"""
+    if runtime_db is None:
+        return "", None
+    runtime = settings_key(args.colabfold_path, colabfold_arguments, slurm_args), sum(
+        length ** 2 for length in query_lengths(predict_fasta)
+    )
+    return runtime_db.time_limit(slurm_args, [runtime]), runtime
+
+
+def create_colabfold_command(target_fasta, out_path_name, colabfold_arguments, args, msa_cache=None):
+    inputs, store_fasta = [target_fasta], None
+    msa_mode, pair_mode = parse_msa_settings(colabfold_arguments)
+    if msa_cache is not None and msa_mode in CACHEABLE_MSA_MODES and Path(target_fasta).suffix != ".a3m":
+        # queries with cached MSAs are predicted from .a3m inputs, the new MSAs are stored after the job
+        cache = msa_cache.with_msa_mode(msa_mode)
+        inputs, store_fasta = prepare_msa_inputs(target_fasta, Path(out_path_name) / "msa_cache_inputs", cache, pair_mode)
+
+    commands = [f"{args.colabfold_path} {colabfold_arguments} {input_path} {out_path_name}" for input_path in inputs]
+    if store_fasta is not None:
+        commands.append(create_store_command(args.msa_cache_dir, msa_mode, store_fasta, out_path_name))
+    return f"source {args.env_setup_script} && " + " && ".join(commands)
+
+
+def apply_cached_results(target_fasta, out_path_name, colabfold_arguments, result_cache=None):
+    """Links results of queries that were already predicted with the same arguments into out_path_name.
+    Returns (fasta with the queries that still have to be predicted or None, result cache for these arguments or None)
+    """
+    if result_cache is None or Path(target_fasta).suffix == ".a3m":
+        return target_fasta, None
+    cache = result_cache.with_arguments(colabfold_arguments)
+    misses_fasta = Path(out_path_name) / "result_cache_misses.fasta"
+    return apply_result_cache(target_fasta, out_path_name, cache, misses_fasta), cache
+
+
+@METRICS.timed("prepare_seconds")
+def prepare_fasta_job(fasta_path, args, runtime_db=None, routing=None, result_cache=None, msa_cache=None):
+    """Moves over the fasta file and creates its sbatch line.
+    Returns (sbatch line, result cache, fasta to predict, output folder, runtime, partition), or None if there is nothing
+    to submit
+    """
     # fast_path is a full path to a fasta file in ./in directory
     target_fasta, out_path_name, colabfold_arguments = move_over_fasta_file(
         fasta_path, out_folder=args.out_folder, dry_run=args.dry_run
     )
+    if target_fasta is None:
+        skip_empty_file(fasta_path, args)
+        return None
+
+    predict_fasta, result_cache = apply_cached_results(target_fasta, out_path_name, colabfold_arguments, result_cache)
+    if predict_fasta is None:
+        logging.info(f"All queries in {fasta_path} were predicted before, results linked to {out_path_name}")
+        return None
+
+    colabfold_command = create_colabfold_command(predict_fasta, out_path_name, colabfold_arguments, args, msa_cache)
+    slurm_args = route_slurm_args(predict_fasta, colabfold_arguments, args, routing)
+    time_limit, runtime = estimate_time_limit(predict_fasta, colabfold_arguments, slurm_args, args, runtime_db)
+
+    submit = create_slurm_submit_line(target_fasta, f"{slurm_args} {time_limit}", colabfold_command)
+    return submit, result_cache, predict_fasta, out_path_name, runtime, parse_partition(slurm_args)
+
+
+def submit_fasta_job(job, dry_run=False, journal=None, runtime_db=None, executor=SLURM) -> bool:
+    """Submits a prepared job. Returns False if sbatch failed"""
+    submit, result_cache, predict_fasta, out_path_name, runtime, _ = job
+    if not dry_run:
+        with METRICS.timer("sbatch_seconds"):
+            sbatch_output = executor.submit(submit)
+        if journal is not None:
+            journal.record(sbatch_output, Path(out_path_name).name, "af2slurm-watcher", predict_fasta, out_path_name)
+        if runtime_db is not None:
+            runtime_db.record(sbatch_output, *runtime)
+        slurm_id = parse_slurm_id(sbatch_output)
+        if slurm_id is None:
+            METRICS.inc("sbatch_failures_total")
+            logging.error(f"sbatch failed for {predict_fasta}: {sbatch_output}")
+            return False
+        logging.info(f"Submitted to {executor.name} with ID {slurm_id}")
+        METRICS.inc("submitted_jobs_total")
+        if result_cache is not None:
+            result_cache.register(predict_fasta, out_path_name)
+    else:
+        logging.info(submit)
+    return True
+
+
+def move_and_submit_fasta(
+    fasta_path, args, dry_run=False, journal=None, admission=None, runtime_db=None, executor=SLURM, routing=None,
+    result_cache=None, msa_cache=None,
+):
+    job = prepare_fasta_job(
+        fasta_path, args, runtime_db=runtime_db, routing=routing, result_cache=result_cache, msa_cache=msa_cache
+    )
+    if job is not None:
+        submit_with_admission(
+            admission,
+            lambda: submit_fasta_job(job, dry_run=dry_run, journal=journal, runtime_db=runtime_db, executor=executor),
+            fasta_path,
+            partition=job[5],
+        )
+
 
-    colabfold_command = f"source {args.env_setup_script} && {args.colabfold_path} {colabfold_arguments} {target_fasta} {out_path_name}"
+def create_slurm_array_submit_line(task_list, num_tasks, slurm_options):
+    task_list = Path(task_list)
+    # %A is the array job ID, %a the task index. Each task additionally writes its own .out next to its fasta
+    slurm = f"{slurm_options} --parsable --job-name={task_list.stem} --output={task_list.parent / task_list.stem}_%A_%a.out "
+    return f"export GROUP_SIZE=1; sbatch  {slurm} -a 1-{num_tasks} {ARRAY_WRAPPER_SCRIPT} {task_list}"
 
-    submit = create_slurm_submit_line(target_fasta, args.slurm_args, colabfold_command)
 
+def submit_fasta_batch(
+    submit, tasks, to_register, task_list, dry_run=False, journal=None, runtime_db=None, executor=SLURM
+) -> bool:
+    """Submits the array job of a task list. Returns False if sbatch failed"""
     if not dry_run:
-        slurm_id = subprocess.getoutput(submit)
-        logging.info(f"Submitted to slurm with ID {slurm_id}")
+        with METRICS.timer("sbatch_seconds"):
+            sbatch_output = executor.submit(submit)
+        slurm_id = parse_slurm_id(sbatch_output)
+        if slurm_id is None:
+            METRICS.inc("sbatch_failures_total")
+            logging.error(f"sbatch failed for {task_list}: {sbatch_output}")
+            if journal is not None:
+                journal.record(sbatch_output, Path(task_list).stem, "af2slurm-watcher", task_list, Path(task_list).parent)
+            return False
+        logging.info(f"Submitted {len(tasks)} files as {executor.name} array job with ID {slurm_id} (task list {task_list})")
+        METRICS.inc("submitted_jobs_total", len(tasks))
+        for result_cache, predict_fasta, out_path_name in to_register:
+            result_cache.register(predict_fasta, out_path_name)
     else:
+        slurm_id = "DRY_RUN"
         logging.info(submit)
+    for index, (fasta_path, _, predict_fasta, out_path_name, runtime, _) in enumerate(tasks, start=1):
+        logging.info(f"{fasta_path}: slurm array task {slurm_id}_{index}")
+        if journal is not None and not dry_run:
+            journal.record(slurm_id, Path(out_path_name).name, "af2slurm-watcher", predict_fasta, out_path_name, array_task=index)
+        if runtime_db is not None and not dry_run:
+            runtime_db.record(slurm_id, *runtime, array_task=index)
+    return True
+
+
+def move_and_submit_fasta_batch(
+    fasta_paths: List[str], args, dry_run=False, journal=None, admission=None, runtime_db=None, executor=SLURM,
+    routing=None, result_cache=None, msa_cache=None,
+):
+    """Moves over all fasta files and submits them as a single slurm array job (one task per file), or one array job
+    per route if they are routed to different resources.
+    The tasks are written to a task list in out_folder/batch_tasks, which is run by wrapper_slurm_array_job.sh
+    """
+    for start in range(0, len(fasta_paths), args.max_batch_size):
+        chunk = fasta_paths[start : start + args.max_batch_size]
+
+        tasks = []
+        to_register = []
+        for fasta_path in chunk:
+            target_fasta, out_path_name, colabfold_arguments = move_over_fasta_file(
+                fasta_path, out_folder=args.out_folder, dry_run=args.dry_run
+            )
+            if target_fasta is None:
+                skip_empty_file(fasta_path, args)
+                continue
+            predict_fasta, cache = apply_cached_results(target_fasta, out_path_name, colabfold_arguments, result_cache)
+            if predict_fasta is None:
+                logging.info(f"All queries in {fasta_path} were predicted before, results linked to {out_path_name}")
+                continue
+            if cache is not None:
+                to_register.append((cache, predict_fasta, out_path_name))
+            colabfold_command = create_colabfold_command(
+                predict_fasta, out_path_name, colabfold_arguments, args, msa_cache
+            )
+            # keep the per-file .out log like in the one-job-per-file mode
+            out_log = Path(target_fasta).with_suffix(".out")
+            slurm_args = route_slurm_args(predict_fasta, colabfold_arguments, args, routing)
+            runtime = estimate_time_limit(predict_fasta, colabfold_arguments, slurm_args, args, runtime_db)[1]
+            tasks.append((fasta_path, f"( {colabfold_command} ) > {out_log} 2>&1", predict_fasta, out_path_name, runtime, slurm_args))
+        if not tasks:
+            continue
+
+        routes = list(dict.fromkeys(task[5] for task in tasks))
+        for slurm_args in routes:
+            route_tasks = [task for task in tasks if task[5] == slurm_args]
+            route_fastas = {task[2] for task in route_tasks}
+            route_register = [register for register in to_register if register[1] in route_fastas]
+            # a new task list for every array job, the wrapper reads it only when each array task starts
+            task_list = create_unique_file(Path(args.out_folder) / "batch_tasks", "batch", ".tasks")
+            with open(task_list, "w") as f:
+                f.write("".join(f"{task[1]}\n" for task in route_tasks))
+
+            # all tasks of the array job get the time limit of the longest one
+            time_limit = "" if runtime_db is None else runtime_db.time_limit(slurm_args, [task[4] for task in route_tasks])
+            submit = create_slurm_array_submit_line(task_list, len(route_tasks), f"{slurm_args} {time_limit}")
+            submit_with_admission(
+                admission,
+                partial(
+                    submit_fasta_batch, submit, route_tasks, route_register, task_list,
+                    dry_run=dry_run, journal=journal, runtime_db=runtime_db, executor=executor,
+                ),
+                str(task_list),
+                n_jobs=len(route_tasks),
+                partition=parse_partition(slurm_args),
+            )
 
 
 def main():
@@ -113,11 +324,179 @@ def main():
     parser.add_argument("--out_folder", help="Directory to write results to", default="./out")
     parser.add_argument("--log_path_name", help="Directory to write results to", default="out.log")
     parser.add_argument("--scan_interval_s", help="Scan folder every X seconds", default=60, type=int)
+    parser.add_argument(
+        "--watch-mode",
+        help="poll: rescan in_folder every scan_interval_s. inotify: submit files as soon as they are written to in_folder "
+        "(still rescans every scan_interval_s; falls back to poll if inotify is not available)",
+        default="poll",
+        choices=["poll", "inotify"],
+    )
+    parser.add_argument(
+        "--stability_interval_s",
+        help="Files are only submitted once their size and modification time did not change between two scans. "
+        "While files are still being written, the folder is rescanned every X seconds",
+        default=5,
+        type=float,
+    )
+    parser.add_argument(
+        "--batch_submit",
+        help="Submit all files found in one scan as a single slurm array job instead of one job per file",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch_window_s",
+        help="With batch_submit, keep collecting new files for X seconds after the first one was found",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        help="With batch_submit, put at most X files into one array job (should not exceed slurm's MaxArraySize)",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "--pipeline",
+        help="Prepare files and submit jobs concurrently instead of one file after the other "
+        "(not used together with batch_submit)",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument("--prepare_workers", help="With pipeline, prepare up to X files at the same time", default=4, type=int)
+    parser.add_argument(
+        "--max_concurrent_submits", help="With pipeline, run up to X sbatch commands at the same time", default=4, type=int
+    )
+    parser.add_argument(
+        "--schedule",
+        help="Order in which found files are submitted: name (alphabetical), fifo (oldest first) or sjf (fewest "
+        "residues first). A priority=N token in the first # line of a file goes first (higher N first, default 0)",
+        default="name",
+        choices=POLICIES,
+    )
+    parser.add_argument(
+        "--fair_share",
+        help="Let the owners of the input files take turns, the one who submitted the fewest residues recently first",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fair_share_half_life_s", help="With fair_share, usage counts half after X seconds", default=3600, type=float
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        help="Keep at most X of our jobs pending or running in the partition of slurm_args (e.g. 200), or per partition "
+        "(e.g. gpu=200,amd=1000). Files over the limit wait in a backlog. Leave empty for no limit",
+        default="",
+    )
+    parser.add_argument(
+        "--retry_backoff_s",
+        help="Retry a failed sbatch after X seconds, doubling the wait after every failed attempt",
+        default=30,
+        type=float,
+    )
+    parser.add_argument("--max_retry_backoff_s", help="Wait at most X seconds between retries", default=1800, type=float)
+    parser.add_argument(
+        "--multi_instance",
+        help="Several watchers serve the same in_folder: every file is claimed (atomically moved to in_folder/.claimed) "
+        "before it is processed, so it is submitted only once",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--instance_name", help="With multi_instance, name of this watcher. Leave empty to use hostname-pid", default=""
+    )
+    parser.add_argument(
+        "--lease_timeout_s",
+        help="With multi_instance, files claimed by a watcher that has not renewed its lease for X seconds "
+        "(because it crashed) are moved back to in_folder",
+        default=600,
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics_file",
+        help="Write per-stage metrics (scan, prepare and sbatch times, failures, backlog) in the Prometheus text format "
+        "to this file after every scan, e.g. for the node_exporter textfile collector. Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--metrics_port", help="Serve the metrics on http://127.0.0.1:X/metrics. 0 to disable", default=0, type=int
+    )
+    parser.add_argument(
+        "--profile", help="Profile the watcher with cProfile and dump the stats to this file. Leave empty to disable", default=""
+    )
+    parser.add_argument("--profile_interval_s", help="With profile, dump the stats every X seconds", default=600, type=float)
+    parser.add_argument(
+        "--job_journal",
+        help="Record all submitted jobs in this sqlite file and track their state (see job_journal.py status). "
+        "Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--journal_refresh_s", help="Refresh the state of the jobs in the journal every X seconds", default=60, type=float
+    )
+    parser.add_argument(
+        "--compact_results",
+        help="Pack the output folder of every completed job in the job journal into <folder>.outputs.zip "
+        "(see result_archive.py). Requires job_journal",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compact_budget_s",
+        help="Stop compacting after X seconds per journal refresh, so the watcher does not stall on a backlog of "
+        "folders. The remaining folders are compacted at the next refreshes",
+        default=10,
+        type=float,
+    )
+    parser.add_argument(
+        "--runtime_db",
+        help="Record the runtime of every finished job in this sqlite file and set sbatch --time from the runtimes of "
+        "earlier jobs with the same settings, so the jobs can be backfilled (see runtime_db.py show). "
+        "Not used if slurm_args already set --time. Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--time_margin", help="With runtime_db, set --time to X times the estimated runtime", default=1.5, type=float
+    )
+    parser.add_argument(
+        "--time_padding_s", help="With runtime_db, add X seconds to the time limit", default=600, type=float
+    )
+    parser.add_argument(
+        "--runtime_harvest_s", help="With runtime_db, look up the runtimes of finished jobs every X seconds", default=600, type=float
+    )
+    parser.add_argument(
+        "--route",
+        help="Routing rule like 'residues<=400 chains=1 -> --partition=gpu-short --gres=gpu:1'. The slurm options of the "
+        "first rule that matches a job replace those in slurm_args. Conditions on residues, chains, total_residues, "
+        "queries, msa_mode, pair_mode and model_type. Can be given several times (route = [rule, rule] in the config)",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--msa_cache_dir",
+        help="Reuse MSAs of chains that were already predicted from this directory and add new MSAs to it. "
+        "Leave empty to disable. Complexes are only taken from the cache with --pair-mode unpaired",
+        default="",
+    )
+    parser.add_argument(
+        "--result_cache_dir",
+        help="Keep an index of predictions in this directory and link existing results instead of predicting the same "
+        "sequences with the same arguments again. Leave empty to disable",
+        default="",
+    )
     parser.add_argument(
         "--colabfold_path",
         help="find path to the colabfold",
         default="/home/aljubetic/AF2/CF2.3/colabfold-conda/bin/colabfold_batch ",
     )
+    parser.add_argument(
+        "--executor",
+        help="Run the jobs with slurm, or in a pool of local_workers processes on this host (see executors.py)",
+        default="slurm",
+        choices=EXECUTORS,
+    )
+    parser.add_argument("--local_workers", help="With executor local, run up to X jobs at the same time", default=1, type=int)
     parser.add_argument(
         "--slurm_args",
         help="arguments for slurm",
@@ -129,6 +508,12 @@ def main():
         default="/home/aljubetic/bin/set_up_AF2.3.sh",
     )
     args = parser.parse_args()
+    try:
+        routing = RoutingTable(args.route) if args.route else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.compact_results and not args.job_journal:
+        parser.error("compact_results requires job_journal")
 
     logging.basicConfig(
         #encoding="utf-8",
@@ -139,17 +524,119 @@ def main():
 
     logging.info("Running af2slurm watcher with arguments: " + str(args))
 
-    while True:
-        # moves files to the output folder and submit them to slurm
-        extensions = [".fasta", ".a3m", ".fasta.txt"]
-        fastas = sorted([f for ext in extensions for f in glob(f"{args.in_folder}/*{ext}")])
-        for fasta in fastas:
-            logging.info(f"Submitting file: {fasta}")
-            move_and_submit_fasta(fasta, args, dry_run=args.dry_run)
-        if args.dry_run:
-            # only execute loop once if we are doing a dry run
-            break
-        sleep(args.scan_interval_s)  # continuous scanning of the input folder for fasta files
+    exporter = MetricsExporter(args, "af2slurm")
+    journal = JobJournal(args.job_journal) if args.job_journal else None
+    executor = create_executor(args.executor, args.local_workers, journal)
+    last_journal_refresh = 0
+    runtime_db = None
+    if args.runtime_db:
+        runtime_db = RuntimeDB(args.runtime_db, margin=args.time_margin, padding_s=args.time_padding_s)
+        runtime_db.harvest()
+    last_runtime_harvest = time.time()
+    # one index connection for all inputs, the arguments of each input select its entries
+    result_cache = ResultCache(args.result_cache_dir, args.colabfold_path) if args.result_cache_dir else None
+    # the same for the MSA cache, the msa mode of each input selects its MSAs
+    msa_cache = MSACache(args.msa_cache_dir, CACHEABLE_MSA_MODES[0]) if args.msa_cache_dir else None
+
+    extensions = [".fasta", ".a3m", ".fasta.txt"]
+    partition = parse_partition(args.slurm_args)
+    admission = AdmissionControl(
+        parse_in_flight_limits(args.max_in_flight, partition),
+        partition,
+        retry_backoff_s=args.retry_backoff_s,
+        max_retry_backoff_s=args.max_retry_backoff_s,
+        scheduler=Scheduler(args.schedule, args.fair_share, args.fair_share_half_life_s),
+    )
+
+    claims = None
+    if args.multi_instance and not args.dry_run:  # a dry run does not remove the input files, so it can't claim them
+        claims = ClaimDirectory(args.in_folder, args.instance_name, args.lease_timeout_s)
+        logging.info(f"Claiming files as {claims.instance}")
+
+    watcher = create_folder_watcher(args.in_folder, args.watch_mode)
+    # in a dry run the loop only runs once, so don't wait for the files to be stable
+    scanner = FolderScanner(args.in_folder, extensions, wait_for_stable=not args.dry_run)
+    fastas = scanner.scan()
+    try:
+        while True:
+            loop_start = time.perf_counter()
+            if args.batch_submit and fastas:
+                # collect files arriving within the batch window into the same array job
+                window_end = time.time() + args.batch_window_s
+                while not args.dry_run and time.time() < window_end:
+                    remaining_s = window_end - time.time()
+                    fastas += [f for f in wait_for_files(watcher, scanner, remaining_s, args.stability_interval_s) if f not in fastas]
+            # one squeue call per scan, then submit the oldest files as far as the in-flight limit allows
+            admission.refresh()
+            admission.run_due_retries()
+            fastas = admission.admit(
+                fastas, partition_of=None if routing is None else lambda fasta: routed_partition(fasta, args, routing)
+            )
+            if claims is not None:
+                # only process the files this watcher managed to claim
+                fastas = claims.claim_all(fastas)
+            # moves files to the output folder and submit them to slurm
+            if args.batch_submit and fastas:
+                logging.info(f"Submitting {len(fastas)} files as one batch: {fastas}")
+                move_and_submit_fasta_batch(
+                    fastas, args, dry_run=args.dry_run, journal=journal, admission=admission, runtime_db=runtime_db,
+                    executor=executor, routing=routing, result_cache=result_cache, msa_cache=msa_cache,
+                )
+                fastas = []
+            elif args.pipeline and fastas:
+                logging.info(f"Submitting {len(fastas)} files: {fastas}")
+                run_pipeline(
+                    fastas,
+                    lambda fasta: prepare_fasta_job(
+                        fasta, args, runtime_db=runtime_db, routing=routing, result_cache=result_cache,
+                        msa_cache=msa_cache,
+                    ),
+                    lambda job: submit_with_admission(
+                        admission,
+                        lambda: submit_fasta_job(
+                            job, dry_run=args.dry_run, journal=journal, runtime_db=runtime_db, executor=executor
+                        ),
+                        job[2],
+                        partition=job[5],
+                    ),
+                    args.prepare_workers,
+                    args.max_concurrent_submits,
+                )
+                fastas = []
+            for fasta in fastas:
+                logging.info(f"Submitting file: {fasta}")
+                move_and_submit_fasta(
+                    fasta, args, dry_run=args.dry_run, journal=journal, admission=admission, runtime_db=runtime_db,
+                    executor=executor, routing=routing, result_cache=result_cache, msa_cache=msa_cache,
+                )
+            if claims is not None:
+                # claimed files that are still there could not be processed, the error is in the log
+                claims.reject_unprocessed()
+            METRICS.observe("loop_seconds", time.perf_counter() - loop_start)
+            exporter.export(final=args.dry_run)
+            if args.dry_run:
+                # only execute loop once if we are doing a dry run
+                break
+            if journal is not None and time.time() - last_journal_refresh > args.journal_refresh_s:
+                journal.refresh()  # one squeue/sacct call for all open jobs
+                last_journal_refresh = time.time()
+                if args.compact_results:
+                    compact_completed(args.job_journal, args.compact_budget_s)
+            if runtime_db is not None and time.time() - last_runtime_harvest > args.runtime_harvest_s:
+                runtime_db.harvest()  # one sacct call for all jobs that have not finished yet
+                last_runtime_harvest = time.time()
+            if claims is not None:
+                claims.reclaim_expired()
+            # continuous scanning of the input folder for fasta files (or waiting for inotify events)
+            fastas = wait_for_files(watcher, scanner, args.scan_interval_s, args.stability_interval_s)
+    finally:
+        executor.close()  # waits for the jobs of the local executor
+        if journal is not None and executor is not SLURM:
+            journal.refresh()  # the final states of the local jobs
+        if result_cache is not None:
+            result_cache.close()
+        if msa_cache is not None:
+            msa_cache.close()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,38 @@
 #!python
 from configargparse import ArgParser, ArgumentDefaultsHelpFormatter
-import subprocess
-from time import sleep
-from glob import glob
 import os
-import shutil
+from functools import partial
 from pathlib import Path
 import re
 import logging
-from typing import Tuple
+import shlex
+import time
+from typing import List, Tuple
+from job_journal import JobJournal, parse_slurm_id
+from partition_routing import RoutingTable, job_features
+from result_archive import compact_completed
+from executors import EXECUTORS, SLURM, create_executor
+from runtime_db import RuntimeDB, query_lengths, settings_key
+from scheduling import POLICIES, Scheduler, split_priority
+from vector_catalogue import VectorCatalogue
+from watcher_metrics import METRICS, MetricsExporter
+from watcher_utils import (
+    AdmissionControl,
+    ClaimDirectory,
+    FolderScanner,
+    create_folder_watcher,
+    create_unique_file,
+    keep_original,
+    normalize_input,
+    parse_in_flight_limits,
+    parse_partition,
+    read_input_args,
+    run_pipeline,
+    submit_with_admission,
+    wait_for_files,
+)
+
+DOM_ARGS_LINE = re.compile(r"^\s*#\s*")
 
 
 def copy_protein_files(in_path: str, out_folder: str, dry_run: bool = False) -> list:
@@ -28,73 +52,217 @@ def copy_protein_files(in_path: str, out_folder: str, dry_run: bool = False) ->
 
     os.makedirs(out_subfolder, exist_ok=True)
 
-    #copy original input file (with arguments) and add ".original"
-    shutil.copy(in_path, str(out_path)+".original")
-
-    # Extract colab_args
-    with open(in_path, "r") as source_file:
-        # skip empty lines at the start of the file
-        lines = source_file.read()
-        lines = lines.lstrip(" \n").splitlines()
-        if len(lines) == 0:
-            logging.warning(f"WARNING: {in_path} is an empty file!")
-            return None, None, None
-        first_line = lines[0].strip()
-
-        match_colabfold_args_line = re.compile(r"^\s*#\s*")
-        if match_colabfold_args_line.match(first_line):  # if the first line matches the pattern
-            dom_args = first_line.lstrip(
-                "#"
-            ).strip()  # Remove only the # symbol from the beginning of the line
-            del lines[0]  # Remove the first line from the list
-        else:
-            dom_args = "" # This should never happen -- vector.gb file is mandatory!
-            logging.warning(f"WARNING: {in_path} does not contain # vector.gb! This is not allowed. Please add arguments to the first line of the file.")
-
-    # add fasta header if it is missing. Just use the name of the file. DO NOT DO THIS ON .pdb files
-    if lines[0][0] != ">" and in_path.suffix != ".pdb" and in_path.suffix != ".PDB":
-        lines.insert(0, ">" + stem_name)
-
-    def filter_stars_spaces(line):
-        if len(line)>0 and line[0] == ">":  # if fasta header, don't do any replacements
-            return line
-        # get rid of stars and spaces in the sequence
-        return line.replace("*", "").replace(" ", "")
+    # Change out extension to lowercase
+    out_parsed_path = out_path.with_suffix(out_path.suffix.lower())
 
-    if in_path.suffix != ".pdb" and in_path.suffix != ".PDB":  # I don't think .a3m is supported by domesticator?
-        lines = [filter_stars_spaces(l) for l in lines]
+    # Extract dom_args and write the cleaned up copy, line by line so large files don't have to fit into memory.
+    # Add the fasta header if it is missing (just use the name of the file) and get rid of stars and spaces in
+    # the sequence. DO NOT DO THIS ON .pdb files
+    is_pdb = in_path.suffix in [".pdb", ".PDB"]
+    dom_args = normalize_input(in_path, out_parsed_path, DOM_ARGS_LINE, None if is_pdb else stem_name)
+    if dom_args is None:
+        logging.warning(f"WARNING: {in_path} is an empty file!")
+        return None, None, None
+    dom_args, _ = split_priority(dom_args)  # only used by the scheduler
+    if not dom_args:
+        # This should never happen -- vector.gb file is mandatory!
+        logging.warning(f"WARNING: {in_path} does not contain # vector.gb! This is not allowed. Please add arguments to the first line of the file.")
 
-    # Change out extension to lowercase
-    out_path = out_path.with_suffix(out_path.suffix.lower())
+    # keep the original input file (with arguments) as ".original", by renaming or linking it if possible
+    moved = keep_original(in_path, str(out_path)+".original", move=not dry_run)
 
-    with open(out_path, "w+") as target_file:
-        target_file.write("\n".join(lines))
-    
-    if not dry_run:
+    if not dry_run and not moved:
         os.remove(in_path)
         
-    return out_path, out_subfolder, dom_args
+    return out_parsed_path, out_subfolder, dom_args
 
     
-def create_slurm_submit_line(protein_path, slurm_options, domesticator_command):
+def create_slurm_submit_line(protein_path, slurm_options, domesticator_command, work_dir):
     protein_path = Path(protein_path) # only used to name the job
     # submit line is composed of: sbatch + slurm_args (config file),
-    slurm = f"{slurm_options} --parsable --job-name={protein_path.stem} --output={protein_path.with_suffix('.out')} -e {protein_path.with_suffix('.out')} "
+    # Domesticator does not have an --out param, so the job is run in the output folder (--chdir)
+    slurm = f"{slurm_options} --parsable --chdir={work_dir} --job-name={protein_path.stem} --output={protein_path.with_suffix('.out')} -e {protein_path.with_suffix('.out')} "
     return f"""sbatch  {slurm} --wrap="{domesticator_command}" """
 
-def submit_job(protein_path, args, dom_args, dry_run=False):
+def create_domesticator_command(protein_path, args, dom_args):
     # Vector filename is first argument in dom_args; we precede it with the path to the vectors folder
+    return f"{args.colabfold_path} '{protein_path}' {args.vectors_folder}/{dom_args} --no_idt"
+
+
+def submit_job(
+    protein_path, args, dom_args, out_folder, dry_run=False, journal=None, runtime_db=None, slurm_args=None, executor=SLURM
+) -> bool:
+    """Submits domesticator for protein_path, with slurm_args (default: the slurm_args option) if it was routed.
+    Returns False if sbatch failed
+    """
+    slurm_args = args.slurm_args if slurm_args is None else slurm_args
+    dom_command = f"source {args.env_setup_script} && {create_domesticator_command(protein_path, args, dom_args)}"
 
-    dom_command = f"source {args.env_setup_script} && {args.colabfold_path} '{protein_path}' {args.vectors_folder}/{dom_args} --no_idt"
+    # the runtime of domesticator grows with the number of residues to back-translate
+    time_limit, runtime = "", None
+    if runtime_db is not None:
+        runtime = settings_key(args.colabfold_path, dom_args, slurm_args), sum(query_lengths(protein_path))
+        time_limit = runtime_db.time_limit(slurm_args, [runtime])
 
-    submit = create_slurm_submit_line(protein_path, args.slurm_args, dom_command)
+    submit = create_slurm_submit_line(protein_path, f"{slurm_args} {time_limit}", dom_command, out_folder)
 
     if not dry_run:
-        slurm_id = subprocess.getoutput(submit)
-        logging.info(f"Submitted to slurm with ID {slurm_id}")
+        with METRICS.timer("sbatch_seconds"):
+            sbatch_output = executor.submit(submit)
+        if journal is not None:
+            journal.record(sbatch_output, Path(protein_path).stem, "dom2slurm-watcher", protein_path, out_folder)
+        if runtime_db is not None:
+            runtime_db.record(sbatch_output, *runtime)
+        slurm_id = parse_slurm_id(sbatch_output)
+        if slurm_id is None:
+            METRICS.inc("sbatch_failures_total")
+            logging.error(f"sbatch failed for {protein_path}: {sbatch_output}")
+            return False
+        logging.info(f"Submitted to {executor.name} with ID {slurm_id}")
+        METRICS.inc("submitted_jobs_total")
     else:
         logging.info(submit)
-    
+    return True
+
+
+def reject_input(path, args, reason):
+    """Renames an input that can't be submitted to .error and writes the reason next to it (.error.txt)"""
+    METRICS.inc("rejected_inputs_total")
+    logging.error(f"Rejecting {path}: {reason}")
+    if args.dry_run:
+        return
+    error_path = os.path.join(args.in_folder, os.path.basename(path) + ".error")
+    os.rename(path, error_path)
+    with open(error_path + ".txt", "w") as f:
+        f.write(f"{reason}\nFix the input and rename {os.path.basename(error_path)} back to {os.path.basename(path)}\n")
+
+
+def routed_partition(fasta, args, routing) -> str:
+    """Partition an input file will be routed to, for the in-flight limits"""
+    try:
+        return parse_partition(routing.route(args.slurm_args, job_features(fasta)))
+    except OSError:  # removed in the meantime, admit drops it
+        return parse_partition(args.slurm_args)
+
+
+@METRICS.timed("prepare_seconds")
+def prepare_protein_job(fasta, args, vectors=None, routing=None):
+    """Checks the vector, copies over the protein file and routes it.
+    Returns (protein path, output folder, dom_args, slurm_args) or None if the file is empty or was rejected
+    """
+    if vectors is not None:
+        # reject inputs with a wrong vector now instead of after the job queued and started
+        dom_args = read_input_args(fasta, DOM_ARGS_LINE)
+        error = None if dom_args is None else vectors.validate(split_priority(dom_args)[0])
+        if error is not None:
+            reject_input(fasta, args, error)
+            return None
+
+    out_protein, out_folder, dom_args = copy_protein_files(fasta, args.out_folder, dry_run=args.dry_run)
+
+    if (out_protein, out_folder, dom_args) == (None, None, None):
+        logging.info(f"Skipping {fasta} because it is empty")
+        # Rename the empty file to .empty to avoid further processing
+        os.rename(fasta, os.path.join(args.in_folder, os.path.basename(fasta) + ".empty"))
+        return None
+    slurm_args = args.slurm_args
+    if routing is not None:
+        slurm_args = routing.route(args.slurm_args, job_features(out_protein), out_protein)
+    return out_protein, out_folder, dom_args, slurm_args
+
+
+def write_coalesced_script(script_path, jobs, args):
+    """Writes a job script that sources env_setup_script once and then runs domesticator for all jobs, each in its own
+    output folder and with its own .out log, up to coalesce_workers at the same time
+    """
+    failed = shlex.quote(str(Path(script_path).with_suffix(".failed")))
+    lines = ["#!/bin/bash", f"source {args.env_setup_script}", f"rm -f {failed}"]
+    for out_protein, out_folder, dom_args, _ in jobs:
+        out_log = shlex.quote(str(Path(out_protein).with_suffix(".out")))
+        run = (
+            f"( cd {shlex.quote(str(out_folder))} && {create_domesticator_command(out_protein, args, dom_args)} ) > {out_log} 2>&1"
+            f" || echo {shlex.quote(str(out_protein))} >> {failed}"
+        )
+        if args.coalesce_workers > 1:
+            lines.append(f"{{ {run}; }} &")
+            lines.append(f'while [ "$(jobs -rp | wc -l)" -ge {args.coalesce_workers} ]; do wait -n; done')
+        else:
+            lines.append(run)
+    lines.append("wait")
+    lines.append(f"[ ! -s {failed} ]  # fail the job if any input failed")
+    with open(script_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def submit_coalesced_job(
+    script_path, jobs, args, slurm_args, dry_run=False, journal=None, runtime_db=None, executor=SLURM
+) -> bool:
+    """Submits a coalesced job script. Returns False if sbatch failed"""
+    script_path = Path(script_path)
+    time_limit, runtime = "", None
+    if runtime_db is not None:
+        # the runtime is estimated per number of workers, from the residues of all inputs together
+        runtime = settings_key(args.colabfold_path, f"--coalesce-workers {args.coalesce_workers}", slurm_args), sum(
+            sum(query_lengths(job[0])) for job in jobs
+        )
+        time_limit = runtime_db.time_limit(slurm_args, [runtime])
+    out_log = script_path.with_suffix(".out")
+    submit = f"sbatch  {slurm_args} {time_limit} --parsable --job-name={script_path.stem} --output={out_log} -e {out_log} {script_path}"
+
+    if not dry_run:
+        with METRICS.timer("sbatch_seconds"):
+            sbatch_output = executor.submit(submit)
+        if journal is not None:
+            # one row per input, with the output folder it writes (not the folder of the job scripts)
+            for out_protein, out_folder, _, _ in jobs:
+                journal.record(
+                    sbatch_output, Path(out_protein).stem, "dom2slurm-watcher", out_protein, out_folder,
+                    member=Path(out_folder).name,
+                )
+        if runtime_db is not None:
+            runtime_db.record(sbatch_output, *runtime)
+        slurm_id = parse_slurm_id(sbatch_output)
+        if slurm_id is None:
+            METRICS.inc("sbatch_failures_total")
+            logging.error(f"sbatch failed for {script_path}: {sbatch_output}")
+            return False
+        logging.info(f"Submitted {len(jobs)} files as one {executor.name} job with ID {slurm_id} ({script_path})")
+        METRICS.inc("submitted_jobs_total")
+    else:
+        logging.info(submit)
+    return True
+
+
+def coalesce_and_submit(
+    protein_paths: List[str], args, dry_run=False, journal=None, admission=None, runtime_db=None, vectors=None,
+    executor=SLURM, routing=None,
+):
+    """Copies over all protein files and submits them as jobs of up to max_coalesce_size files (one per route), which
+    only start the environment once. The job scripts are written to out_folder/coalesced_jobs
+    """
+    jobs = [job for job in (prepare_protein_job(path, args, vectors=vectors, routing=routing) for path in protein_paths) if job is not None]
+    if not jobs:
+        return
+    script_folder = Path(args.out_folder).resolve() / "coalesced_jobs"
+    for slurm_args in dict.fromkeys(job[3] for job in jobs):
+        route_jobs = [job for job in jobs if job[3] == slurm_args]
+        for start in range(0, len(route_jobs), args.max_coalesce_size):
+            chunk = route_jobs[start : start + args.max_coalesce_size]
+            # the .failed marker and the log are named after the script, so every job gets a new one
+            script_path = create_unique_file(script_folder, "coalesced", ".sh")
+            write_coalesced_script(script_path, chunk, args)
+            for job in chunk:
+                logging.info(f"{job[0]}: coalesced into {script_path}")
+            submit_with_admission(
+                admission,
+                partial(
+                    submit_coalesced_job, script_path, chunk, args, slurm_args,
+                    dry_run=dry_run, journal=journal, runtime_db=runtime_db, executor=executor,
+                ),
+                script_path,
+                partition=parse_partition(slurm_args),
+            )
+
 
 def main():
     parser = ArgParser(
@@ -116,12 +284,178 @@ def main():
     parser.add_argument("--out_folder", help="Directory to write results to", default="./out")
     parser.add_argument("--log_path_name", help="Filename path to write the log to", default="out.log")
     parser.add_argument("--scan_interval_s", help="Scan folder every X seconds", default=60, type=int)
+    parser.add_argument(
+        "--watch-mode",
+        help="poll: rescan in_folder every scan_interval_s. inotify: submit files as soon as they are written to in_folder "
+        "(still rescans every scan_interval_s; falls back to poll if inotify is not available)",
+        default="poll",
+        choices=["poll", "inotify"],
+    )
+    parser.add_argument(
+        "--stability_interval_s",
+        help="Files are only submitted once their size and modification time did not change between two scans. "
+        "While files are still being written, the folder is rescanned every X seconds",
+        default=5,
+        type=float,
+    )
+    parser.add_argument(
+        "--coalesce",
+        help="Run several files in one slurm job, which sources env_setup_script and starts domesticator's environment "
+        "only once, instead of one job per file",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--coalesce_window_s",
+        help="With coalesce, keep collecting new files for X seconds after the first one was found",
+        default=0,
+        type=float,
+    )
+    parser.add_argument("--max_coalesce_size", help="With coalesce, put at most X files into one job", default=50, type=int)
+    parser.add_argument(
+        "--coalesce_workers",
+        help="With coalesce, run domesticator for up to X files of a job at the same time (request as many CPUs in slurm_args)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--pipeline",
+        help="Prepare files and submit jobs concurrently instead of one file after the other "
+        "(not used together with coalesce)",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument("--prepare_workers", help="With pipeline, prepare up to X files at the same time", default=4, type=int)
+    parser.add_argument(
+        "--max_concurrent_submits", help="With pipeline, run up to X sbatch commands at the same time", default=4, type=int
+    )
+    parser.add_argument(
+        "--schedule",
+        help="Order in which found files are submitted: name (alphabetical), fifo (oldest first) or sjf (fewest "
+        "residues first). A priority=N token in the first # line of a file goes first (higher N first, default 0)",
+        default="name",
+        choices=POLICIES,
+    )
+    parser.add_argument(
+        "--fair_share",
+        help="Let the owners of the input files take turns, the one who submitted the fewest residues recently first",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fair_share_half_life_s", help="With fair_share, usage counts half after X seconds", default=3600, type=float
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        help="Keep at most X of our jobs pending or running in the partition of slurm_args (e.g. 200), or per partition "
+        "(e.g. amd=1000,intel=500). Files over the limit wait in a backlog. Leave empty for no limit",
+        default="",
+    )
+    parser.add_argument(
+        "--retry_backoff_s",
+        help="Retry a failed sbatch after X seconds, doubling the wait after every failed attempt",
+        default=30,
+        type=float,
+    )
+    parser.add_argument("--max_retry_backoff_s", help="Wait at most X seconds between retries", default=1800, type=float)
+    parser.add_argument(
+        "--multi_instance",
+        help="Several watchers serve the same in_folder: every file is claimed (atomically moved to in_folder/.claimed) "
+        "before it is processed, so it is submitted only once",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--instance_name", help="With multi_instance, name of this watcher. Leave empty to use hostname-pid", default=""
+    )
+    parser.add_argument(
+        "--lease_timeout_s",
+        help="With multi_instance, files claimed by a watcher that has not renewed its lease for X seconds "
+        "(because it crashed) are moved back to in_folder",
+        default=600,
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics_file",
+        help="Write per-stage metrics (scan, prepare and sbatch times, failures, backlog) in the Prometheus text format "
+        "to this file after every scan, e.g. for the node_exporter textfile collector. Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--metrics_port", help="Serve the metrics on http://127.0.0.1:X/metrics. 0 to disable", default=0, type=int
+    )
+    parser.add_argument(
+        "--profile", help="Profile the watcher with cProfile and dump the stats to this file. Leave empty to disable", default=""
+    )
+    parser.add_argument("--profile_interval_s", help="With profile, dump the stats every X seconds", default=600, type=float)
+    parser.add_argument(
+        "--job_journal",
+        help="Record all submitted jobs in this sqlite file and track their state (see job_journal.py status). "
+        "Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--journal_refresh_s", help="Refresh the state of the jobs in the journal every X seconds", default=60, type=float
+    )
+    parser.add_argument(
+        "--compact_results",
+        help="Pack the output folder of every completed job in the job journal into <folder>.outputs.zip "
+        "(see result_archive.py). Requires job_journal",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compact_budget_s",
+        help="Stop compacting after X seconds per journal refresh, so the watcher does not stall on a backlog of "
+        "folders. The remaining folders are compacted at the next refreshes",
+        default=10,
+        type=float,
+    )
+    parser.add_argument(
+        "--runtime_db",
+        help="Record the runtime of every finished job in this sqlite file and set sbatch --time from the runtimes of "
+        "earlier jobs with the same settings, so the jobs can be backfilled (see runtime_db.py show). "
+        "Not used if slurm_args already set --time. Leave empty to disable",
+        default="",
+    )
+    parser.add_argument(
+        "--time_margin", help="With runtime_db, set --time to X times the estimated runtime", default=1.5, type=float
+    )
+    parser.add_argument(
+        "--time_padding_s", help="With runtime_db, add X seconds to the time limit", default=600, type=float
+    )
+    parser.add_argument(
+        "--runtime_harvest_s", help="With runtime_db, look up the runtimes of finished jobs every X seconds", default=600, type=float
+    )
+    parser.add_argument(
+        "--route",
+        help="Routing rule like 'residues<=300 -> --partition=short --cpus-per-task=1'. The slurm options of the first "
+        "rule that matches a job replace those in slurm_args. Conditions on residues, chains, total_residues and "
+        "queries. Can be given several times (route = [rule, rule] in the config)",
+        action="append",
+        default=[],
+    )
     parser.add_argument("--vectors_folder", help="Directory with vector.gb files", default="./vectors")
+    parser.add_argument(
+        "--vector_validation",
+        help="Check that the vector of an input is a valid GenBank file in vectors_folder before submitting it. "
+        "Inputs with a wrong vector are renamed to .error, with the reason in .error.txt. Skipped while vectors_folder "
+        "does not exist (e.g. if it is only available on the compute nodes)",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "--colabfold_path",
         help="find path to the colabfold",
         default="/home/aljubetic/conda/envs/domesticator/bin/python /home/aljubetic/gits/domesticator3/domesticator3 ",
     )
+    parser.add_argument(
+        "--executor",
+        help="Run the jobs with slurm, or in a pool of local_workers processes on this host (see executors.py)",
+        default="slurm",
+        choices=EXECUTORS,
+    )
+    parser.add_argument("--local_workers", help="With executor local, run up to X jobs at the same time", default=1, type=int)
     parser.add_argument(
         "--slurm_args",
         help="arguments for slurm",
@@ -133,6 +467,12 @@ def main():
         default="/home/aljubetic/bin/setup_proxy_settings.sh",
     )
     args = parser.parse_args()
+    try:
+        routing = RoutingTable(args.route) if args.route else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.compact_results and not args.job_journal:
+        parser.error("compact_results requires job_journal")
 
     logging.basicConfig(
         #encoding="utf-8",
@@ -141,37 +481,129 @@ def main():
         handlers=[logging.FileHandler(args.log_path_name), logging.StreamHandler()],
     )
 
-    # Because Domesticator does not support /out folder, change potentially rel /in path to abs path, then change pwd to to the specified out_folder
+    # Because Domesticator does not support /out folder, change potentially rel /in path to abs path, the jobs are then run in (--chdir) the specified out_folder
     args.in_folder = str(Path(args.in_folder).resolve())
     args.out_folder = str(Path(args.out_folder).resolve()) # change out folder as well, in case we refer to it at a later point in time
     args.vectors_folder = str(Path(args.vectors_folder).resolve()) # is without trailing slash
-    starting_cwd = os.getcwd()
 
     logging.info("Running dom2slurm watcher with arguments: " + str(args))
 
-    while True:
-        # moves files to the output folder and submit them to slurm
-        extensions_prot = [".fasta", ".pdb", ".fasta.txt", ".FASTA", ".PDB"]
-        fastas = sorted([f for ext in extensions_prot for f in glob(f"{args.in_folder}/*{ext}")])
-        for fasta in fastas:
-            logging.info(f'Submitting protein file: "{fasta}"')
-            out_protein, out_folder, dom_args = copy_protein_files(fasta, args.out_folder, dry_run=args.dry_run)
-
-            if (out_protein, out_folder, dom_args) == (None, None, None):
-                logging.info(f"Skipping {fasta} because it is empty")
-                # Rename the empty file to .empty to avoid further processing
-                os.rename(fasta, fasta+".empty")    
-                continue
-
-            # Wokaround for Domesticator not having --out param 
-            os.chdir(out_folder)
-            submit_job(out_protein, args, dom_args, dry_run=args.dry_run)
-            os.chdir(starting_cwd)
-
-        if args.dry_run:
-            # only execute loop once if we are doing a dry run
-            break
-        sleep(args.scan_interval_s)  # continuous scanning of the input folder for fasta files
+    exporter = MetricsExporter(args, "dom2slurm")
+    journal = JobJournal(args.job_journal) if args.job_journal else None
+    executor = create_executor(args.executor, args.local_workers, journal)
+    last_journal_refresh = 0
+    runtime_db = None
+    if args.runtime_db:
+        runtime_db = RuntimeDB(args.runtime_db, margin=args.time_margin, padding_s=args.time_padding_s)
+        runtime_db.harvest()
+    last_runtime_harvest = time.time()
+
+    extensions_prot = [".fasta", ".pdb", ".fasta.txt", ".FASTA", ".PDB"]
+    partition = parse_partition(args.slurm_args)
+    admission = AdmissionControl(
+        parse_in_flight_limits(args.max_in_flight, partition),
+        partition,
+        retry_backoff_s=args.retry_backoff_s,
+        max_retry_backoff_s=args.max_retry_backoff_s,
+        scheduler=Scheduler(args.schedule, args.fair_share, args.fair_share_half_life_s),
+    )
+
+    claims = None
+    if args.multi_instance and not args.dry_run:  # a dry run does not remove the input files, so it can't claim them
+        claims = ClaimDirectory(args.in_folder, args.instance_name, args.lease_timeout_s)
+        logging.info(f"Claiming files as {claims.instance}")
+
+    watcher = create_folder_watcher(args.in_folder, args.watch_mode)
+    # in a dry run the loop only runs once, so don't wait for the files to be stable
+    scanner = FolderScanner(args.in_folder, extensions_prot, wait_for_stable=not args.dry_run)
+    vectors = VectorCatalogue(args.vectors_folder) if args.vector_validation else None
+    fastas = scanner.scan()
+    try:
+        while True:
+            loop_start = time.perf_counter()
+            if vectors is not None:
+                vectors.refresh()  # only lists vectors_folder again if it changed
+            if args.coalesce and fastas:
+                # collect files arriving within the window (or until the job is full) into the same job
+                window_end = time.time() + args.coalesce_window_s
+                while not args.dry_run and time.time() < window_end and len(fastas) < args.max_coalesce_size:
+                    remaining_s = window_end - time.time()
+                    fastas += [f for f in wait_for_files(watcher, scanner, remaining_s, args.stability_interval_s) if f not in fastas]
+            # one squeue call per scan, then submit the oldest files as far as the in-flight limit allows
+            admission.refresh()
+            admission.run_due_retries()
+            fastas = admission.admit(
+                fastas, partition_of=None if routing is None else lambda fasta: routed_partition(fasta, args, routing)
+            )
+            if claims is not None:
+                # only process the files this watcher managed to claim
+                fastas = claims.claim_all(fastas)
+            # moves files to the output folder and submit them to slurm
+            if args.coalesce and fastas:
+                logging.info(f"Submitting {len(fastas)} protein files in coalesced jobs: {fastas}")
+                coalesce_and_submit(
+                    fastas, args, dry_run=args.dry_run, journal=journal, admission=admission, runtime_db=runtime_db,
+                    vectors=vectors, executor=executor, routing=routing,
+                )
+                fastas = []
+            elif args.pipeline and fastas:
+                logging.info(f"Submitting {len(fastas)} protein files: {fastas}")
+                run_pipeline(
+                    fastas,
+                    lambda fasta: prepare_protein_job(fasta, args, vectors=vectors, routing=routing),
+                    lambda job: submit_with_admission(
+                        admission,
+                        lambda: submit_job(
+                            job[0], args, job[2], job[1],
+                            dry_run=args.dry_run, journal=journal, runtime_db=runtime_db, executor=executor, slurm_args=job[3],
+                        ),
+                        job[0],
+                        partition=parse_partition(job[3]),
+                    ),
+                    args.prepare_workers,
+                    args.max_concurrent_submits,
+                )
+                fastas = []
+            for fasta in fastas:
+                logging.info(f'Submitting protein file: "{fasta}"')
+                job = prepare_protein_job(fasta, args, vectors=vectors, routing=routing)
+                if job is None:
+                    continue
+                out_protein, out_folder, dom_args, slurm_args = job
+                submit_with_admission(
+                    admission,
+                    partial(
+                        submit_job, out_protein, args, dom_args, out_folder,
+                        dry_run=args.dry_run, journal=journal, runtime_db=runtime_db, executor=executor, slurm_args=slurm_args,
+                    ),
+                    out_protein,
+                    partition=parse_partition(slurm_args),
+                )
+            if claims is not None:
+                # claimed files that are still there could not be processed, the error is in the log
+                claims.reject_unprocessed()
+
+            METRICS.observe("loop_seconds", time.perf_counter() - loop_start)
+            exporter.export(final=args.dry_run)
+            if args.dry_run:
+                # only execute loop once if we are doing a dry run
+                break
+            if journal is not None and time.time() - last_journal_refresh > args.journal_refresh_s:
+                journal.refresh()  # one squeue/sacct call for all open jobs
+                last_journal_refresh = time.time()
+                if args.compact_results:
+                    compact_completed(args.job_journal, args.compact_budget_s)
+            if runtime_db is not None and time.time() - last_runtime_harvest > args.runtime_harvest_s:
+                runtime_db.harvest()  # one sacct call for all jobs that have not finished yet
+                last_runtime_harvest = time.time()
+            if claims is not None:
+                claims.reclaim_expired()
+            # continuous scanning of the input folder for fasta files (or waiting for inotify events)
+            fastas = wait_for_files(watcher, scanner, args.scan_interval_s, args.stability_interval_s)
+    finally:
+        executor.close()  # waits for the jobs of the local executor
+        if journal is not None and executor is not SLURM:
+            journal.refresh()  # the final states of the local jobs
 
 
 if __name__ == "__main__":
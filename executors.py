@@ -0,0 +1,185 @@
+"""Where the watchers and af2slurm-parallel run their jobs (the `executor` option).
+
+    slurm   submits the sbatch command lines with sbatch
+    local   runs the same command lines in a pool of local_workers processes on this host
+
+Jobs are always described by the sbatch command line, so both executors run exactly the same commands. The local
+executor interprets the sbatch options the tools write: --wrap or a job script with its arguments, --output/-e (with
+%A, %a, %j and %x), --chdir, --job-name, --array and variables exported before sbatch (e.g. GROUP_SIZE). Resource
+options such as --partition, --gres or --time are ignored. Array tasks get SLURM_ARRAY_TASK_ID like on the cluster.
+Local jobs get IDs like local-1700000000-1234-1. squeue and sacct don't know them, so the executor hands their final
+state to the job journal, which applies it on its next refresh.
+"""
+import itertools
+import logging
+import os
+import re
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from job_journal import LOCAL_JOB_PREFIX, combine_states
+
+EXECUTORS = ["slurm", "local"]
+# sbatch options that don't take a value
+SBATCH_FLAGS = {
+    "--parsable", "--exclusive", "--requeue", "--no-requeue", "-H", "--hold", "-Q", "--quiet", "--test-only",
+    "--contiguous", "-O", "--overcommit", "--spread-job", "--use-min-nodes", "-W", "--wait", "-v", "--verbose",
+}
+SHORT_OPTIONS = {"-o": "--output", "-e": "--error", "-D": "--chdir", "-J": "--job-name", "-a": "--array"}
+ENV_ASSIGNMENT = re.compile(r"^([A-Za-z_]\w*)=(.*)$")
+
+
+class SbatchLine:
+    """The parts of an sbatch command line the local executor needs"""
+
+    def __init__(self, submit: str):
+        """Raises ValueError if submit is not an sbatch command line"""
+        self.env: Dict[str, str] = {}
+        self.options: Dict[str, str] = {}
+        self.script: List[str] = []
+        tokens = shlex.split(submit)
+        # "export GROUP_SIZE=1; sbatch ..."
+        while tokens and tokens[0] != "sbatch":
+            token = tokens.pop(0).rstrip(";")
+            match = ENV_ASSIGNMENT.match(token)
+            if match:
+                self.env[match.group(1)] = match.group(2)
+            elif token not in ["export", ""]:
+                raise ValueError(f"can't run '{token}' before sbatch locally")
+        if not tokens:
+            raise ValueError("not an sbatch command line")
+        tokens.pop(0)
+        while tokens:
+            token = tokens.pop(0)
+            if not token.startswith("-"):
+                self.script = [token] + tokens
+                break
+            name, equals, value = token.partition("=")
+            if not name.startswith("--") and len(name) > 2:  # -a1-3
+                name, value = token[:2], token[2:]
+            elif name not in SBATCH_FLAGS and not equals and tokens and (len(name) == 2 or not tokens[0].startswith("-")):
+                value = tokens.pop(0)  # -a 1-3, --partition gpu
+            self.options[SHORT_OPTIONS.get(name, name)] = value
+        if "--wrap" not in self.options and not self.script:
+            raise ValueError("sbatch line has neither --wrap nor a job script")
+
+    def command(self) -> List[str]:
+        if "--wrap" in self.options:
+            return ["bash", "-c", self.options["--wrap"]]
+        return ["bash"] + self.script
+
+    def array_tasks(self) -> List[Optional[int]]:
+        """Task indices of --array (e.g. 1-10, 1,3,5-7 or 1-9:2%4), [None] for a plain job"""
+        if "--array" not in self.options:
+            return [None]
+        tasks = []
+        for item in self.options["--array"].split("%")[0].split(","):
+            bounds, _, step = item.partition(":")
+            first, _, last = bounds.partition("-")
+            tasks += list(range(int(first), int(last or first) + 1, int(step or 1)))
+        return tasks
+
+
+def expand_output(pattern: str, job_id: str, task: Optional[int], job_name: str) -> str:
+    replacements = {
+        "A": job_id, "a": str(task) if task is not None else "4294967294", "x": job_name,
+        "j": job_id if task is None else f"{job_id}_{task}", "%": "%",
+    }
+    return re.sub(r"%([Aajx%])", lambda match: replacements[match.group(1)], pattern)
+
+
+class SlurmExecutor:
+    name = "slurm"
+
+    def submit(self, submit: str) -> str:
+        """Runs the sbatch command line and returns the output of sbatch"""
+        return subprocess.getoutput(submit)
+
+    def close(self):
+        pass
+
+
+class LocalExecutor:
+    name = "local"
+
+    def __init__(self, workers: int = 1, journal=None):
+        self.pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="local-job")
+        self.journal = journal
+        self.id_prefix = f"{LOCAL_JOB_PREFIX}{int(time.time())}-{os.getpid()}-"
+        self.counter = itertools.count(1)
+        self.tasks: Dict[str, list] = {}  # job id: [tasks left, states, start times, end times]
+        self.lock = threading.Lock()
+
+    def submit(self, submit: str) -> str:
+        """Starts the job of the sbatch command line in the pool and returns its ID, or an error message"""
+        try:
+            line = SbatchLine(submit)
+            tasks = line.array_tasks()
+        except ValueError as e:
+            return f"local executor: {e}"
+        job_id = f"{self.id_prefix}{next(self.counter)}"
+        work_dir = line.options.get("--chdir", os.getcwd())
+        job_name = line.options.get("--job-name", Path(line.script[0]).name if line.script else "wrap")
+        with self.lock:
+            self.tasks[job_id] = [len(tasks), [], [], []]
+        for task in tasks:
+            env = dict(
+                os.environ, **line.env, SLURM_JOB_ID=job_id, SLURM_JOB_NAME=job_name, SLURM_SUBMIT_DIR=os.getcwd()
+            )
+            if task is not None:
+                env.update(SLURM_ARRAY_JOB_ID=job_id, SLURM_ARRAY_TASK_ID=str(task))
+            default_output = "slurm-%j.out" if task is None else "slurm-%A_%a.out"
+            output = expand_output(line.options.get("--output", default_output), job_id, task, job_name)
+            error = expand_output(line.options.get("--error", output), job_id, task, job_name)
+            self.pool.submit(self._run, job_id, task, line.command(), env, work_dir, output, error)
+        logging.debug(f"Queued {job_id} with {len(tasks)} tasks in the local executor")
+        return job_id
+
+    def _run(self, job_id, task, command, env, work_dir, output, error):
+        started = time.time()
+        try:
+            output_path, error_path = Path(work_dir) / output, Path(work_dir) / error
+            with open(output_path, "w") as out, open(error_path, "w") if error_path != output_path else out as err:
+                returncode = subprocess.run(command, cwd=work_dir, env=env, stdout=out, stderr=err).returncode
+            state = "COMPLETED" if returncode == 0 else "FAILED"
+        except OSError as e:
+            logging.error(f"Local job {job_id} could not be started: {e}")
+            state = "FAILED"
+        ended = time.time()
+        if self.journal is not None and task is not None:
+            self.journal.local_job_ended(f"{job_id}_{task}", state, started, ended)
+        self._finished(job_id, state, started, ended)
+
+    def _finished(self, job_id, state, started, ended):
+        """Records the end of a job or array task, the whole job ends with its last task"""
+        with self.lock:
+            left, states, starts, ends = self.tasks[job_id]
+            states.append(state)
+            starts.append(started)
+            ends.append(ended)
+            self.tasks[job_id][0] = left - 1
+            if left > 1:
+                return
+            del self.tasks[job_id]
+        state = combine_states(states)
+        logging.info(f"Local job {job_id} ended: {state}")
+        if self.journal is not None:
+            self.journal.local_job_ended(job_id, state, min(starts), max(ends))
+
+    def close(self):
+        """Waits for all local jobs to end"""
+        self.pool.shutdown(wait=True)
+
+
+SLURM = SlurmExecutor()
+
+
+def create_executor(name: str, workers: int = 1, journal=None):
+    if name == "local":
+        return LocalExecutor(workers, journal)
+    return SLURM
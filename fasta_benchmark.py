@@ -0,0 +1,131 @@
+#!python
+"""Startup and parse throughput of the fasta readers of af2slurm-parallel (builtin vs. Biopython).
+
+    python fasta_benchmark.py --n-records 200000 --output fasta_benchmark.json
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import importlib.util
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def load_af2slurm_parallel():
+    spec = importlib.util.spec_from_file_location("af2slurm_parallel", REPO_DIR / "af2slurm-parallel.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_wall_time(command, repeats: int) -> float:
+    """Fastest of repeats runs of command, in seconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def write_proteinmpnn_fasta(path: Path, n_records: int, seed: int):
+    """Synthetic ProteinMPNN output: native sequence followed by designs with score headers"""
+    rng = random.Random(seed)
+    length = rng.randint(80, 300)
+    with open(path, "w") as f:
+        f.write(f">native, score=1.5, global_score=1.5, fixed_chains=[], designed_chains=['A']\n")
+        f.write("".join(rng.choice(AMINO_ACIDS) for _ in range(length)) + "\n")
+        for n in range(1, n_records):
+            sequence = "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+            f.write(f">T=0.1, sample={n}, score={rng.uniform(0.5, 2):.4f}, global_score={rng.uniform(0.5, 2):.4f}, "
+                    f"seq_recovery=0.4\n{sequence}\n")
+
+
+def parse_throughput(module, path: Path, parser: str) -> dict:
+    size_mb = path.stat().st_size / 1e6
+    start = time.perf_counter()
+    records = 0
+    for record in module.read_fasta_records(path, parser):
+        records += 1
+        _ = len(record), record.id, record.description  # what af2slurm-parallel uses
+    elapsed_s = time.perf_counter() - start
+
+    # memory of holding all records, as af2slurm-parallel does without --proteinmpnn
+    tracemalloc.start()
+    records_list = list(module.read_fasta_records(path, parser))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records_list
+    return {
+        "records": records,
+        "seconds": round(elapsed_s, 3),
+        "records_per_s": round(records / elapsed_s),
+        "mb_per_s": round(size_mb / elapsed_s, 1),
+        "list_peak_mb": round(peak / 1e6, 1),
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        prog="fasta_benchmark",
+        description="Compares the builtin fasta reader of af2slurm-parallel with Biopython",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--n-records", help="Number of records in the synthetic fasta", type=int, default=100000)
+    parser.add_argument("--repeats", help="Startup times are the fastest of X runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file", default="fasta_benchmark.json")
+    args = parser.parse_args()
+
+    module = load_af2slurm_parallel()
+    has_biopython = importlib.util.find_spec("Bio") is not None  # Biopython is optional
+    results = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "n_records": args.n_records,
+        "startup_s": {
+            "python": best_wall_time([sys.executable, "-c", "pass"], args.repeats),
+            "import Bio.SeqIO": best_wall_time([sys.executable, "-c", "import Bio.SeqIO"], args.repeats)
+            if has_biopython else None,
+            "af2slurm-parallel --help": best_wall_time(
+                [sys.executable, str(REPO_DIR / "af2slurm-parallel.py"), "--help"], args.repeats
+            ),
+        },
+        "parse": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        fasta = Path(tmp) / "proteinmpnn.fasta"
+        write_proteinmpnn_fasta(fasta, args.n_records, args.seed)
+        for fasta_parser in ["builtin", "biopython"] if has_biopython else ["builtin"]:
+            results["parse"][fasta_parser] = parse_throughput(module, fasta, fasta_parser)
+        if not has_biopython:
+            results["parse"]["biopython"] = None
+
+    for name, seconds in results["startup_s"].items():
+        if seconds is None:
+            print(f"startup {name:28s} unavailable (Biopython is not installed)")
+        else:
+            print(f"startup {name:28s} {seconds * 1000:8.1f} ms")
+    for name, r in results["parse"].items():
+        if r is None:
+            print(f"parse   {name:28s} unavailable (Biopython is not installed)")
+            continue
+        print(f"parse   {name:28s} {r['records_per_s']:8d} records/s {r['mb_per_s']:7.1f} MB/s "
+              f"{r['list_peak_mb']:7.1f} MB for all records")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!python
+"""Journal of submitted slurm jobs, shared by af2slurm-watcher, dom2slurm-watcher and af2slurm-parallel.
+
+Every submission is recorded in an sqlite database. refresh() updates the state of all open jobs with one squeue call
+(and one sacct call for the jobs that have left the queue), never with one call per job.
+
+    python job_journal.py --journal jobs.sqlite status       # queue and throughput summary
+    python job_journal.py --journal jobs.sqlite track        # keep refreshing the job states
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import logging
+import re
+import shlex
+import sqlite3
+import subprocess
+import threading
+import time
+from datetime import datetime
+from statistics import median
+from typing import Dict, List, Optional
+
+# Jobs in these states will not change anymore
+FINAL_STATES = [
+    "COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "PREEMPTED", "BOOT_FAIL", "DEADLINE",
+    "REVOKED", "SUBMIT_FAILED", "UNKNOWN",
+]
+# Jobs of the local executor (executors.py) are not known to squeue and sacct, it reports their state itself
+LOCAL_JOB_PREFIX = "local-"
+# ended local jobs that are not in the journal (e.g. the whole array if only its tasks were recorded) are dropped after
+LOCAL_JOB_KEEP_S = 3600
+# The worst state of an array task is the state of the whole array
+STATE_SEVERITY = ["COMPLETED", "PENDING", "RUNNING", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "FAILED"]
+# A job that is neither in the queue nor in the accounting is MISSING (slurmdbd may not have recorded it yet) and only
+# becomes UNKNOWN after this many refreshes in a row
+MISSING_REFRESHES = 5
+
+
+def parse_slurm_id(sbatch_output: str) -> Optional[str]:
+    """Returns the job ID from the output of sbatch (with or without --parsable) or of the local executor, or None if
+    the submission failed
+    """
+    match = re.search(
+        rf"^(?:Submitted batch job )?(\d+|{LOCAL_JOB_PREFIX}[\d-]+)(?:;\S+)?\s*$", sbatch_output.strip(), re.MULTILINE
+    )
+    return match.group(1) if match else None
+
+
+def base_job_id(job_id: str) -> str:
+    """Slurm job ID of a journal row: 123 for 123, 123_4 (array task) and 123/name (one input of a coalesced job)"""
+    return job_id.split("/")[0].split("_")[0]
+
+
+def parse_slurm_time(value: str) -> Optional[float]:
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").timestamp()
+    except ValueError:  # Unknown, None, N/A
+        return None
+
+
+def combine_states(states: List[str]) -> str:
+    """State of a job array from the states of its tasks"""
+    if any(state not in FINAL_STATES for state in states):
+        return "RUNNING" if "RUNNING" in states else "PENDING"
+    return max(states, key=lambda state: STATE_SEVERITY.index(state) if state in STATE_SEVERITY else len(STATE_SEVERITY))
+
+
+class JobJournal:
+    def __init__(self, path: str, squeue: str = "squeue", sacct: str = "sacct"):
+        self.squeue = squeue
+        self.sacct = sacct
+        self.lock = threading.Lock()  # the watchers can submit from several threads
+        self.local_jobs: Dict[str, tuple] = {}  # job id: (state, started, ended) of ended local jobs
+        self.missing: Dict[str, int] = {}  # job id: number of refreshes in a row it was neither in squeue nor in sacct
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, name TEXT, source TEXT, input TEXT, "
+                "out_folder TEXT, submitted REAL, state TEXT, state_changed REAL, started REAL, ended REAL, message TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def record(
+        self, sbatch_output: str, name: str, source: str, input_path="", out_folder="", array_task=None, member=None
+    ) -> Optional[str]:
+        """Records a submission. Returns the job ID or None if sbatch failed. array_task is appended as <id>_<task>,
+        member as <id>/<member> (one row per input of a job that runs several inputs, each with its own out_folder)
+        """
+        slurm_id = parse_slurm_id(sbatch_output)
+        now = time.time()
+        if slurm_id is None:
+            job_id, state, message = f"failed-{now:.6f}-{name}", "SUBMIT_FAILED", sbatch_output.strip()
+        else:
+            job_id, state, message = slurm_id, "SUBMITTED", None
+            if array_task is not None:
+                job_id = f"{slurm_id}_{array_task}"
+            if member is not None:
+                job_id = f"{job_id}/{member}"
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, name, source, input, out_folder, submitted, state, state_changed, message) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, name, source, str(input_path), str(out_folder), now, state, now, message),
+            )
+        return None if slurm_id is None else job_id
+
+    def local_job_ended(self, job_id: str, state: str, started: float, ended: float):
+        """Called by the local executor for every job and array task (<id>_<task>) that ended. Applied by refresh()"""
+        with self.lock:
+            self.local_jobs[job_id] = (state, started, ended)
+
+    def open_jobs(self) -> List[str]:
+        placeholders = ",".join("?" * len(FINAL_STATES))
+        with self.lock:
+            rows = self.db.execute(f"SELECT job_id FROM jobs WHERE state NOT IN ({placeholders})", FINAL_STATES).fetchall()
+        return [row[0] for row in rows]
+
+    def _query(self, command: List[str]) -> Optional[List[List[str]]]:
+        """Rows of the output of squeue or sacct, None if the command failed"""
+        try:
+            output = subprocess.run(command, capture_output=True, text=True, timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"WARNING: {command[0]} failed: {e}")
+            return None
+        if output.returncode != 0:
+            logging.warning(f"WARNING: {' '.join(command[:1])} failed: {output.stderr.strip()}")
+            return None
+        return [line.split("|") for line in output.stdout.splitlines() if line.strip()]
+
+    def refresh(self) -> int:
+        """Updates the state of all open jobs. Returns the number of jobs whose state changed"""
+        open_jobs = self.open_jobs()
+        changed = self._refresh_local([job_id for job_id in open_jobs if job_id.startswith(LOCAL_JOB_PREFIX)])
+        open_jobs = [job_id for job_id in open_jobs if not job_id.startswith(LOCAL_JOB_PREFIX)]
+        if not open_jobs:
+            return changed
+        base_ids = sorted({base_job_id(job_id) for job_id in open_jobs})
+
+        # one line per job (and per array task with -r): job id | state | start time
+        tasks: Dict[str, List[List[str]]] = {}
+        squeue = shlex.split(self.squeue) + ["-r", "--noheader", "--format=%i|%T|%S", f"--jobs={','.join(base_ids)}"]
+        rows = self._query(squeue)
+        if rows is None:  # without the queue every job would look finished
+            return changed
+        for job_id, state, start in (line[:3] for line in rows if len(line) >= 3):
+            # for pending jobs %S is only the expected start time
+            tasks.setdefault(job_id, []).append([state, start if state != "PENDING" else "Unknown", "Unknown"])
+
+        # jobs that left the queue are looked up in the accounting, again in a single call
+        in_queue = {job_id.split("_")[0] for job_id in tasks}
+        finished = [base_id for base_id in base_ids if base_id not in in_queue]
+        if finished:
+            sacct = shlex.split(self.sacct) + [
+                "-X", "--noheader", "--parsable2", "--format=JobID,State,Start,End", f"--jobs={','.join(finished)}"
+            ]
+            rows = self._query(sacct)
+            if rows is None:  # keep the jobs that left the queue as they are until sacct works again
+                finished = []
+            for job_id, state, start, end in (line[:4] for line in rows or [] if len(line) >= 4):
+                tasks.setdefault(job_id, []).append([state.split()[0], start, end])  # "CANCELLED by 123"
+
+        now = time.time()
+        with self.lock, self.db:
+            for job_id in open_jobs:
+                slurm_job = job_id.split("/")[0]
+                if "_" in slurm_job:
+                    matching = tasks.get(slurm_job, [])
+                else:  # a whole array job (or a plain job): combine all its tasks
+                    matching = [t for task_id, ts in tasks.items() if task_id.split("_")[0] == slurm_job for t in ts]
+                if matching:
+                    self.missing.pop(job_id, None)
+                    state = combine_states([t[0] for t in matching])
+                elif base_job_id(job_id) in finished:
+                    # neither in the queue nor in the accounting (e.g. not yet recorded by slurmdbd)
+                    self.missing[job_id] = self.missing.get(job_id, 0) + 1
+                    state = "MISSING" if self.missing[job_id] < MISSING_REFRESHES else "UNKNOWN"
+                    if state == "UNKNOWN":
+                        del self.missing[job_id]
+                else:
+                    continue
+                started = min((s for s in (parse_slurm_time(t[1]) for t in matching) if s), default=None)
+                ended = max((e for e in (parse_slurm_time(t[2]) for t in matching) if e), default=None)
+                result = self.db.execute(
+                    "UPDATE jobs SET state = ?, state_changed = ?, started = COALESCE(?, started), ended = COALESCE(?, ended) "
+                    "WHERE job_id = ? AND state != ?",
+                    (state, now, started, ended if state in FINAL_STATES else None, job_id, state),
+                )
+                changed += result.rowcount
+        return changed
+
+    def _refresh_local(self, open_jobs: List[str]) -> int:
+        changed = 0
+        now = time.time()
+        with self.lock, self.db:
+            for job_id in open_jobs:
+                # the local job stays in local_jobs until it is dropped, there can be a row per input (<id>/<member>)
+                if job_id.split("/")[0] in self.local_jobs:
+                    state, started, ended = self.local_jobs[job_id.split("/")[0]]
+                    result = self.db.execute(
+                        "UPDATE jobs SET state = ?, state_changed = ?, started = ?, ended = ? WHERE job_id = ?",
+                        (state, now, started, ended, job_id),
+                    )
+                    changed += result.rowcount
+            for job_id in [job_id for job_id, (_, _, ended) in self.local_jobs.items() if ended < now - LOCAL_JOB_KEEP_S]:
+                del self.local_jobs[job_id]
+        return changed
+
+    def status(self, window_s: float = 24 * 3600) -> str:
+        """Queue and throughput summary"""
+        now = time.time()
+        with self.lock:
+            counts = self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state ORDER BY COUNT(*) DESC").fetchall()
+            recent = self.db.execute(
+                "SELECT submitted, started, ended, state FROM jobs WHERE submitted > ? OR ended > ?",
+                (now - window_s, now - window_s),
+            ).fetchall()
+
+        lines = ["Jobs by state:"]
+        lines += [f"  {state:15s} {count:8d}" for state, count in counts]
+        submitted = [r for r in recent if r[0] > now - window_s]
+        finished = [r for r in recent if r[2] and r[2] > now - window_s]
+        completed = [r for r in finished if r[3] == "COMPLETED"]
+        lines.append(f"Last {window_s / 3600:g} h: {len(submitted)} submitted, {len(finished)} finished, {len(completed)} completed")
+        lines.append(f"  throughput: {len(completed) / (window_s / 3600):.2f} completed jobs per hour")
+        waits = [r[1] - r[0] for r in finished if r[1]]
+        runtimes = [r[2] - r[1] for r in finished if r[1] and r[2]]
+        if waits:
+            lines.append(f"  median queue wait: {median(waits) / 60:.1f} min")
+        if runtimes:
+            lines.append(f"  median run time: {median(runtimes) / 60:.1f} min")
+        return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(
+        prog="job_journal",
+        description="Shows and tracks the slurm jobs submitted by af2slurm and dom2slurm",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--journal", help="Path to the job journal", default="jobs.sqlite")
+    parser.add_argument("--squeue", help="squeue command", default="squeue")
+    parser.add_argument("--sacct", help="sacct command", default="sacct")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status = subparsers.add_parser("status", help="Refresh the job states and print a summary")
+    status.add_argument("--window-h", help="Throughput is computed over the last X hours", type=float, default=24)
+    status.add_argument("--no-refresh", help="Only print what is in the journal", default=False, action="store_true")
+    track = subparsers.add_parser("track", help="Refresh the job states every X seconds")
+    track.add_argument("--interval", help="Seconds between refreshes", type=float, default=60)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    journal = JobJournal(args.journal, squeue=args.squeue, sacct=args.sacct)
+    if args.command == "status":
+        if not args.no_refresh:
+            journal.refresh()
+        print(journal.status(window_s=args.window_h * 3600))
+    else:
+        while True:
+            changed = journal.refresh()
+            logging.info(f"{changed} jobs changed state, {len(journal.open_jobs())} open")
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!python
+"""Content-addressed cache of per-chain MSAs, shared between af2slurm-watcher and af2slurm-parallel.
+
+Every chain MSA is stored as cache_dir/msas/<key[:2]>/<key>.a3m, where the key is a hash of the chain sequence and
+the msa mode. Inputs whose chains are all cached are rewritten to colabfold .a3m inputs, so colabfold_batch skips the
+MSA search for them. After a job finishes, `msa_cache.py store` adds the MSAs colabfold computed for the cache misses.
+cache_dir/index.sqlite keeps track of hits and misses per chain.
+
+The cached MSAs are unpaired, so complexes are only served from the cache if they are predicted with --pair-mode unpaired.
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import copy
+import hashlib
+import logging
+import os
+import shlex
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MSA_CACHE_SCRIPT = Path(__file__).resolve()
+# msa modes that search for MSAs (and can therefore be cached)
+CACHEABLE_MSA_MODES = ["mmseqs2_uniref_env", "mmseqs2_uniref"]
+
+
+def read_fasta(fasta_path) -> Iterator[Tuple[str, str]]:
+    """Yields (header, sequence) for every record, parsed the same way as colabfold_batch does it"""
+    header, sequence = None, []
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#") or not line:
+                continue
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(sequence)
+                header, sequence = line[1:], []
+            else:
+                sequence.append(line)
+    if header is not None:
+        yield header, "".join(sequence)
+
+
+def safe_filename(name: str) -> str:
+    """Same as colabfold's safe_filename, which turns a fasta header into the job name"""
+    return "".join([c if c.isalnum() or c in ["_", ".", "-"] else "_" for c in name])
+
+
+def unique_chains(query: str) -> Tuple[List[str], List[int]]:
+    """Splits a colabfold query (chains separated by :) into unique chains and their cardinalities"""
+    chains = [c for c in query.upper().split(":") if c]
+    unique = []
+    for chain in chains:
+        if chain not in unique:
+            unique.append(chain)
+    return unique, [chains.count(chain) for chain in unique]
+
+
+def build_a3m(chains: List[str], cardinalities: List[int], chain_msas: List[List[str]]) -> str:
+    """Combines unpaired per-chain MSAs into a colabfold a3m (the format colabfold writes for --pair-mode unpaired).
+    colabfold_batch reads the chains of a complex from the first row, so it holds the whole query
+    """
+    lengths = [len(chain) for chain in chains]
+    lines = [f"#{','.join(map(str, lengths))}\t{','.join(map(str, cardinalities))}"]
+    if len(chains) > 1:
+        lines += [">" + "\t".join(str(101 + n) for n in range(len(chains))), "".join(chains)]
+    for n, msa in enumerate(chain_msas):
+        prefix = "-" * sum(lengths[:n])
+        suffix = "-" * sum(lengths[n + 1 :])
+        lines.append(f">{101 + n}")  # the stored query header is replaced by the chain index
+        for line in msa[1:]:
+            lines.append(line if line.startswith(">") else prefix + line + suffix)
+    return "\n".join(lines) + "\n"
+
+
+def extract_chain_msas(a3m_text: str) -> Dict[str, List[str]]:
+    """Takes the unpaired MSA of every chain out of an a3m written by colabfold_batch.
+    Returns {chain sequence: a3m lines without the padding of the other chains}
+    """
+    lines = a3m_text.replace("\x00", "").splitlines()
+    if not lines or not lines[0].startswith("#"):
+        return {}
+    lengths = [int(x) for x in lines[0][1:].split("\t")[0].split(",")]
+
+    # The unpaired block of chain n starts with the header >10{n+1}. Paired rows (if any) come before them.
+    block_starts = []
+    for n in range(len(lengths)):
+        header = f">{101 + n}"
+        start = next((i for i, line in enumerate(lines) if line == header), None)
+        if start is None:
+            return {}
+        block_starts.append(start)
+    block_starts.append(len(lines))
+
+    chain_msas = {}
+    for n in range(len(lengths)):
+        before, after = sum(lengths[:n]), sum(lengths[n + 1 :])
+        msa = []
+        for line in lines[block_starts[n] : block_starts[n + 1]]:
+            if line.startswith(">"):
+                msa.append(line)
+            else:
+                msa.append(line[before : len(line) - after])
+        chain_msas[msa[1]] = msa
+    return chain_msas
+
+
+def parse_msa_settings(colab_args: str) -> Tuple[str, str]:
+    """Returns (msa mode, pair mode) from colabfold_batch arguments, with colabfold's defaults"""
+    tokens = shlex.split(colab_args)
+    settings = {"--msa-mode": "mmseqs2_uniref_env", "--pair-mode": "unpaired_paired"}
+    for i, token in enumerate(tokens):
+        option, _, value = token.partition("=")
+        if option in settings:
+            settings[option] = value if value else (tokens[i + 1] if i + 1 < len(tokens) else settings[option])
+    return settings["--msa-mode"], settings["--pair-mode"]
+
+
+class MSACache:
+    def __init__(self, cache_dir: str, msa_mode: str):
+        self.cache_dir = Path(cache_dir)
+        self.msa_mode = msa_mode
+        os.makedirs(self.cache_dir / "msas", exist_ok=True)
+        # the watchers look up MSAs from several prepare threads
+        self.index = sqlite3.connect(self.cache_dir / "index.sqlite", timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.index:
+            self.index.execute(
+                "CREATE TABLE IF NOT EXISTS chains (key TEXT PRIMARY KEY, msa_mode TEXT, length INTEGER, "
+                "stored REAL, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0, last_lookup REAL)"
+            )
+
+    def with_msa_mode(self, msa_mode: str) -> "MSACache":
+        """The cache for another msa mode, sharing this index and its connection"""
+        cache = copy.copy(self)
+        cache.msa_mode = msa_mode
+        return cache
+
+    def close(self):
+        self.index.close()
+
+    def key(self, chain: str) -> str:
+        return hashlib.sha256(f"{self.msa_mode}\n{chain.upper()}".encode()).hexdigest()
+
+    def path(self, chain: str) -> Path:
+        key = self.key(chain)
+        return self.cache_dir / "msas" / key[:2] / f"{key}.a3m"
+
+    def get(self, chain: str) -> Optional[List[str]]:
+        try:
+            return self.path(chain).read_text().splitlines()
+        except FileNotFoundError:
+            return None
+
+    def put(self, chain: str, msa: List[str]):
+        path = self.path(chain)
+        if path.exists():
+            return
+        os.makedirs(path.parent, exist_ok=True)
+        # write to a temporary file first, so concurrent jobs never read half-written MSAs
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text("\n".join(msa) + "\n")
+        os.replace(tmp_path, path)
+        with self.lock, self.index:
+            self.index.execute(
+                "INSERT INTO chains (key, msa_mode, length, stored) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET stored = excluded.stored",
+                (self.key(chain), self.msa_mode, len(chain), time.time()),
+            )
+
+    def record_lookups(self, chains: List[str], hit: bool):
+        now = time.time()
+        column = "hits" if hit else "misses"
+        with self.lock, self.index:
+            self.index.executemany(
+                f"INSERT INTO chains (key, msa_mode, length, {column}, last_lookup) VALUES (?, ?, ?, 1, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET {column} = {column} + 1, last_lookup = excluded.last_lookup",
+                [(self.key(chain), self.msa_mode, len(chain), now) for chain in chains],
+            )
+
+    def stats(self) -> Tuple[int, int, int]:
+        """Returns (stored MSAs, hits, misses)"""
+        with self.lock:
+            stored, hits, misses = self.index.execute(
+                "SELECT COUNT(stored), COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0) FROM chains"
+            ).fetchone()
+        return stored, hits, misses
+
+
+def prepare_msa_inputs(fasta_path, input_dir, cache: MSACache, pair_mode: str) -> Tuple[List[Path], Optional[Path]]:
+    """Splits the queries of a fasta file into cache hits and misses.
+    Hits are written as one .a3m per query into input_dir/hits, misses into input_dir/misses.fasta.
+    Returns (inputs to run colabfold_batch on, fasta with the misses or None). If nothing is cached, the inputs are
+    just [fasta_path].
+    """
+    input_dir = Path(input_dir)
+    hits, misses = [], []
+    for header, query in read_fasta(fasta_path):
+        chains, cardinalities = unique_chains(query)
+        chain_msas = [cache.get(chain) for chain in chains]
+        if len(chains) > 1 and pair_mode != "unpaired":
+            misses.append((header, query))  # cached MSAs are unpaired
+        elif all(msa is not None for msa in chain_msas):
+            hits.append((header, build_a3m(chains, cardinalities, chain_msas)))
+            cache.record_lookups(chains, hit=True)
+        else:
+            misses.append((header, query))
+            cache.record_lookups([c for c, msa in zip(chains, chain_msas) if msa is None], hit=False)
+
+    logging.info(f"MSA cache: {len(hits)} hits, {len(misses)} misses for {fasta_path}")
+    if not hits:
+        return [Path(fasta_path)], Path(fasta_path)
+
+    inputs = []
+    os.makedirs(input_dir / "hits", exist_ok=True)
+    for header, a3m in hits:
+        (input_dir / "hits" / f"{safe_filename(header)}.a3m").write_text(a3m)
+    inputs.append(input_dir / "hits")
+    if not misses:
+        return inputs, None
+
+    misses_fasta = input_dir / "misses.fasta"
+    with open(misses_fasta, "w") as f:
+        f.writelines(f">{header}\n{query}\n" for header, query in misses)
+    return [misses_fasta] + inputs, misses_fasta
+
+
+def create_store_command(cache_dir, msa_mode, fasta_path, result_dir) -> str:
+    """Command to run after colabfold_batch, which stores the MSAs computed for the queries in fasta_path"""
+    return f"python3 {MSA_CACHE_SCRIPT} store --cache-dir {cache_dir} --msa-mode {msa_mode} {fasta_path} {result_dir}"
+
+
+def store_results(cache: MSACache, fasta_path, result_dir) -> int:
+    """Adds the MSAs colabfold_batch wrote to result_dir for the queries in fasta_path. Returns the number of new chains"""
+    stored = 0
+    for header, _ in read_fasta(fasta_path):
+        a3m_path = Path(result_dir) / f"{safe_filename(header)}.a3m"
+        if not a3m_path.exists():
+            logging.warning(f"WARNING: no MSA found for {header} at {a3m_path}")
+            continue
+        for chain, msa in extract_chain_msas(a3m_path.read_text()).items():
+            if not cache.path(chain).exists():
+                cache.put(chain, msa)
+                stored += 1
+    return stored
+
+
+def main():
+    parser = ArgumentParser(
+        prog="msa_cache",
+        description="Manage the MSA cache of af2slurm",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--cache-dir", help="MSA cache directory", required=True)
+    parser.add_argument("--msa-mode", help="colabfold_batch --msa-mode the MSAs were made with", default="mmseqs2_uniref_env")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    store = subparsers.add_parser("store", help="Store the MSAs colabfold_batch computed for a fasta file")
+    store.add_argument("fasta", help="fasta file that was predicted")
+    store.add_argument("result_dir", help="colabfold_batch output directory")
+    subparsers.add_parser("stats", help="Print the number of cached MSAs, hits and misses")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    cache = MSACache(args.cache_dir, args.msa_mode)
+    if args.command == "store":
+        stored = store_results(cache, args.fasta, args.result_dir)
+        logging.info(f"Stored {stored} new chain MSAs in {args.cache_dir}")
+    else:
+        stored, hits, misses = cache.stats()
+        print(f"{stored} cached MSAs, {hits} hits, {misses} misses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Routes submissions to partitions, gres and CPU settings by the size and settings of the job.
+
+The routing table is a list of rules (the `route` option of the watchers, `--route` of af2slurm-parallel), e.g.
+
+    route = [residues<=400 chains=1 -> --partition=gpu-short --gres=gpu:1, msa_mode=single_sequence -> --cpus-per-task=8]
+
+The first rule whose conditions all hold decides; the slurm options after -> replace the same options of slurm_args.
+Without a matching rule slurm_args is used unchanged. Conditions compare the features of job_features() with
+=, !=, <, <=, > or >=. A rule without conditions matches every job.
+"""
+import logging
+import operator
+import re
+import shlex
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+from msa_cache import parse_msa_settings, read_fasta
+
+CONDITION = re.compile(r"^(\w+)(<=|>=|!=|=|<|>)(\S+)$")
+OPERATORS = {"<=": operator.le, ">=": operator.ge, "!=": operator.ne, "=": operator.eq, "<": operator.lt, ">": operator.gt}
+# short sbatch options, so that -p in slurm_args is replaced by --partition in a rule
+SHORT_OPTIONS = {"-p": "--partition", "-c": "--cpus-per-task", "-G": "--gpus", "-t": "--time", "-n": "--ntasks", "-N": "--nodes"}
+
+Feature = Union[int, str]
+
+
+def job_features(path, arguments: str = "") -> Dict[str, Feature]:
+    """Features to route on: residues and chains (of the largest query), total_residues, queries, and
+    msa_mode, pair_mode and model_type from the colabfold arguments
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".pdb":
+        residues, chains = 0, set()
+        with open(path) as f:
+            for line in f:
+                if line.startswith("ATOM") and line[12:16].strip() == "CA":
+                    residues += 1
+                    chains.add(line[21:22])
+        sizes = [(residues, len(chains))]
+    else:
+        sizes = []
+        for _, query in read_fasta(path):
+            chains = [chain for chain in query.replace("*", "").replace(" ", "").split(":") if chain]
+            sizes.append((sum(len(chain) for chain in chains), len(chains)))
+            if path.suffix == ".a3m":  # only the query, not the MSA
+                break
+        if not sizes:  # an input file without a fasta header (the watchers add it when they copy the file)
+            with open(path) as f:
+                query = "".join(line.strip() for line in f if not line.lstrip().startswith("#"))
+            chains = [chain for chain in query.replace("*", "").replace(" ", "").split(":") if chain]
+            if chains:
+                sizes.append((sum(len(chain) for chain in chains), len(chains)))
+
+    msa_mode, pair_mode = parse_msa_settings(arguments)
+    model_type = "auto"
+    tokens = shlex.split(arguments)
+    for i, token in enumerate(tokens):
+        option, _, value = token.partition("=")
+        if option == "--model-type":
+            model_type = value if value else (tokens[i + 1] if i + 1 < len(tokens) else model_type)
+    return {
+        "residues": max((residues for residues, _ in sizes), default=0),
+        "chains": max((chains for _, chains in sizes), default=0),
+        "total_residues": sum(residues for residues, _ in sizes),
+        "queries": len(sizes),
+        "msa_mode": msa_mode,
+        "pair_mode": pair_mode,
+        "model_type": model_type,
+    }
+
+
+def combine_features(features: List[Dict[str, Feature]]) -> Dict[str, Feature]:
+    """Features of several inputs submitted as one job: the largest query decides, the settings of the first input"""
+    combined = dict(features[0])
+    combined["residues"] = max(f["residues"] for f in features)
+    combined["chains"] = max(f["chains"] for f in features)
+    combined["total_residues"] = sum(f["total_residues"] for f in features)
+    combined["queries"] = sum(f["queries"] for f in features)
+    return combined
+
+
+def split_slurm_options(slurm_options: str) -> List[Tuple[str, List[str]]]:
+    """Splits sbatch options into (option name, tokens), e.g. ("--partition", ["-p", "gpu"])"""
+    options = []
+    for token in shlex.split(slurm_options):
+        if token.startswith("-"):
+            name = token.split("=", 1)[0]
+            options.append((SHORT_OPTIONS.get(name, name), [token]))
+        elif options:
+            options[-1][1].append(token)
+        else:
+            options.append((token, [token]))
+    return options
+
+
+def merge_slurm_options(slurm_options: str, override: str) -> str:
+    """Replaces the options of slurm_options that are set in override and adds the others"""
+    overrides = split_slurm_options(override)
+    names = {name for name, _ in overrides}
+    kept = [tokens for name, tokens in split_slurm_options(slurm_options) if name not in names]
+    return " ".join(shlex.quote(token) for tokens in kept + [tokens for _, tokens in overrides] for token in tokens)
+
+
+class RoutingTable:
+    def __init__(self, rules: List[str]):
+        """Raises ValueError for rules that can't be parsed"""
+        self.rules = []
+        for rule in rules:
+            conditions, arrow, slurm_options = rule.partition("->")
+            if not arrow or not slurm_options.strip():
+                raise ValueError(f"route '{rule}' has no '-> <slurm options>'")
+            parsed = []
+            for condition in conditions.split():
+                match = CONDITION.match(condition)
+                if match is None:
+                    raise ValueError(f"can't parse condition '{condition}' of route '{rule}'")
+                parsed.append(match.groups())
+            self.rules.append((rule.strip(), parsed, slurm_options.strip()))
+
+    @staticmethod
+    def matches(conditions, features: Dict[str, Feature]) -> bool:
+        for name, op, value in conditions:
+            if name not in features:
+                return False
+            feature = features[name]
+            if isinstance(feature, int):
+                try:
+                    value = float(value)
+                except ValueError:
+                    return False
+            elif op not in ["=", "!="]:
+                return False
+            if not OPERATORS[op](feature, value):
+                return False
+        return True
+
+    def route(self, slurm_options: str, features: Dict[str, Feature], description="") -> str:
+        """Returns the slurm options for a job with these features and logs the decision (if description is given)"""
+        if not self.rules:
+            return slurm_options
+        summary = " ".join(f"{name}={value}" for name, value in features.items())
+        for rule, conditions, override in self.rules:
+            if self.matches(conditions, features):
+                routed = merge_slurm_options(slurm_options, override)
+                if description:
+                    logging.info(f"Routing {description} ({summary}) by '{rule}': {routed}")
+                return routed
+        if description:
+            logging.info(f"Routing {description} ({summary}): no route matches, using {slurm_options}")
+        return slurm_options
@@ -0,0 +1,205 @@
+#!python
+"""Packs the output folder of a finished job into a single zip archive, to save inodes on the shared filesystem.
+
+<folder> becomes <folder>.outputs.zip next to it. The zip central directory is the index: single members (e.g. one
+model PDB) are read without extracting the rest. results_table.py and the result cache read the archives like folders.
+
+    python result_archive.py compact <af2slurm-parallel out_dir or watcher out_folder>   # all finished folders
+    python result_archive.py compact --journal jobs.sqlite                                  # folders of completed jobs
+    python result_archive.py list out/g0001.outputs.zip
+    python result_archive.py extract out/g0001.outputs.zip <member>
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import fnmatch
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import IO, List, Optional
+
+from msa_cache import read_fasta, safe_filename
+
+ARCHIVE_SUFFIX = ".outputs.zip"
+# inputs af2slurm-watcher and dom2slurm-watcher copy into the output folder
+INPUT_SUFFIXES = [".fasta", ".a3m", ".fasta.txt", ".pdb"]
+
+
+def archive_path(folder) -> Path:
+    folder = Path(folder)
+    return folder.with_name(folder.name + ARCHIVE_SUFFIX)
+
+
+class ResultArchive:
+    """Read access to the members of a compacted output folder. The zip is opened on first use"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._zip = None
+
+    @property
+    def zip(self) -> zipfile.ZipFile:
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.path)
+        return self._zip
+
+    def names(self) -> List[str]:
+        return self.zip.namelist()
+
+    def open(self, member: str) -> IO[bytes]:
+        """Streams a single member, without extracting anything else"""
+        return self.zip.open(member)
+
+    def read_text(self, member: str) -> str:
+        with self.open(member) as f:
+            return f.read().decode()
+
+    def model_pdb(self, jobname: str, rank: int = 1) -> Optional[str]:
+        """Returns the PDB of the model with this rank of jobname (relaxed if there is one), or None"""
+        for kind in ["relaxed", "unrelaxed"]:
+            # colabfold >= 1.5 writes rank_001, older versions rank_1
+            for pattern in [f"{jobname}_{kind}_rank_{rank:03d}_*.pdb", f"{jobname}_{kind}_rank_{rank}_*.pdb"]:
+                matches = sorted(fnmatch.filter(self.names(), pattern))
+                if matches:
+                    return self.read_text(matches[0])
+        return None
+
+    def extract(self, member: str, target) -> Path:
+        target = Path(target)
+        os.makedirs(target.parent, exist_ok=True)
+        with self.open(member) as source, open(target, "wb") as f:
+            shutil.copyfileobj(source, f)
+        return target
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+def compact(folder) -> Optional[Path]:
+    """Packs all files of folder into its archive and removes the folder. If the folder was compacted before (new files
+    appeared since), the archive is rewritten with the old and the new files. Returns the archive path
+    """
+    folder = Path(folder)
+    archive = archive_path(folder)
+    files = sorted(path for path in folder.rglob("*") if path.is_file())
+    names = {path.relative_to(folder).as_posix() for path in files}
+    tmp_path = archive.with_name(f".{archive.name}.{os.getpid()}.tmp")
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as target:
+        if archive.exists():
+            with zipfile.ZipFile(archive) as old:
+                for info in old.infolist():
+                    if info.filename not in names:
+                        target.writestr(info, old.read(info), compress_type=info.compress_type)
+        for path in files:
+            target.write(path, path.relative_to(folder).as_posix())
+    with zipfile.ZipFile(tmp_path) as written:  # check the archive before the originals are removed
+        verified = written.testzip() is None and names <= set(written.namelist())
+    if not verified:
+        os.remove(tmp_path)
+        raise OSError(f"could not verify the archive of {folder}")
+    os.replace(tmp_path, archive)
+    shutil.rmtree(folder)
+    logging.info(f"Compacted {len(files)} files of {folder} into {archive}")
+    return archive
+
+
+def queries_done(folder, fasta) -> bool:
+    """True if colabfold wrote <jobname>.done.txt into folder for every query of fasta"""
+    if Path(fasta).suffix == ".a3m":  # a single query, named after the file
+        jobnames = [safe_filename(Path(fasta).stem)]
+    else:
+        jobnames = [safe_filename(header) for header, _ in read_fasta(fasta)]
+    return bool(jobnames) and all((Path(folder) / f"{jobname}.done.txt").exists() for jobname in jobnames)
+
+
+def finished_folders(out_dir) -> List[Path]:
+    """Output folders under out_dir whose colabfold predictions are all done: the gNNNN folders of af2slurm-parallel
+    (queries in out_dir/gNNNN.fasta) and the per-input folders of af2slurm-watcher (queries in their input copy)
+    """
+    out_dir = Path(out_dir)
+    finished = []
+    for folder in sorted(path for path in out_dir.iterdir() if path.is_dir()):
+        fasta = out_dir / f"{folder.name}.fasta"
+        if not fasta.exists():
+            fasta = next((folder / f"{folder.name}{suffix}" for suffix in INPUT_SUFFIXES
+                          if (folder / f"{folder.name}{suffix}").exists()), None)
+        if fasta is not None and fasta.suffix != ".pdb" and queries_done(folder, fasta):
+            finished.append(folder)
+    return finished
+
+
+def completed_journal_folders(journal_path) -> List[Path]:
+    """Output folders of completed jobs in the job journal that have no unfinished job left.
+    af2slurm-parallel records its whole out_dir, whose group folders are found by finished_folders instead
+    """
+    from job_journal import FINAL_STATES
+
+    db = sqlite3.connect(journal_path, timeout=60)
+    placeholders = ",".join("?" * len(FINAL_STATES))
+    rows = db.execute(
+        "SELECT DISTINCT out_folder FROM jobs WHERE state = 'COMPLETED' AND out_folder != '' "
+        "AND source != 'af2slurm-parallel' AND out_folder NOT IN "
+        f"(SELECT out_folder FROM jobs WHERE state NOT IN ({placeholders}))",
+        FINAL_STATES,
+    ).fetchall()
+    db.close()
+    return [Path(row[0]) for row in rows if Path(row[0]).is_dir()]
+
+
+def compact_completed(journal_path, budget_s: Optional[float] = None) -> int:
+    """Compacts the output folders of completed jobs in the job journal. With budget_s, no new folder is started once
+    that many seconds have passed (after the first one), the rest is left for the next call. Returns the number of
+    folders
+    """
+    start = time.monotonic()
+    compacted = 0
+    for folder in completed_journal_folders(journal_path):
+        if budget_s is not None and compacted and time.monotonic() - start > budget_s:
+            break
+        try:
+            compact(folder)
+            compacted += 1
+        except OSError as e:  # e.g. compacted by another watcher instance at the same time
+            logging.warning(f"WARNING: could not compact {folder}: {e}")
+    return compacted
+
+
+def main():
+    parser = ArgumentParser(
+        prog="result_archive",
+        description="Packs finished output folders into indexed zip archives and reads them back",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Pack all finished output folders")
+    compact_parser.add_argument("out_dir", help="af2slurm-parallel out_dir or watcher out_folder", nargs="?")
+    compact_parser.add_argument("--journal", help="Also pack the folders of completed jobs in this job journal")
+    list_parser = subparsers.add_parser("list", help="List the members of an archive")
+    list_parser.add_argument("archive")
+    extract_parser = subparsers.add_parser("extract", help="Write one member of an archive to stdout")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("member")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "compact":
+        folders = finished_folders(args.out_dir) if args.out_dir else []
+        if args.journal:
+            folders += [folder for folder in completed_journal_folders(args.journal) if folder not in folders]
+        for folder in folders:
+            compact(folder)
+    elif args.command == "list":
+        for name in ResultArchive(args.archive).names():
+            print(name)
+    else:
+        with ResultArchive(args.archive).open(args.member) as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    main()
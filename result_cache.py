@@ -0,0 +1,184 @@
+#!python
+"""Persistent index of finished predictions, so identical queries are not predicted twice.
+
+A query is identified by its normalised sequence(s) plus the normalised colabfold_batch arguments and executable.
+Every submitted query is registered in cache_dir/results.sqlite with the folder and job name it is predicted under.
+A registered prediction is only used once colabfold_batch wrote its <jobname>.done.txt, so failed or still running
+jobs are never served from the cache. On a hit the existing outputs are hardlinked (or copied if that is not
+possible) into the new output folder under the new job name. Outputs of a folder that was compacted into an archive
+(result_archive.py) are extracted from it instead.
+"""
+import copy
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from msa_cache import read_fasta, safe_filename
+from result_archive import ResultArchive, archive_path
+
+# Everything colabfold_batch writes for a query is called <jobname>.<suffix> or <jobname>_<one of these>...
+COLABFOLD_OUTPUT_PREFIXES = [
+    "unrelaxed", "relaxed", "scores", "predicted_aligned_error", "coverage", "pae", "plddt", "template_domain_names",
+    "env", "all", "single_repr", "pair_repr", "error",
+]
+COLABFOLD_OUTPUT_SUFFIXES = [".a3m", ".done.txt", ".result.zip", ".pickle"]
+
+
+def normalize_query(query: str) -> str:
+    return ":".join(chain for chain in query.upper().replace(" ", "").replace("*", "").split(":") if chain)
+
+
+def normalize_args(colabfold_args: str) -> str:
+    """Sorts the options so that the order (and --option=value vs --option value) does not matter"""
+    options = []
+    for token in shlex.split(colabfold_args):
+        if token.startswith("--"):
+            option, _, value = token.partition("=")
+            options.append([option] + ([value] if value else []))
+        elif options:
+            options[-1].append(token)
+        else:
+            options.append([token])
+    return " ".join(" ".join(option) for option in sorted(options))
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def is_result_file(name: str, jobname: str) -> bool:
+    """True if colabfold_batch writes a file or folder called name for the query jobname"""
+    if not name.startswith(jobname):
+        return False
+    rest = name[len(jobname) :]
+    return rest in COLABFOLD_OUTPUT_SUFFIXES or (rest.startswith("_") and rest[1:].startswith(tuple(COLABFOLD_OUTPUT_PREFIXES)))
+
+
+def result_files(result_dir, jobname) -> List[Path]:
+    """Returns the files and folders colabfold_batch wrote to result_dir for the query jobname"""
+    return [path for path in Path(result_dir).iterdir() if is_result_file(path.name, jobname)]
+
+
+def extract_results(archive: ResultArchive, jobname, new_result_dir, new_jobname) -> int:
+    """Extracts the outputs of jobname from a compacted result_dir, renamed to new_jobname. Returns the number of files"""
+    members = [name for name in archive.names() if is_result_file(name.split("/")[0], jobname) and not name.endswith("/")]
+    for name in members:
+        target = Path(new_result_dir) / (new_jobname + name[len(jobname) :])
+        if not target.exists():
+            archive.extract(name, target)
+    return len(members)
+
+
+def link_results(result_dir, jobname, new_result_dir, new_jobname) -> int:
+    """Links the outputs of jobname into new_result_dir, renamed to new_jobname. Returns the number of files"""
+    os.makedirs(new_result_dir, exist_ok=True)
+    if not Path(result_dir).is_dir() and archive_path(result_dir).exists():
+        archive = ResultArchive(archive_path(result_dir))
+        try:
+            return extract_results(archive, jobname, new_result_dir, new_jobname)
+        finally:
+            archive.close()
+    files = result_files(result_dir, jobname)
+    for path in files:
+        target = Path(new_result_dir) / (new_jobname + path.name[len(jobname) :])
+        if target.exists():
+            continue
+        if path.is_dir():
+            shutil.copytree(path, target, copy_function=link_or_copy)
+        else:
+            link_or_copy(path, target)
+    return len(files)
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str, colabfold_path: str, colabfold_args: str = ""):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.colabfold_path = colabfold_path
+        self.args_key = f"{colabfold_path.strip()} {normalize_args(colabfold_args)}"
+        # registering happens after the submission, which can be in another thread than the lookups
+        self.index = sqlite3.connect(Path(cache_dir) / "results.sqlite", timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.index:
+            self.index.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT, result_dir TEXT, jobname TEXT, registered REAL)"
+            )
+            self.index.execute("CREATE INDEX IF NOT EXISTS results_key ON results (key)")
+
+    def with_arguments(self, colabfold_args: str) -> "ResultCache":
+        """The cache for other colabfold_batch arguments, sharing this index and its connection"""
+        cache = copy.copy(self)
+        cache.args_key = f"{self.colabfold_path.strip()} {normalize_args(colabfold_args)}"
+        return cache
+
+    def close(self):
+        self.index.close()
+
+    def key(self, query: str) -> str:
+        return hashlib.sha256(f"{self.args_key}\n{normalize_query(query)}".encode()).hexdigest()
+
+    def lookup(self, query: str) -> Optional[Tuple[str, str]]:
+        """Returns (result_dir, jobname) of a finished prediction of query with the same arguments, or None"""
+        with self.lock:
+            rows = self.index.execute(
+                "SELECT result_dir, jobname FROM results WHERE key = ? ORDER BY registered DESC", (self.key(query),)
+            ).fetchall()
+        for result_dir, jobname in rows:
+            if (Path(result_dir) / f"{jobname}.done.txt").exists() or self.archived_done(result_dir, jobname):
+                return result_dir, jobname
+        return None
+
+    @staticmethod
+    def archived_done(result_dir, jobname) -> bool:
+        """True if result_dir was compacted after jobname finished"""
+        if Path(result_dir).is_dir() or not archive_path(result_dir).exists():
+            return False
+        archive = ResultArchive(archive_path(result_dir))
+        try:
+            return f"{jobname}.done.txt" in archive.names()
+        except OSError:
+            return False
+        finally:
+            archive.close()
+
+    def register(self, fasta_path, result_dir):
+        """Registers all queries in fasta_path as being predicted into result_dir"""
+        result_dir = str(Path(result_dir).resolve())
+        now = time.time()
+        rows = [(self.key(query), result_dir, safe_filename(header), now) for header, query in read_fasta(fasta_path)]
+        with self.lock, self.index:
+            self.index.executemany("INSERT INTO results (key, result_dir, jobname, registered) VALUES (?, ?, ?, ?)", rows)
+
+
+def apply_result_cache(fasta_path, result_dir, cache: ResultCache, misses_fasta) -> Optional[Path]:
+    """Links the results of already predicted queries in fasta_path into result_dir.
+    Returns the fasta with the queries that still have to be predicted: fasta_path if nothing was cached,
+    misses_fasta if only some queries were cached and None if all of them were.
+    """
+    hits, misses = 0, []
+    for header, query in read_fasta(fasta_path):
+        cached = cache.lookup(query)
+        if cached is None:
+            misses.append((header, query))
+            continue
+        cached_dir, cached_jobname = cached
+        linked = link_results(cached_dir, cached_jobname, result_dir, safe_filename(header))
+        logging.info(f"Result cache: reusing {linked} files of {cached_jobname} in {cached_dir} for {header}")
+        hits += 1
+
+    if hits == 0:
+        return Path(fasta_path)
+    if not misses:
+        return None
+    with open(misses_fasta, "w") as f:
+        f.writelines(f">{header}\n{query}\n" for header, query in misses)
+    return Path(misses_fasta)
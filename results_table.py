@@ -0,0 +1,252 @@
+#!python
+"""Summary table of the ColabFold scores of an af2slurm-parallel run, updated incrementally.
+
+`ingest` reads only the score JSONs that are not in out_dir/results/index.sqlite yet (and only lists the group folders
+whose mtime changed), and appends one row per model to out_dir/results/scores.csv and, as one NumPy structured array
+per ingest, to out_dir/results/chunks/. A chunk and the CSV rows only count once the index lists them, so an ingest
+that is interrupted leaves the table as it was and the next one starts over. Every row is mapped back to the sequence id af2slurm-parallel wrote into the group fasta,
+which for ProteinMPNN inputs is <sample>|<score>, so sample and mpnn_score are columns of their own.
+`top` ranks the table with vectorised NumPy operations.
+
+    python results_table.py ingest <out_dir>
+    python results_table.py top <out_dir> --by iptm -n 50
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import csv
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from msa_cache import read_fasta, safe_filename
+from result_archive import ResultArchive, archive_path
+
+# <jobname>_scores_rank_001_alphafold2_ptm_model_3_seed_000.json (colabfold >= 1.5)
+# <jobname>_unrelaxed_rank_1_model_3_scores.json (older colabfold)
+SCORE_FILE_PATTERNS = [
+    re.compile(r"^(?P<jobname>.+)_scores_rank_(?P<rank>\d+)_.*model_(?P<model>\d+)_seed_(?P<seed>\d+)\.json$"),
+    re.compile(r"^(?P<jobname>.+)_unrelaxed_rank_(?P<rank>\d+)_model_(?P<model>\d+)_scores\.json$"),
+]
+STRING_COLUMNS = ["group", "jobname", "id", "score_file"]
+COLUMNS = [
+    ("group", "U"), ("jobname", "U"), ("id", "U"), ("sample", "i8"), ("mpnn_score", "f8"), ("rank", "i4"),
+    ("model", "i4"), ("seed", "i4"), ("length", "i4"), ("plddt", "f8"), ("ptm", "f8"), ("iptm", "f8"),
+    ("max_pae", "f8"), ("score_file", "U"),
+]
+# Directory mtimes on network filesystems can have coarse resolution (see FolderScanner)
+MTIME_RESOLUTION_S = 2
+
+
+def parse_sequence_id(sequence_id: str):
+    """Returns (sample, ProteinMPNN score) from the <sample>|<score> ids of af2slurm-parallel, or (-1, nan)"""
+    sample, separator, score = sequence_id.partition("|")
+    try:
+        return (int(sample), float(score)) if separator else (-1, math.nan)
+    except ValueError:
+        return -1, math.nan
+
+
+def read_score_file(path: Path, sequence_ids: Dict[str, str],
+                    archive: Optional[ResultArchive] = None) -> Optional[tuple]:
+    """Returns the row for a colabfold score JSON (a member of archive if the folder was compacted), or None if it is
+    not a score file
+    """
+    match = next((m for m in (p.match(path.name) for p in SCORE_FILE_PATTERNS) if m), None)
+    if match is None:
+        return None
+    with (open(path) if archive is None else archive.open(path.name)) as f:
+        scores = json.load(f)
+    plddt = scores.get("plddt", [])
+    jobname = match.group("jobname")
+    sequence_id = sequence_ids.get(jobname, jobname)
+    sample, mpnn_score = parse_sequence_id(sequence_id)
+    return (
+        path.parent.name, jobname, sequence_id, sample, mpnn_score, int(match.group("rank")), int(match.group("model")),
+        int(match["seed"]) if "seed" in match.groupdict() else 0, len(plddt),
+        sum(plddt) / len(plddt) if plddt else math.nan,
+        scores.get("ptm", math.nan), scores.get("iptm", math.nan), scores.get("max_pae", math.nan), path.name,
+    )
+
+
+def folder_mtime(folder: Path) -> Optional[int]:
+    """mtime of the folder, or of its archive if it was compacted. None if it does not exist (not predicted yet)"""
+    for path in [folder, archive_path(folder)]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+def to_array(rows: List[tuple], string_widths: Dict[str, int]) -> np.ndarray:
+    dtype = [(name, f"U{string_widths[name]}" if kind == "U" else kind) for name, kind in COLUMNS]
+    return np.array(rows, dtype=dtype)
+
+
+class ResultsTable:
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.results_dir = self.out_dir / "results"
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.csv_path = self.results_dir / "scores.csv"
+        self.chunk_dir = self.results_dir / "chunks"
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self.index = sqlite3.connect(self.results_dir / "index.sqlite", timeout=60)
+        with self.index:
+            self.index.execute("CREATE TABLE IF NOT EXISTS processed (path TEXT PRIMARY KEY)")
+            self.index.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER)")
+            self.index.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, name TEXT)")
+            # number of bytes of scores.csv that belong to ingests which were committed to the index
+            self.index.execute("CREATE TABLE IF NOT EXISTS csv (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)")
+
+    def load(self) -> np.ndarray:
+        """All rows, from the chunks listed in the index (chunks left behind by an interrupted ingest are ignored)"""
+        chunks = [np.load(self.chunk_dir / name) for name, in self.index.execute("SELECT name FROM chunks ORDER BY id")]
+        if not chunks:
+            return to_array([], {name: 1 for name in STRING_COLUMNS})
+        widths = {name: max(chunk.dtype[name].itemsize // 4 for chunk in chunks) for name in STRING_COLUMNS}
+        dtype = to_array([], widths).dtype
+        return np.concatenate([chunk.astype(dtype) for chunk in chunks])
+
+    def committed_csv_size(self) -> int:
+        row = self.index.execute("SELECT size FROM csv").fetchone()
+        return row[0] if row else 0
+
+    def append_chunk(self, rows: List[tuple]) -> str:
+        """Writes rows as the next chunk. Returns its file name, which only counts once it is in the index"""
+        widths = {name: max([1] + [len(row[i]) for row in rows]) for i, (name, kind) in enumerate(COLUMNS) if kind == "U"}
+        chunk_id = self.index.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()[0]
+        name = f"scores_{chunk_id:06d}.npy"
+        tmp_path = self.chunk_dir / f"{name}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, to_array(rows, widths))
+        os.replace(tmp_path, self.chunk_dir / name)
+        return name
+
+    def append_csv(self, rows: List[tuple]) -> int:
+        """Appends rows to scores.csv, after cutting off what an interrupted ingest appended. Returns the new size"""
+        with open(self.csv_path, "a+b") as f:
+            f.truncate(self.committed_csv_size())
+        with open(self.csv_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow([name for name, _ in COLUMNS])
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def changed_folders(self) -> List[Path]:
+        """Group folders (with a g*.fasta next to them) whose mtime changed since they were last ingested.
+        A folder that was compacted counts as changed once, when its archive appears
+        """
+        known = dict(self.index.execute("SELECT path, mtime FROM folders"))
+        changed = []
+        for fasta in sorted(self.out_dir.glob("*.fasta")):
+            folder = self.out_dir / fasta.stem
+            mtime = folder_mtime(folder)
+            if mtime is not None and known.get(str(folder)) != mtime:
+                changed.append(folder)
+        return changed
+
+    def ingest(self) -> int:
+        """Adds the rows of all new score files. Returns the number of new rows"""
+        start = time.time()
+        processed = {row[0] for row in self.index.execute("SELECT path FROM processed")}
+        rows, new_files, folder_mtimes = [], [], []
+        for folder in self.changed_folders():
+            mtime = folder_mtime(folder)
+            sequence_ids = {}
+            fasta = self.out_dir / f"{folder.name}.fasta"
+            for header, _ in read_fasta(fasta):
+                sequence_ids[safe_filename(header)] = header
+            archive = None if folder.is_dir() else ResultArchive(archive_path(folder))
+            # files are indexed by their path in the folder, so compacting a folder does not ingest it again
+            if archive is None:
+                paths = list(folder.glob("*.json"))
+            else:
+                paths = [folder / name for name in archive.names() if "/" not in name and name.endswith(".json")]
+            for path in paths:
+                if str(path) in processed:
+                    continue
+                try:
+                    row = read_score_file(path, sequence_ids, archive)
+                except (OSError, ValueError) as e:  # still being written
+                    logging.warning(f"WARNING: could not read {path}: {e}")
+                    mtime = None
+                    continue
+                if row is not None:
+                    rows.append(row)
+                    new_files.append((str(path),))
+            if archive is not None:
+                archive.close()
+            # a listing made right after a change may have missed part of it, so list the folder again next time
+            if mtime is not None and time.time() - mtime / 1e9 > MTIME_RESOLUTION_S:
+                folder_mtimes.append((str(folder), mtime))
+
+        # the chunk and the CSV rows are written first and only count once the index lists them, in one transaction
+        chunk = self.append_chunk(rows) if rows else None
+        csv_size = self.append_csv(rows) if rows else None
+        with self.index:
+            if chunk is not None:
+                self.index.execute("INSERT INTO chunks (name) VALUES (?)", (chunk,))
+                self.index.execute("INSERT OR REPLACE INTO csv (id, size) VALUES (0, ?)", (csv_size,))
+            self.index.executemany("INSERT OR IGNORE INTO processed (path) VALUES (?)", new_files)
+            self.index.executemany("INSERT OR REPLACE INTO folders (path, mtime) VALUES (?, ?)", folder_mtimes)
+        logging.info(f"Ingested {len(rows)} new score files in {time.time() - start:.2f} s")
+        return len(rows)
+
+
+def top_n(table: np.ndarray, n: int = 20, by: str = "plddt", best_model_only: bool = True) -> np.ndarray:
+    """The n rows with the highest value of by (lowest for max_pae and mpnn_score), vectorised.
+    With best_model_only, only the rank 1 model of every sequence is considered
+    """
+    if best_model_only:
+        table = table[table["rank"] == 1]
+    values = table[by].astype("f8")
+    if by in ["max_pae", "mpnn_score"]:
+        values = -values
+    values = np.where(np.isnan(values), -np.inf, values)
+    if len(table) > n:
+        candidates = np.argpartition(-values, n)[:n]
+    else:
+        candidates = np.arange(len(table))
+    return table[candidates[np.argsort(-values[candidates], kind="stable")]]
+
+
+def main():
+    parser = ArgumentParser(
+        prog="results_table",
+        description="Collects the ColabFold scores of an af2slurm-parallel run into one table and ranks them",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest = subparsers.add_parser("ingest", help="Add the new score files to out_dir/results")
+    ingest.add_argument("out_dir", help="Output directory of af2slurm-parallel")
+    top = subparsers.add_parser("top", help="Print the best sequences")
+    top.add_argument("out_dir", help="Output directory of af2slurm-parallel")
+    top.add_argument("-n", help="Number of sequences", type=int, default=20)
+    top.add_argument("--by", help="Column to rank by", default="plddt", choices=["plddt", "ptm", "iptm", "max_pae", "mpnn_score"])
+    top.add_argument("--all-models", help="Rank all models, not only the rank 1 model of every sequence", default=False, action="store_true")
+    top.add_argument("--no-ingest", help="Do not add new score files first", default=False, action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    results = ResultsTable(args.out_dir)
+    if args.command == "ingest" or not args.no_ingest:
+        results.ingest()
+    if args.command == "top":
+        columns = ["id", "sample", "mpnn_score", "plddt", "ptm", "iptm", "max_pae", "model", "group"]
+        print("\t".join(columns))
+        for row in top_n(results.load(), args.n, args.by, best_model_only=not args.all_models):
+            print("\t".join(f"{row[c]:.3f}" if isinstance(row[c], np.floating) else str(row[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
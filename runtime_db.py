@@ -0,0 +1,207 @@
+#!python
+"""Runtimes of finished jobs, used to set sbatch --time so that the jobs can be backfilled.
+
+Every submission is recorded with its settings (executable, arguments and slurm resources) and a size measure (e.g. the
+sum of the squared query lengths for AlphaFold). harvest() looks up the elapsed time of all finished jobs with a single
+sacct call. For new jobs the runtime is fitted per settings as a + b * size over the last completed jobs, and --time is
+set to the estimate times a safety margin. Without enough completed jobs no --time is set (the partition's limit applies).
+A job that hit its time limit (TIMEOUT) needed at least its elapsed time plus padding_s, so the fit is raised to cover
+that and the next job with these settings gets a longer limit.
+
+    python runtime_db.py --db runtimes.sqlite harvest     # look up the runtimes of finished jobs
+    python runtime_db.py --db runtimes.sqlite show        # fitted runtime per settings
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import logging
+import math
+import re
+import shlex
+import sqlite3
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from job_journal import FINAL_STATES, LOCAL_JOB_PREFIX, parse_slurm_id
+from msa_cache import read_fasta
+from result_cache import normalize_args
+
+TIME_OPTION = re.compile(r"(^|\s)(--time[=\s]|-t\s?\S)")
+
+
+def query_lengths(path) -> List[int]:
+    """Number of residues of every query in a fasta, a3m (only the query, not the MSA) or pdb file"""
+    path = Path(path)
+    if path.suffix.lower() == ".pdb":
+        with open(path) as f:
+            return [sum(1 for line in f if line.startswith("ATOM") and line[12:16].strip() == "CA")]
+    records = read_fasta(path)
+    if path.suffix == ".a3m":
+        records = [next(iter(records), ("", ""))]
+    return [len(query.replace(":", "").replace("*", "").replace(" ", "")) for _, query in records]
+
+
+def settings_key(executable: str, arguments: str, slurm_options: str) -> str:
+    """Jobs with the same executable, arguments and slurm resources share one runtime fit"""
+    return f"{executable.strip()} {normalize_args(arguments)} | {normalize_args(slurm_options)}"
+
+
+def format_minutes(seconds: float) -> int:
+    return max(1, math.ceil(seconds / 60))
+
+
+def has_time_limit(slurm_options: str) -> bool:
+    return TIME_OPTION.search(slurm_options) is not None
+
+
+class RuntimeDB:
+    def __init__(self, path: str, sacct: str = "sacct", margin: float = 1.5, padding_s: float = 600,
+                 min_samples: int = 5, max_samples: int = 200):
+        self.sacct = sacct
+        self.margin = margin
+        self.padding_s = padding_s
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.lock = threading.Lock()  # the watchers can submit from several threads
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS runtimes (job_id TEXT PRIMARY KEY, settings TEXT, size REAL, "
+                "submitted REAL, state TEXT, elapsed REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS runtimes_settings ON runtimes (settings, state)")
+
+    def record(self, sbatch_output: str, settings: str, size: float, array_task=None):
+        """Records a submitted job (or array task) to harvest its runtime once it finished"""
+        slurm_id = parse_slurm_id(sbatch_output)
+        if slurm_id is None or slurm_id.startswith(LOCAL_JOB_PREFIX):  # local runtimes don't tell anything about slurm
+            return
+        job_id = slurm_id if array_task is None else f"{slurm_id}_{array_task}"
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO runtimes (job_id, settings, size, submitted, state) VALUES (?, ?, ?, ?, ?)",
+                (job_id, settings, size, time.time(), "SUBMITTED"),
+            )
+
+    def harvest(self) -> int:
+        """Looks up the state and elapsed time of all unfinished jobs with one sacct call. Returns the number of jobs
+        that finished
+        """
+        placeholders = ",".join("?" * len(FINAL_STATES))
+        with self.lock:
+            open_jobs = [row[0] for row in self.db.execute(
+                f"SELECT job_id FROM runtimes WHERE state NOT IN ({placeholders})", FINAL_STATES
+            )]
+        if not open_jobs:
+            return 0
+        base_ids = sorted({job_id.split("_")[0] for job_id in open_jobs})
+        command = shlex.split(self.sacct) + [
+            "-X", "--noheader", "--parsable2", "--format=JobID,State,ElapsedRaw", f"--jobs={','.join(base_ids)}"
+        ]
+        try:
+            output = subprocess.run(command, capture_output=True, text=True, timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"WARNING: {command[0]} failed: {e}")
+            return 0
+        if output.returncode != 0:
+            logging.warning(f"WARNING: {command[0]} failed: {output.stderr.strip()}")
+            return 0
+
+        finished = []
+        for line in output.stdout.splitlines():
+            fields = line.split("|")
+            if len(fields) < 3:
+                continue
+            job_id, state, elapsed = fields[0], fields[1].split()[0], fields[2]  # "CANCELLED by 123"
+            if state in FINAL_STATES and elapsed.isdigit():
+                finished.append((state, float(elapsed), job_id))
+        with self.lock, self.db:
+            self.db.executemany("UPDATE runtimes SET state = ?, elapsed = ? WHERE job_id = ?", finished)
+        return len(finished)
+
+    def fit(self, settings: str) -> Optional[Tuple[float, float]]:
+        """Least squares fit of elapsed = a + b * size over the last completed jobs with these settings, raised to cover
+        the slowest of them and the lower bounds of the jobs that timed out.
+        Returns (a, b) or None if there are not enough completed jobs
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT size, elapsed, state FROM runtimes WHERE settings = ? AND state IN ('COMPLETED', 'TIMEOUT') "
+                "ORDER BY submitted DESC LIMIT ?",
+                (settings, self.max_samples),
+            ).fetchall()
+        samples = [(size, elapsed) for size, elapsed, state in rows if state == "COMPLETED"]
+        # a job that timed out would have needed more than its limit, at least its elapsed time plus the padding
+        lower_bounds = samples + [(size, elapsed + self.padding_s) for size, elapsed, state in rows if state == "TIMEOUT"]
+        if len(samples) < self.min_samples:
+            return None
+        n = len(samples)
+        mean_size = sum(s for s, _ in samples) / n
+        mean_elapsed = sum(e for _, e in samples) / n
+        variance = sum((s - mean_size) ** 2 for s, _ in samples)
+        slope = sum((s - mean_size) * (e - mean_elapsed) for s, e in samples) / variance if variance else 0
+        if slope < 0:  # noise, the runtime does not get shorter for larger inputs
+            slope = 0
+        intercept = mean_elapsed - slope * mean_size
+        # shift the line up so that it covers the slowest job seen so far
+        intercept += max(e - (intercept + slope * s) for s, e in lower_bounds)
+        return intercept, slope
+
+    def estimate(self, settings: str, size: float) -> Optional[float]:
+        """Time limit in seconds for a job of this size (with the safety margin), or None if it can't be estimated"""
+        fitted = self.fit(settings)
+        if fitted is None:
+            return None
+        intercept, slope = fitted
+        return (intercept + slope * size) * self.margin + self.padding_s
+
+    def time_limit(self, slurm_options: str, jobs: Iterable[Tuple[str, float]]) -> str:
+        """Returns the sbatch --time option for (settings, size) of a job or of all tasks of an array job.
+        Returns "" if slurm_options already set a time limit or any of the runtimes can't be estimated yet
+        """
+        if has_time_limit(slurm_options):
+            return ""
+        limits = [self.estimate(settings, size) for settings, size in jobs]
+        if not limits or None in limits:
+            return ""
+        return f"--time={format_minutes(max(limits))}"
+
+    def summary(self) -> str:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT settings, COUNT(*), SUM(state = 'COMPLETED'), AVG(CASE WHEN state = 'COMPLETED' THEN elapsed END) "
+                "FROM runtimes GROUP BY settings ORDER BY COUNT(*) DESC"
+            ).fetchall()
+        lines = []
+        for settings, jobs, completed, mean_elapsed in rows:
+            fitted = self.fit(settings)
+            fit = f"{fitted[0]:.0f} s + {fitted[1]:.3g} s * size" if fitted else "not enough completed jobs"
+            mean = f"{mean_elapsed / 60:.1f} min" if mean_elapsed else "-"
+            lines.append(f"{settings}\n  {jobs} jobs, {completed or 0} completed, mean {mean}, time limit {fit}")
+        return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(
+        prog="runtime_db",
+        description="Harvests and shows the runtimes used to set sbatch --time",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--db", help="Path to the runtime database", default="runtimes.sqlite")
+    parser.add_argument("--sacct", help="sacct command", default="sacct")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("harvest", help="Look up the runtimes of finished jobs")
+    subparsers.add_parser("show", help="Show the fitted runtime per settings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    runtimes = RuntimeDB(args.db, sacct=args.sacct)
+    if args.command == "harvest":
+        logging.info(f"{runtimes.harvest()} jobs finished")
+    else:
+        print(runtimes.summary())
+
+
+if __name__ == "__main__":
+    main()
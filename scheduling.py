@@ -0,0 +1,154 @@
+"""Order in which the watchers submit the input files they found (the `schedule` and `fair_share` options).
+
+Policies:
+    name      alphabetical, as the files were always processed
+    fifo      oldest file (mtime) first
+    sjf       shortest job first, by the number of residues of all queries in the file
+
+A `priority=N` token in the first `#` line of an input (next to the colabfold/domesticator arguments) goes before the
+policy: higher N first, the default is 0. The token is taken out before the arguments are used.
+
+With fair share, users (the owners of the input files) take turns: the next file is the first one of the user with the
+least recent usage (residues submitted, decaying with a half-life of fair_share_half_life_s). Priorities then only
+order the files of the same user, so a large priority does not push other users' files back.
+"""
+import logging
+import os
+import pwd
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+POLICIES = ["name", "fifo", "sjf"]
+PRIORITY_TOKEN = re.compile(r"(?:^|\s)priority=(-?\d+)(?=\s|$)")
+
+
+def split_priority(arguments: str) -> Tuple[str, int]:
+    """Returns the arguments without the priority=N token, and N (0 if there is none)"""
+    match = PRIORITY_TOKEN.search(arguments)
+    if match is None:
+        return arguments, 0
+    return (arguments[: match.start()] + arguments[match.end() :]).strip(), int(match.group(1))
+
+
+def read_priority(path) -> int:
+    """Returns the priority=N of the first line of an input file (0 if there is none), without reading the rest"""
+    with open(path, errors="replace") as f:
+        first_line = next((line.strip() for line in f if line.strip()), "")
+    return split_priority(first_line.lstrip("#"))[1] if first_line.startswith("#") else 0
+
+
+def count_residues(path) -> int:
+    """Returns the residues of all queries of an input file, reading it line by line.
+    Only the query of an .a3m is counted, not the MSA. For .pdb files the CA atoms are counted
+    """
+    path = Path(path)
+    residues, headers = 0, 0
+    is_pdb = path.suffix.lower() == ".pdb"
+    with open(path, errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if is_pdb:
+                residues += line.startswith("ATOM") and line[12:16].strip() == "CA"
+            elif line.startswith(">"):
+                headers += 1
+                if path.suffix == ".a3m" and headers > 1:
+                    break
+            else:
+                residues += sum(1 for c in line if c.isalpha())
+    return residues
+
+
+def file_owner(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class Scheduler:
+    def __init__(self, policy: str = "name", fair_share: bool = False, fair_share_half_life_s: float = 3600):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown schedule '{policy}', use one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.fair_share = fair_share
+        self.half_life_s = fair_share_half_life_s
+        # only sjf and fair share need the residues, the other policies only read the first line of a file
+        self.needs_residues = policy == "sjf" or fair_share
+        self.inputs: Dict[str, tuple] = {}  # path: ((size, mtime), owner, residues, priority)
+        self.usage: Dict[str, float] = {}  # owner: residues submitted, decayed to usage_time
+        self.usage_time = time.time()
+        self.lock = threading.Lock()
+
+    def _input(self, path: str):
+        """Returns (owner, residues, priority, mtime) of path, reading it only if it changed since it was last seen.
+        residues is 0 if the policy does not need it
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "", 0, 0, 0
+        cached = self.inputs.get(path)
+        if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+            try:
+                priority = read_priority(path)
+                residues = count_residues(path) if self.needs_residues else 0
+            except OSError as e:
+                logging.warning(f"WARNING: can't read {path} to schedule it: {e}")
+                residues, priority = 0, 0
+            cached = ((stat.st_size, stat.st_mtime_ns), file_owner(stat.st_uid), residues, priority)
+            self.inputs[path] = cached
+        return cached[1], cached[2], cached[3], cached[0][1]
+
+    def _decay(self):
+        now = time.time()
+        factor = 0.5 ** ((now - self.usage_time) / self.half_life_s)
+        self.usage = {owner: usage * factor for owner, usage in self.usage.items() if usage * factor > 1}
+        self.usage_time = now
+
+    def order(self, paths: List[str]) -> List[str]:
+        """Returns paths in the order they should be submitted"""
+        with self.lock:
+            described = {path: self._input(path) for path in paths}
+            for path in set(self.inputs) - set(described):
+                del self.inputs[path]  # submitted or removed
+
+            def key(path):
+                owner, residues, priority, mtime = described[path]
+                if self.policy == "fifo":
+                    return -priority, mtime, path
+                if self.policy == "sjf":
+                    return -priority, residues, path
+                return -priority, path
+
+            ordered = sorted(paths, key=key)
+            if not self.fair_share:
+                return ordered
+
+            # the users take turns, the one with the least usage (including the files ordered so far) goes next
+            self._decay()
+            queues: Dict[str, List[str]] = {}
+            for path in ordered:
+                queues.setdefault(described[path][0], []).append(path)
+            usage = {owner: self.usage.get(owner, 0.0) for owner in queues}
+            heads = {owner: 0 for owner in queues}
+            fair = []
+            while len(fair) < len(ordered):
+                owner = min((o for o in queues if heads[o] < len(queues[o])), key=lambda o: (usage[o], o))
+                path = queues[owner][heads[owner]]
+                heads[owner] += 1
+                usage[owner] += max(1, described[path][1])
+                fair.append(path)
+            return fair
+
+    def charge(self, paths: List[str]):
+        """Adds the residues of paths, which are being submitted now, to the usage of their owners"""
+        with self.lock:
+            self._decay()
+            for path in paths:
+                owner, residues, _, _ = self._input(path)
+                self.usage[owner] = self.usage.get(owner, 0.0) + max(1, residues)
@@ -0,0 +1,14 @@
+#!/bin/bash
+# Like wrapper_slurm_array_job_group.sh, but without #SBATCH defaults: all resources come from the sbatch command line
+# (slurm_args of af2slurm-watcher), so an array task gets the same resources as a job of the one-job-per-file mode
+
+GROUP_SIZE=${GROUP_SIZE:-1}
+
+for I in $(seq 1 $GROUP_SIZE)
+do
+    echo "Hello from job $SLURM_JOB_ID on $(hostname) at $(date)"
+    J=$(($SLURM_ARRAY_TASK_ID * $GROUP_SIZE + $I - $GROUP_SIZE))
+    CMD=$(sed -n "${J}p" $1)
+    echo "COMMAND: ${CMD}"
+    echo "${CMD}" | bash
+done
@@ -0,0 +1,84 @@
+import importlib.util
+import stat
+import sys
+from argparse import Namespace
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import watcher_utils  # noqa: E402
+
+
+def load_script(file_name: str):
+    """Imports one of the command line scripts, whose file names are not valid module names"""
+    spec = importlib.util.spec_from_file_location(Path(file_name).stem.replace("-", "_"), REPO_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def af2slurm_watcher():
+    return load_script("af2slurm-watcher.py")
+
+
+@pytest.fixture(scope="session")
+def dom2slurm_watcher():
+    return load_script("dom2slurm-watcher.py")
+
+
+@pytest.fixture(scope="session")
+def af2slurm_parallel():
+    return load_script("af2slurm-parallel.py")
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 2, 3, 4, 5)
+
+
+@pytest.fixture
+def frozen_now(monkeypatch):
+    """All file names made by the watchers get the same timestamp, as if everything happened in the same second"""
+    monkeypatch.setattr(watcher_utils, "datetime", FrozenDatetime)
+    return FrozenDatetime.now()
+
+
+@pytest.fixture
+def watcher_args(tmp_path):
+    """Makes the parsed arguments of a watcher dry run with in_folder and out_folder in tmp_path"""
+
+    def make(**kwargs):
+        defaults = dict(
+            in_folder=str(tmp_path / "in"), out_folder=str(tmp_path / "out"), dry_run=True, colabfold_path="colabfold_batch",
+            env_setup_script="env.sh", slurm_args="--partition=gpu",
+        )
+        return Namespace(**{**defaults, **kwargs})
+
+    return make
+
+
+class StubCommand:
+    """Executable that prints the text of its output file and exits with the given code, like squeue or sacct would"""
+
+    def __init__(self, folder, name):
+        self.output = folder / f"{name}.out"
+        self.path = folder / name
+        self.path.write_text(f"#!/bin/sh\ncat '{self.output}'\nexit $(cat '{self.output}.code' 2>/dev/null || echo 0)\n")
+        self.path.chmod(self.path.stat().st_mode | stat.S_IEXEC)
+        self.set("")
+
+    def set(self, text, code=0):
+        self.output.write_text(text)
+        (self.output.parent / f"{self.output.name}.code").write_text(str(code))
+
+
+@pytest.fixture
+def stub_command(tmp_path):
+    """Makes a StubCommand called name in tmp_path"""
+    return lambda name: StubCommand(tmp_path, name)
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+import watcher_utils
+from watcher_utils import AdmissionControl, parse_in_flight_limits, parse_partition
+
+
+@pytest.mark.parametrize(
+    "slurm_args, partition",
+    [
+        ("--partition=gpu --gres=gpu:1", "gpu"),
+        ("--ntasks=1 --partition amd", "amd"),
+        ("-p cpu", "cpu"),
+        ("-pcpu", "cpu"),
+        ("--ntasks=1", ""),
+    ],
+)
+def test_parse_partition(slurm_args, partition):
+    assert parse_partition(slurm_args) == partition
+
+
+def test_parse_in_flight_limits():
+    assert parse_in_flight_limits("200", "gpu") == {"gpu": 200}
+    assert parse_in_flight_limits("gpu=200, amd=1000", "gpu") == {"gpu": 200, "amd": 1000}
+    assert parse_in_flight_limits("", "gpu") == {}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def squeue(stub_command):
+    return stub_command("squeue")
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    def make(*names):
+        for name in names:
+            (tmp_path / name).write_text(">a\nMKV\n")
+        return [str(tmp_path / name) for name in names]
+
+    return make
+
+
+def test_in_flight_jobs_are_counted_per_partition(squeue):
+    admission = AdmissionControl({"gpu": 4, "amd": 10}, "gpu", squeue=str(squeue.path))
+    assert admission.free_slots() == 4
+    # one line per job or array task, pending jobs can list several partitions
+    squeue.set("gpu\ngpu\namd,gpu\namd\n")
+    admission.refresh()
+    assert admission.in_flight == {"gpu": 3, "amd": 2}
+    assert (admission.free_slots(), admission.free_slots("amd"), admission.free_slots("cpu")) == (1, 8, None)
+    admission.submitted(n_jobs=5)
+    assert admission.free_slots() == 0
+
+    # a failed squeue keeps the previous count
+    squeue.set("", code=1)
+    admission.refresh()
+    assert admission.in_flight == {"gpu": 8, "amd": 2}
+    squeue.set("")
+    admission.refresh()
+    assert admission.free_slots() == 4
+
+
+def test_backlog_keeps_its_order_across_loops(squeue, inputs):
+    admission = AdmissionControl({"gpu": 2}, "gpu", squeue=str(squeue.path))
+    squeue.set("gpu\n")
+    admission.refresh()
+    a, b, c, d, e = inputs("a.fasta", "b.fasta", "c.fasta", "d.fasta", "e.fasta")
+    assert admission.admit([a, b, c]) == [a]
+    admission.submitted()
+    assert admission.admit([d]) == []
+    assert list(admission.backlog) == [b, c, d]
+
+    # the next loop: the jobs finished
+    squeue.set("")
+    admission.refresh()
+    assert admission.admit([e]) == [b, c]
+    assert list(admission.backlog) == [d, e]
+    # files that were removed from in_folder in the meantime are dropped
+    os.remove(d)
+    admission.refresh()
+    assert admission.admit([]) == [e]
+    assert admission.backlog == {}
+
+
+def test_failed_submissions_are_retried_with_backoff(squeue, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watcher_utils.time, "time", clock)
+    admission = AdmissionControl({"gpu": 2}, "gpu", squeue=str(squeue.path), retry_backoff_s=30, max_retry_backoff_s=100)
+    results = [False, False, False, False, True]
+    calls = []
+
+    def sbatch():
+        calls.append(clock.now)
+        return results.pop(0)
+
+    admission.submit(sbatch, "a.fasta", n_jobs=2)
+    assert admission.pending_retry_jobs() == 2
+    admission.run_due_retries()
+    assert len(calls) == 1
+
+    # 30, 60 and then 100 instead of 120 s after the failed attempts
+    for backoff_s in [30, 60, 100]:
+        clock.now += backoff_s - 1
+        admission.run_due_retries()
+        assert len(calls) == 1 + [30, 60, 100].index(backoff_s)
+        clock.now += 1
+        admission.run_due_retries()
+    assert len(calls) == 4
+    assert [round(b - a) for a, b in zip(calls, calls[1:])] == [30, 60, 100]
+
+    # a retry that is due waits until the limit allows it
+    squeue.set("gpu\n")
+    admission.refresh()
+    clock.now += 100
+    admission.run_due_retries()
+    assert len(calls) == 4
+    squeue.set("")
+    admission.refresh()
+    admission.run_due_retries()
+    assert len(calls) == 5
+    assert admission.retries == []
+    assert admission.in_flight == {"gpu": 2}
+
+
+def test_retries_take_up_free_slots(squeue, inputs):
+    admission = AdmissionControl({"gpu": 2}, "gpu", squeue=str(squeue.path), retry_backoff_s=30)
+    admission.refresh()
+    admission.submit(lambda: False, "batch", n_jobs=1)
+    a, b = inputs("a.fasta", "b.fasta")
+    assert admission.admit([a, b]) == [a]
@@ -0,0 +1,46 @@
+import random
+import sys
+
+import pytest
+
+
+def test_balanced_tasks_cover_all_sequences(af2slurm_parallel):
+    groups = [["A" * 400] * 4, ["A" * 50] * 4, ["A" * 100] * 2]
+    cost = lambda seq: len(seq) ** 2
+    pieces, tasks = af2slurm_parallel.balance_array_tasks(groups, 3, cost)
+    assert sorted(n for task in tasks for n in task) == list(range(len(pieces)))
+    assert sorted(seq for piece in pieces for seq in piece) == sorted(seq for g in groups for seq in g)
+    task_costs = [sum(cost(seq) for n in task for seq in pieces[n]) for task in tasks]
+    # the large group is split, so no task has much more than the average
+    assert max(task_costs) <= 1.5 * sum(task_costs) / len(task_costs)
+
+
+def test_more_tasks_than_pieces(af2slurm_parallel):
+    pieces, tasks = af2slurm_parallel.balance_array_tasks([["AAA"]], 5, len)
+    assert pieces == [["AAA"]]
+    assert tasks == [[0]]
+
+
+@pytest.mark.parametrize("array_tasks", [1, 4])
+def test_submitted_array_matches_array_tasks(af2slurm_parallel, tmp_path, monkeypatch, capsys, array_tasks):
+    rng = random.Random(2)
+    designs = "".join(
+        f">T=0.1, sample={n}, score={rng.random():.3f}, global_score=1.0\n{''.join(rng.choice('ACDEFGHIK') for _ in range(rng.randint(30, 200)))}\n"
+        for n in range(1, 40)
+    )
+    fasta = tmp_path / "designs.fasta"
+    fasta.write_text(">native, score=1.0, global_score=1.0\nMNATIVE\n" + designs)
+    out_dir = tmp_path / "out"
+    (out_dir).mkdir()
+    (out_dir / "g9999.fasta").write_text(">left over from an earlier run\nACDEF\n")
+    monkeypatch.setattr(sys, "argv", [
+        "af2slurm-parallel.py", str(fasta), str(out_dir), "--proteinmpnn", "--array-tasks", str(array_tasks),
+        "--max-group-size", "5", "--dry-run",
+    ])
+    af2slurm_parallel.main()
+
+    submit = capsys.readouterr().out.splitlines()[-1]
+    assert f" -a 1-{array_tasks} " in submit
+    tasks = (out_dir / "run.tasks").read_text()
+    assert "designs.fasta" not in tasks and "g9999" not in tasks
+    assert sum(f"g{n:04d}.fasta" in tasks for n in range(40)) == len(list(out_dir.glob("g0*.fasta")))
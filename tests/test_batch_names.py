@@ -0,0 +1,50 @@
+import itertools
+
+import watcher_utils
+from watcher_utils import create_unique_file
+
+
+def write_inputs(folder, names):
+    folder.mkdir(exist_ok=True)
+    for name in names:
+        (folder / name).write_text(f">{name}\nACDEFGHIK\n")
+    return [str(folder / name) for name in names]
+
+
+def test_unique_files_of_the_same_second(tmp_path, frozen_now):
+    paths = [create_unique_file(tmp_path, "batch", ".tasks") for _ in range(20)]
+    assert len(set(paths)) == 20
+    assert all(path.exists() and path.name.startswith("batch_20240102-030405_") for path in paths)
+
+
+def test_existing_file_is_not_overwritten(tmp_path, monkeypatch, frozen_now):
+    monkeypatch.setattr(watcher_utils, "_UNIQUE_FILE_COUNTER", itertools.count(1))
+    first = create_unique_file(tmp_path, "batch", ".tasks")
+    first.write_text("first batch\n")
+    # e.g. another watcher instance with the same pid on another host
+    monkeypatch.setattr(watcher_utils, "_UNIQUE_FILE_COUNTER", itertools.count(1))
+    second = create_unique_file(tmp_path, "batch", ".tasks")
+    assert second != first
+    assert first.read_text() == "first batch\n"
+
+
+def test_batches_of_the_same_second_get_their_own_task_list(af2slurm_watcher, tmp_path, watcher_args, frozen_now):
+    args = watcher_args(max_batch_size=100, result_cache_dir=None, msa_cache_dir=None)
+    af2slurm_watcher.move_and_submit_fasta_batch(write_inputs(tmp_path / "in", ["a.fasta"]), args, dry_run=True)
+    af2slurm_watcher.move_and_submit_fasta_batch(write_inputs(tmp_path / "in", ["b.fasta"]), args, dry_run=True)
+
+    task_lists = sorted((tmp_path / "out" / "batch_tasks").glob("*.tasks"))
+    assert len(task_lists) == 2
+    contents = [path.read_text() for path in task_lists]
+    assert any("a.fasta" in text and "b.fasta" not in text for text in contents)
+    assert any("b.fasta" in text and "a.fasta" not in text for text in contents)
+
+
+def test_batches_are_chunked_by_max_batch_size(af2slurm_watcher, tmp_path, watcher_args):
+    args = watcher_args(max_batch_size=2, result_cache_dir=None, msa_cache_dir=None)
+    inputs = write_inputs(tmp_path / "in", ["a.fasta", "b.fasta", "c.fasta"])
+    af2slurm_watcher.move_and_submit_fasta_batch(inputs, args, dry_run=True)
+
+    task_lists = (tmp_path / "out" / "batch_tasks").glob("*.tasks")
+    assert sorted(len(path.read_text().splitlines()) for path in task_lists) == [1, 2]
+
@@ -0,0 +1,28 @@
+import os
+
+from watcher_utils import ClaimDirectory
+
+
+def test_claimed_files_that_failed_are_renamed_to_error(tmp_path):
+    for name in ["a.fasta", "b.fasta"]:
+        (tmp_path / name).write_text(">a\nACDEF\n")
+    claims = ClaimDirectory(str(tmp_path), "node1")
+    claimed = claims.claim_all([str(tmp_path / "a.fasta"), str(tmp_path / "b.fasta")])
+    assert claimed == [os.path.join(claims.folder, "a.fasta"), os.path.join(claims.folder, "b.fasta")]
+    assert ClaimDirectory(str(tmp_path), "node2").claim(str(tmp_path / "a.fasta")) is None
+
+    os.remove(claimed[0])  # processed, moved to the output folder
+    assert claims.reject_unprocessed() == 1
+    assert sorted(os.listdir(claims.folder)) == [ClaimDirectory.LEASE_NAME]
+    assert (tmp_path / "b.fasta.error").read_text() == ">a\nACDEF\n"
+    assert "b.fasta.error back to b.fasta" in (tmp_path / "b.fasta.error.txt").read_text()
+
+
+def test_expired_claims_are_released(tmp_path):
+    (tmp_path / "a.fasta").write_text(">a\nACDEF\n")
+    crashed = ClaimDirectory(str(tmp_path), "node1", lease_timeout_s=600)
+    crashed.claim(str(tmp_path / "a.fasta"))
+    os.utime(crashed.lease_path, (0, 0))
+
+    assert ClaimDirectory(str(tmp_path), "node2", lease_timeout_s=600).reclaim_expired() == 1
+    assert (tmp_path / "a.fasta").exists()
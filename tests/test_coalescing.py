@@ -0,0 +1,12 @@
+def test_coalesced_scripts_of_the_same_second(dom2slurm_watcher, tmp_path, watcher_args, frozen_now):
+    args = watcher_args(
+        colabfold_path="domesticator", max_coalesce_size=10, coalesce_workers=1, vectors_folder=str(tmp_path / "vectors")
+    )
+    (tmp_path / "in").mkdir()
+    for name in ["a.fasta", "b.fasta"]:
+        (tmp_path / "in" / name).write_text("# pET29b.gb\n>x\nACDEFGHIK\n")
+        dom2slurm_watcher.coalesce_and_submit([str(tmp_path / "in" / name)], args, dry_run=True)
+
+    scripts = sorted((tmp_path / "out" / "coalesced_jobs").glob("*.sh"))
+    assert len(scripts) == 2
+    assert ["a.fasta" in path.read_text() for path in scripts].count(True) == 1
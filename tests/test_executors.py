@@ -0,0 +1,70 @@
+import pytest
+
+from executors import LocalExecutor, SbatchLine, expand_output
+from job_journal import JobJournal
+
+
+def test_exported_variables_and_short_array_option():
+    line = SbatchLine("export GROUP_SIZE=1; sbatch  --partition=gpu --parsable --job-name=batch_1 -a 1-3 wrapper.sh tasks.txt")
+    assert line.env == {"GROUP_SIZE": "1"}
+    assert line.options == {"--partition": "gpu", "--parsable": "", "--job-name": "batch_1", "--array": "1-3"}
+    assert line.script == ["wrapper.sh", "tasks.txt"]
+    assert line.command() == ["bash", "wrapper.sh", "tasks.txt"]
+    assert line.array_tasks() == [1, 2, 3]
+
+
+def test_wrap_with_nested_quotes():
+    line = SbatchLine("""sbatch --parsable --wrap="cd '/data/my run' && colabfold_batch --msa-mode=single_sequence \\"a b.fasta\\" out" """)
+    assert line.script == []
+    assert line.command() == ["bash", "-c", """cd '/data/my run' && colabfold_batch --msa-mode=single_sequence "a b.fasta" out"""]
+    assert line.array_tasks() == [None]
+
+
+def test_options_with_separate_values():
+    line = SbatchLine("sbatch --partition gpu -e /out/a.err -o /out/a.out --chdir=/work -J name --exclusive job.sh --arg")
+    assert line.options == {
+        "--partition": "gpu", "--error": "/out/a.err", "--output": "/out/a.out", "--chdir": "/work", "--job-name": "name",
+        "--exclusive": "",
+    }
+    assert line.script == ["job.sh", "--arg"]
+    assert SbatchLine("sbatch -a1-9:2%4 -D /work job.sh").options == {"--array": "1-9:2%4", "--chdir": "/work"}
+    assert SbatchLine("sbatch -a 1,3,5-7 job.sh").array_tasks() == [1, 3, 5, 6, 7]
+
+
+@pytest.mark.parametrize("submit", ["sbatch --parsable", "rm -rf /; sbatch job.sh", "squeue"])
+def test_not_runnable(submit):
+    with pytest.raises(ValueError):
+        SbatchLine(submit)
+
+
+def test_expand_output():
+    assert expand_output("logs/%x_%A_%a.out", "local-1", 3, "batch") == "logs/batch_local-1_3.out"
+    assert expand_output("%j.out", "local-1", 3, "batch") == "local-1_3.out"
+    assert expand_output("%j.out", "local-1", None, "batch") == "local-1.out"
+    assert expand_output("100%%_%a", "local-1", None, "batch") == "100%_4294967294"
+
+
+def test_local_jobs_report_their_state_to_the_journal(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.sqlite"), squeue="true", sacct="true")
+    executor = LocalExecutor(workers=2, journal=journal)
+    (tmp_path / "work").mkdir()
+    (tmp_path / "task.sh").write_text('echo "task $SLURM_ARRAY_TASK_ID of $SLURM_JOB_NAME, group $GROUP_SIZE"\nexit $(($1 == $SLURM_ARRAY_TASK_ID))\n')
+    array = executor.submit(
+        f"export GROUP_SIZE=2; sbatch --parsable --partition=gpu --job-name=batch --chdir={tmp_path / 'work'} "
+        f"--output=%x_%A_%a.out -a 1-3 {tmp_path / 'task.sh'} 2"
+    )
+    wrapped = executor.submit(f"sbatch --parsable -e {tmp_path / 'wrap.err'} --output={tmp_path / 'wrap.out'} --wrap=\"echo 'out'; echo err >&2\"")
+    assert executor.submit("sbatch --parsable").startswith("local executor:")
+    journal.record(array, "batch", "test")
+    journal.record(array, "batch", "test", array_task=1)
+    journal.record(array, "batch", "test", array_task=2)
+    journal.record(array, "batch", "test", array_task=3)
+    journal.record(wrapped, "wrap", "test")
+    executor.close()
+    journal.refresh()
+
+    states = dict(journal.db.execute("SELECT job_id, state FROM jobs").fetchall())
+    assert states == {array: "FAILED", f"{array}_1": "COMPLETED", f"{array}_2": "FAILED", f"{array}_3": "COMPLETED", wrapped: "COMPLETED"}
+    assert (tmp_path / "work" / f"batch_{array}_2.out").read_text() == "task 2 of batch, group 2\n"
+    assert (tmp_path / "wrap.out").read_text() == "out\n"
+    assert (tmp_path / "wrap.err").read_text() == "err\n"
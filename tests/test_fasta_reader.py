@@ -0,0 +1,20 @@
+import pytest
+
+
+def test_read_fasta_records(af2slurm_parallel, tmp_path):
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text("text before the first header\n>a first query\nACD\nEF G\n>b\n\nHIK\n>\nLM\n")
+    records = list(af2slurm_parallel.read_fasta_records(fasta))
+    assert [(r.id, r.description, r.seq) for r in records] == [
+        ("a", "a first query", "ACDEFG"), ("b", "b", "HIK"), ("", "", "LM")
+    ]
+    assert len(records[0]) == 6
+
+
+def test_same_records_as_biopython(af2slurm_parallel, tmp_path):
+    pytest.importorskip("Bio")
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text(">a first query\nACD\nEFG\n>b, score=1.0\nHIK\n")
+    builtin = [(r.id, r.description, str(r.seq)) for r in af2slurm_parallel.read_fasta_records(fasta)]
+    biopython = [(r.id, r.description, str(r.seq)) for r in af2slurm_parallel.read_fasta_records(fasta, "biopython")]
+    assert builtin == biopython
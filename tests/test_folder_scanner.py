@@ -0,0 +1,38 @@
+import os
+import time
+
+from watcher_utils import FolderScanner
+
+
+def age(path, seconds=60):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_files_are_returned_once_stable(tmp_path):
+    (tmp_path / "a.fasta").write_text(">a\nACDEF\n")
+    (tmp_path / "b.txt").write_text("not an input\n")
+    age(tmp_path)
+    scanner = FolderScanner(str(tmp_path), [".fasta", ".fasta.txt"])
+    assert scanner.scan() == []
+    assert scanner.pending
+    assert scanner.scan() == [str(tmp_path / "a.fasta")]
+    (tmp_path / "a.fasta").unlink()
+    age(tmp_path)
+    assert scanner.scan() == []
+    assert not scanner.pending
+
+
+def test_files_left_in_the_folder_are_returned_again(tmp_path):
+    (tmp_path / "a.fasta").write_text(">a\nACDEF\n")
+    age(tmp_path)
+    scanner = FolderScanner(str(tmp_path), [".fasta"], wait_for_stable=False)
+    assert scanner.scan() == [str(tmp_path / "a.fasta")]
+    # e.g. its submission raised, the folder itself did not change
+    assert scanner.scan() == [str(tmp_path / "a.fasta")]
+
+    stable = FolderScanner(str(tmp_path), [".fasta"])
+    stable.scan()
+    assert stable.scan() == [str(tmp_path / "a.fasta")]
+    assert stable.scan() == []  # seen again, returned once it is stable
+    assert stable.scan() == [str(tmp_path / "a.fasta")]
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+import watcher_utils
+from watcher_utils import FolderScanner, InotifyWatcher, create_folder_watcher, wait_for_files
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+
+
+@linux_only
+def test_written_and_moved_files_are_reported(tmp_path):
+    (tmp_path / "in").mkdir()
+    watcher = InotifyWatcher(str(tmp_path / "in"))
+    try:
+        assert watcher.wait(0.01) is None
+        (tmp_path / "in" / "written.fasta").write_text(">a\nMKV\n")
+        (tmp_path / "moved.fasta").write_text(">b\nMKV\n")
+        os.rename(tmp_path / "moved.fasta", tmp_path / "in" / "moved.fasta")
+        assert watcher.wait(5) == [str(tmp_path / "in" / "moved.fasta"), str(tmp_path / "in" / "written.fasta")]
+        assert watcher.wait(0.01) is None
+    finally:
+        watcher.close()
+
+
+@linux_only
+def test_only_finished_inputs_are_returned(tmp_path):
+    watcher = create_folder_watcher(str(tmp_path), "inotify")
+    assert isinstance(watcher, InotifyWatcher)
+    scanner = FolderScanner(str(tmp_path), [".fasta"])
+    try:
+        (tmp_path / "notes.txt").write_text("not an input\n")
+        with open(tmp_path / "input.fasta", "w") as f:
+            f.write(">a\nMKV\n")
+            f.flush()
+            # still open for writing, so not reported yet
+            assert wait_for_files(watcher, scanner, 0.1, 0.1) == []
+        assert wait_for_files(watcher, scanner, 5, 5) == [str(tmp_path / "input.fasta")]
+    finally:
+        watcher.close()
+
+
+def test_falls_back_to_polling_without_inotify(tmp_path, monkeypatch):
+    def no_libc(*args, **kwargs):
+        raise OSError("libc.so.6: cannot open shared object file")
+
+    monkeypatch.setattr(watcher_utils.ctypes, "CDLL", no_libc)
+    with pytest.raises(OSError):
+        InotifyWatcher(str(tmp_path))
+    watcher = create_folder_watcher(str(tmp_path), "inotify")
+    assert watcher is None
+
+    (tmp_path / "input.fasta").write_text(">a\nMKV\n")
+    then = os.stat(tmp_path).st_mtime - 60
+    os.utime(tmp_path, (then, then))
+    scanner = FolderScanner(str(tmp_path), [".fasta"], wait_for_stable=False)
+    assert wait_for_files(watcher, scanner, 0.01, 0.01) == [str(tmp_path / "input.fasta")]
+
+
+def test_polling_is_the_default(tmp_path):
+    assert create_folder_watcher(str(tmp_path), "poll") is None
+
+
+@linux_only
+def test_falls_back_to_polling_if_the_folder_can_not_be_watched(tmp_path):
+    assert create_folder_watcher(str(tmp_path / "missing"), "inotify") is None
@@ -0,0 +1,70 @@
+import re
+import shutil
+from pathlib import Path
+
+import pytest
+
+from watcher_utils import normalize_input
+
+EXAMPLES = sorted((Path(__file__).resolve().parent.parent / "example").iterdir())
+
+
+def baseline_output(path: Path, args_line: str, keep_lines) -> tuple:
+    """(arguments, text) of the cleaned up copy, as the watchers wrote it before they normalised inputs line by line"""
+    stem_name = path.stem[: -len(".fasta")] if path.stem.endswith(".fasta") else path.stem
+    lines = path.read_text().lstrip(" \n").splitlines()
+    arguments = ""
+    if re.match(args_line, lines[0].strip()):
+        arguments = lines.pop(0).strip().lstrip("#").strip()
+    if keep_lines:
+        return arguments, "\n".join(lines)
+    if lines[0][0] != ">":
+        lines.insert(0, ">" + stem_name)
+    lines = [line if line.startswith(">") else line.replace("*", "").replace(" ", "") for line in lines]
+    return arguments, "\n".join(lines)
+
+
+@pytest.mark.parametrize("example", EXAMPLES, ids=[path.name for path in EXAMPLES])
+def test_af2slurm_output_matches_the_baseline(af2slurm_watcher, tmp_path, example):
+    shutil.copy(example, tmp_path / example.name)
+    target, _, arguments = af2slurm_watcher.move_over_fasta_file(str(tmp_path / example.name), str(tmp_path / "out"))
+    expected_arguments, expected_text = baseline_output(example, r"^\s*#\s*-\s*", keep_lines=example.suffix == ".a3m")
+    assert (arguments, Path(target).read_text()) == (expected_arguments, expected_text)
+    assert Path(f"{target}.original").read_bytes() == example.read_bytes()
+
+
+@pytest.mark.parametrize("example", EXAMPLES, ids=[path.name for path in EXAMPLES])
+def test_dom2slurm_output_matches_the_baseline(dom2slurm_watcher, tmp_path, example):
+    shutil.copy(example, tmp_path / example.name)
+    target, _, arguments = dom2slurm_watcher.copy_protein_files(str(tmp_path / example.name), str(tmp_path / "out"))
+    expected_arguments, expected_text = baseline_output(example, r"^\s*#\s*", keep_lines=False)
+    assert (arguments, Path(target).read_text()) == (expected_arguments, expected_text)
+
+
+def test_header_is_inserted_and_stars_and_spaces_are_removed(tmp_path):
+    (tmp_path / "in.fasta").write_text("\n  \n# --msa-mode single_sequence\nMKV LA*\nGG G\n:\nMLL*\n")
+    assert normalize_input(tmp_path / "in.fasta", tmp_path / "out.fasta", re.compile(r"^\s*#\s*-"), "in") == "--msa-mode single_sequence"
+    assert (tmp_path / "out.fasta").read_text() == ">in\nMKVLA\nGGG\n:\nMLL"
+
+
+def test_headers_are_kept_as_they_are(tmp_path):
+    (tmp_path / "in.fasta").write_text(">a * b\nMKV*\n>c\nML L\n")
+    assert normalize_input(tmp_path / "in.fasta", tmp_path / "out.fasta", re.compile(r"^\s*#\s*-"), "in") == ""
+    assert (tmp_path / "out.fasta").read_text() == ">a * b\nMKV\n>c\nMLL"
+
+
+def test_files_without_header_are_copied_unchanged(tmp_path):
+    text = "# --num-recycle 3\n#3\t1\n>101\nMKV\n>UniRef100_1\nM-v*\n"
+    (tmp_path / "in.a3m").write_text(text)
+    assert normalize_input(tmp_path / "in.a3m", tmp_path / "out.a3m", re.compile(r"^\s*#\s*-"), None) == "--num-recycle 3"
+    assert (tmp_path / "out.a3m").read_text() == text[len("# --num-recycle 3\n") :].rstrip("\n")
+
+
+def test_empty_inputs(tmp_path):
+    (tmp_path / "in.fasta").write_text("\n \n")
+    assert normalize_input(tmp_path / "in.fasta", tmp_path / "out.fasta", re.compile(r"^\s*#"), "in") is None
+    assert not (tmp_path / "out.fasta").exists()
+    # only the arguments line: a fasta with just the header
+    (tmp_path / "in.fasta").write_text("# pET29b.gb\n")
+    assert normalize_input(tmp_path / "in.fasta", tmp_path / "out.fasta", re.compile(r"^\s*#"), "in") == "pET29b.gb"
+    assert (tmp_path / "out.fasta").read_text() == ">in"
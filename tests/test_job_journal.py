@@ -0,0 +1,99 @@
+import pytest
+
+from job_journal import MISSING_REFRESHES, JobJournal, combine_states
+
+
+@pytest.fixture
+def slurm(tmp_path, stub_command):
+    squeue, sacct = stub_command("squeue"), stub_command("sacct")
+    journal = JobJournal(str(tmp_path / "jobs.sqlite"), squeue=str(squeue.path), sacct=str(sacct.path))
+    return journal, squeue, sacct
+
+
+def states(journal):
+    return dict(journal.db.execute("SELECT job_id, state FROM jobs").fetchall())
+
+
+def test_pending_running_completed(slurm):
+    journal, squeue, sacct = slurm
+    assert journal.record("Submitted batch job 12345", "a", "test") == "12345"
+    squeue.set("12345|PENDING|2024-01-02T03:04:05\n")
+    assert journal.refresh() == 1
+    assert states(journal) == {"12345": "PENDING"}
+
+    squeue.set("12345|RUNNING|2024-01-02T03:04:05\n")
+    journal.refresh()
+    assert states(journal) == {"12345": "RUNNING"}
+
+    squeue.set("")
+    sacct.set("12345|COMPLETED|2024-01-02T03:04:05|2024-01-02T04:04:05\n")
+    journal.refresh()
+    assert states(journal) == {"12345": "COMPLETED"}
+    started, ended = journal.db.execute("SELECT started, ended FROM jobs").fetchone()
+    assert ended - started == 3600
+    assert journal.open_jobs() == []
+
+
+def test_array_tasks_are_combined(slurm):
+    journal, squeue, sacct = slurm
+    journal.record("777", "batch", "test")
+    journal.record("777", "a", "test", array_task=0)
+    journal.record("777", "b", "test", array_task=1)
+    squeue.set("777_0|PENDING|N/A\n777_1|RUNNING|2024-01-02T03:04:05\n")
+    journal.refresh()
+    assert states(journal) == {"777": "RUNNING", "777_0": "PENDING", "777_1": "RUNNING"}
+
+    squeue.set("")
+    sacct.set("777_0|COMPLETED|2024-01-02T03:04:05|2024-01-02T03:10:00\n777_1|FAILED|2024-01-02T03:04:05|2024-01-02T03:20:00\n")
+    journal.refresh()
+    assert states(journal) == {"777": "FAILED", "777_0": "COMPLETED", "777_1": "FAILED"}
+
+
+def test_combine_states():
+    assert combine_states(["COMPLETED", "PENDING"]) == "PENDING"
+    assert combine_states(["COMPLETED", "PENDING", "RUNNING"]) == "RUNNING"
+    assert combine_states(["COMPLETED", "TIMEOUT", "CANCELLED"]) == "TIMEOUT"
+    assert combine_states(["COMPLETED", "COMPLETED"]) == "COMPLETED"
+
+
+def test_cancelled_by_user(slurm):
+    journal, squeue, sacct = slurm
+    journal.record("42", "a", "test", member="a.fasta")
+    sacct.set("42|CANCELLED by 1000|2024-01-02T03:04:05|2024-01-02T03:05:05\n")
+    journal.refresh()
+    assert states(journal) == {"42/a.fasta": "CANCELLED"}
+
+
+@pytest.mark.parametrize("squeue_fails", [True, False])
+def test_failed_queries_keep_the_state(slurm, squeue_fails):
+    journal, squeue, sacct = slurm
+    journal.record("12345", "a", "test")
+    squeue.set("12345|RUNNING|2024-01-02T03:04:05\n")
+    journal.refresh()
+
+    squeue.set("", code=1 if squeue_fails else 0)
+    sacct.set("", code=1)
+    for _ in range(2 * MISSING_REFRESHES):
+        journal.refresh()
+    assert states(journal) == {"12345": "RUNNING"}
+    assert journal.open_jobs() == ["12345"]
+
+
+def test_missing_jobs_become_unknown_after_several_refreshes(slurm):
+    journal, squeue, sacct = slurm
+    journal.record("12345", "a", "test")
+    for _ in range(MISSING_REFRESHES - 1):
+        journal.refresh()
+        assert states(journal) == {"12345": "MISSING"}
+
+    # recorded by slurmdbd in the meantime
+    sacct.set("12345|COMPLETED|2024-01-02T03:04:05|2024-01-02T04:04:05\n")
+    journal.refresh()
+    assert states(journal) == {"12345": "COMPLETED"}
+
+    journal.record("12346", "b", "test")
+    sacct.set("")
+    for _ in range(MISSING_REFRESHES):
+        journal.refresh()
+    assert states(journal)["12346"] == "UNKNOWN"
+    assert journal.open_jobs() == []
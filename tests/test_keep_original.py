@@ -0,0 +1,56 @@
+import errno
+import os
+import shutil
+
+import pytest
+
+import watcher_utils
+from watcher_utils import keep_original
+
+
+def test_original_is_moved_if_the_input_is_removed_anyway(tmp_path):
+    (tmp_path / "in.fasta").write_text(">a\nMKV\n")
+    (tmp_path / "in.fasta.original").write_text("of an earlier run")
+    inode = (tmp_path / "in.fasta").stat().st_ino
+    assert keep_original(str(tmp_path / "in.fasta"), str(tmp_path / "in.fasta.original"), move=True) is True
+    assert not (tmp_path / "in.fasta").exists()
+    assert (tmp_path / "in.fasta.original").stat().st_ino == inode
+
+
+def test_original_is_copied_across_filesystems(tmp_path, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(watcher_utils.os, "rename", cross_device)
+    (tmp_path / "in.fasta").write_text(">a\nMKV\n")
+    assert keep_original(str(tmp_path / "in.fasta"), str(tmp_path / "in.fasta.original"), move=True) is False
+    assert (tmp_path / "in.fasta.original").read_text() == ">a\nMKV\n"
+
+
+@pytest.mark.parametrize("reflinks", [True, False])
+def test_dry_run_keeps_the_input(tmp_path, monkeypatch, reflinks):
+    reflinked = []
+
+    def reflink(src, dst):
+        if not reflinks:
+            raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+        shutil.copyfile(src, dst)
+        reflinked.append(dst)
+
+    monkeypatch.setattr(watcher_utils, "reflink", reflink)
+    (tmp_path / "in.fasta").write_text(">a\nMKV\n")
+    assert keep_original(str(tmp_path / "in.fasta"), str(tmp_path / "in.fasta.original"), move=False) is False
+    assert reflinked == ([str(tmp_path / "in.fasta.original")] if reflinks else [])
+    # not a hardlink, the input may still be rewritten
+    (tmp_path / "in.fasta").write_text(">a\nMKL\n")
+    assert (tmp_path / "in.fasta.original").read_text() == ">a\nMKV\n"
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_watcher_keeps_the_input_only_in_a_dry_run(af2slurm_watcher, tmp_path, dry_run):
+    (tmp_path / "in.fasta").write_text("# --msa-mode single_sequence\nMKV*\n")
+    target, out_folder, arguments = af2slurm_watcher.move_over_fasta_file(str(tmp_path / "in.fasta"), str(tmp_path / "out"), dry_run=dry_run)
+    assert (target, out_folder, arguments) == (tmp_path / "out" / "in" / "in.fasta", tmp_path / "out" / "in", "--msa-mode single_sequence")
+    assert (tmp_path / "in.fasta").exists() == dry_run
+    assert (tmp_path / "out" / "in" / "in.fasta.original").read_text() == "# --msa-mode single_sequence\nMKV*\n"
+    assert target.read_text() == ">in\nMKV"
@@ -0,0 +1,18 @@
+import random
+
+
+def test_length_packed_groups_respect_the_limits(af2slurm_parallel):
+    rng = random.Random(0)
+    seqs = ["A" * rng.randint(50, 400) for _ in range(200)]
+    groups = af2slurm_parallel.group_sequences_length_packed(seqs, 10, 2000, 10)
+    assert sorted(seq for g in groups for seq in g) == sorted(seqs)
+    for g in groups:
+        assert len(g) <= 10
+        assert sum(len(seq) for seq in g) <= 2000
+        assert [len(seq) for seq in g] == sorted(len(seq) for seq in g)
+
+
+def test_length_windows_share_a_group(af2slurm_parallel):
+    seqs = ["A" * n for n in [100, 105, 300, 108, 302]]
+    groups = af2slurm_parallel.group_sequences_length_packed(seqs, 3, 10000, 10)
+    assert [[len(seq) for seq in g] for g in groups] == [[100, 105, 108], [300, 302]]
@@ -0,0 +1,54 @@
+from conftest import REPO_DIR
+from msa_cache import MSACache, build_a3m, extract_chain_msas, parse_msa_settings, prepare_msa_inputs, unique_chains
+
+BINDER = "MMEAVRDFLERASEYCRSIGKEEAAERIDEFLERLDESNMKSVIEETLELLREVL"
+TARGET = "CSQNEYFDSLLHACIPCQLRCSSNTPPLTCQRYCNA"
+
+
+def test_example_a3m_round_trip():
+    chain_msas = extract_chain_msas((REPO_DIR / "example" / "complex_msa.a3m").read_text())
+    assert list(chain_msas) == [BINDER, TARGET]
+
+    a3m = build_a3m([BINDER, TARGET], [1, 2], [chain_msas[BINDER], chain_msas[TARGET]])
+    lines = a3m.splitlines()
+    assert lines[0] == f"#{len(BINDER)},{len(TARGET)}\t1,2"
+    assert lines[1:3] == [">101\t102", BINDER + TARGET]
+    assert lines[3:5] == [">101", BINDER + "-" * len(TARGET)]
+    # without the insertions (lower case), every row is aligned to the whole query
+    aligned = [sum(not c.islower() for c in line) for line in lines[2:] if not line.startswith(">")]
+    assert set(aligned) == {len(BINDER + TARGET)}
+    assert extract_chain_msas(a3m) == chain_msas
+
+
+def test_monomer_a3m_has_no_extra_query_row():
+    a3m = build_a3m([TARGET], [2], [[">101", TARGET, ">hit", TARGET.lower()]])
+    assert a3m.splitlines() == [f"#{len(TARGET)}\t2", ">101", TARGET, ">hit", TARGET.lower()]
+
+
+def test_unique_chains():
+    assert unique_chains("ACD:efg:ACD") == (["ACD", "EFG"], [2, 1])
+
+
+def test_parse_msa_settings():
+    assert parse_msa_settings("--num-recycle 3") == ("mmseqs2_uniref_env", "unpaired_paired")
+    assert parse_msa_settings("--msa-mode single_sequence --pair-mode=unpaired") == ("single_sequence", "unpaired")
+
+
+def test_complexes_are_only_served_unpaired(tmp_path):
+    cache = MSACache(str(tmp_path / "cache"), "mmseqs2_uniref_env")
+    chain_msas = extract_chain_msas((REPO_DIR / "example" / "complex_msa.a3m").read_text())
+    for chain, msa in chain_msas.items():
+        cache.put(chain, msa)
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text(f">complex\n{BINDER}:{TARGET}\n>new\n{BINDER}:ACDEF\n")
+
+    inputs, misses = prepare_msa_inputs(fasta, tmp_path / "paired", cache, "unpaired_paired")
+    assert inputs == [fasta] and misses == fasta
+
+    inputs, misses = prepare_msa_inputs(fasta, tmp_path / "unpaired", cache, "unpaired")
+    assert inputs == [tmp_path / "unpaired" / "misses.fasta", tmp_path / "unpaired" / "hits"]
+    assert misses.read_text() == f">new\n{BINDER}:ACDEF\n"
+    hit = (tmp_path / "unpaired" / "hits" / "complex.a3m").read_text().splitlines()
+    assert hit[2] == BINDER + TARGET
+    assert cache.stats() == (2, 2, 1)
+    cache.close()
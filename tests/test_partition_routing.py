@@ -0,0 +1,93 @@
+import pytest
+
+from partition_routing import RoutingTable, job_features, merge_slurm_options
+from watcher_utils import AdmissionControl
+
+
+@pytest.mark.parametrize(
+    "rule, message",
+    [
+        ("residues<=400", "has no '-> <slurm options>'"),
+        ("residues<=400 ->", "has no '-> <slurm options>'"),
+        ("residues~400 -> --partition=gpu", "can't parse condition 'residues~400'"),
+    ],
+)
+def test_invalid_rules(rule, message):
+    with pytest.raises(ValueError, match=message):
+        RoutingTable([rule])
+
+
+def test_first_matching_rule_decides():
+    table = RoutingTable([
+        "residues<=400 chains=1 -> --partition=gpu-short",
+        "msa_mode=single_sequence -> --cpus-per-task=8",
+        "-> --partition=gpu-long",
+    ])
+    slurm_args = "--partition=gpu --cpus-per-task=2"
+    small = {"residues": 300, "chains": 1, "msa_mode": "mmseqs2_uniref_env"}
+    single = {"residues": 900, "chains": 2, "msa_mode": "single_sequence"}
+    large = {"residues": 900, "chains": 2, "msa_mode": "mmseqs2_uniref_env"}
+    assert table.route(slurm_args, small) == "--cpus-per-task=2 --partition=gpu-short"
+    assert table.route(slurm_args, single) == "--partition=gpu --cpus-per-task=8"
+    assert table.route(slurm_args, large) == "--cpus-per-task=2 --partition=gpu-long"
+
+
+def test_conditions_on_missing_or_mistyped_features_do_not_match():
+    table = RoutingTable(["model_type<3 -> --partition=a", "queries=two -> --partition=b"])
+    features = {"model_type": "auto", "queries": 2}
+    assert table.route("--partition=gpu", features) == "--partition=gpu"
+
+
+def test_empty_table_keeps_slurm_args():
+    assert RoutingTable([]).route("-p gpu --gres=gpu:1", {"residues": 1}) == "-p gpu --gres=gpu:1"
+
+
+@pytest.mark.parametrize(
+    "slurm_options, override, expected",
+    [
+        ("--partition=gpu --gres=gpu:1", "--partition=cpu", "--gres=gpu:1 --partition=cpu"),
+        ("-p gpu --ntasks=1", "--partition=cpu", "--ntasks=1 --partition=cpu"),
+        ("--partition gpu -c 2", "-c 8", "--partition gpu -c 8"),
+        ("--partition=gpu", "--gres=gpu:A40:1", "--partition=gpu --gres=gpu:A40:1"),
+        ("--comment='a b'", "--partition=cpu", "'--comment=a b' --partition=cpu"),
+    ],
+)
+def test_merge_slurm_options(slurm_options, override, expected):
+    assert merge_slurm_options(slurm_options, override) == expected
+
+
+def test_job_features(tmp_path):
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text(">a\nACDEF:GHI\n>b\nAC\n")
+    features = job_features(fasta, "--msa-mode single_sequence --model-type alphafold2_multimer_v3")
+    assert features["residues"] == 8
+    assert features["chains"] == 2
+    assert features["total_residues"] == 10
+    assert features["queries"] == 2
+    assert features["msa_mode"] == "single_sequence"
+    assert features["model_type"] == "alphafold2_multimer_v3"
+
+
+def test_job_features_without_fasta_header(tmp_path):
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text("# --num-recycle 1\nACDE*:FG\n")
+    features = job_features(fasta)
+    assert (features["residues"], features["chains"], features["queries"]) == (6, 2, 1)
+
+
+def test_admission_counts_files_against_their_routed_partition(tmp_path):
+    paths = []
+    for name in ["long1", "long2", "short1", "short2", "short3"]:
+        path = tmp_path / name
+        path.write_text(">a\nA\n")
+        paths.append(str(path))
+    admission = AdmissionControl({"gpu": 1, "gpu-short": 2}, "gpu")
+    admission.in_flight = {"gpu": 0, "gpu-short": 0}
+
+    partition_of = lambda path: "gpu" if "long" in path else "gpu-short"
+    admitted = admission.admit(paths, partition_of=partition_of)
+    assert admitted == [paths[0], paths[2], paths[3]]
+    assert list(admission.backlog) == [paths[1], paths[4]]
+
+    # without routing all files count against the partition of slurm_args
+    assert AdmissionControl({"gpu": 1}, "gpu").admit(paths) == [paths[0]]
@@ -0,0 +1,23 @@
+import random
+import threading
+import time
+
+from watcher_utils import run_pipeline
+
+
+def test_pipeline_submits_in_the_order_of_the_files():
+    submitted = []
+    lock = threading.Lock()
+    rng = random.Random(0)
+    delays = {f: rng.random() * 0.02 for f in range(20)}
+
+    def prepare(f):
+        time.sleep(delays[f])
+        return None if f == 3 else f
+
+    def submit(job):
+        with lock:
+            submitted.append(job)
+
+    run_pipeline(list(range(20)), prepare, submit, prepare_workers=4, max_concurrent_submits=1)
+    assert submitted == [f for f in range(20) if f != 3]
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+
+def write_proteinmpnn(path, designs):
+    lines = [">native, score=1.0, global_score=1.0\n", "MNATIVE\n"]
+    for n, (sequence, score) in enumerate(designs, start=1):
+        lines += [f">T=0.1, sample={n}, score={score}, global_score={score}, seq_recovery=0.5\n", f"{sequence}\n"]
+    path.write_text("".join(lines))
+
+
+def reference_top(designs, keep, deduplicate):
+    best = {}
+    candidates = []
+    for n, (sequence, score) in enumerate(designs, start=1):
+        if not deduplicate:
+            candidates.append((score, n, sequence))
+        elif sequence not in best or score < best[sequence][0]:
+            best[sequence] = (score, n)
+    if deduplicate:
+        candidates = [(score, n, sequence) for sequence, (score, n) in best.items()]
+    return [(sequence, n) for _, n, sequence in sorted(candidates)][: max(keep - 1, 0)]
+
+
+@pytest.mark.parametrize("deduplicate", [True, False])
+def test_select_top_proteinmpnn(af2slurm_parallel, tmp_path, deduplicate):
+    rng = random.Random(1)
+    for trial in range(200):
+        designs = [(rng.choice("ABCDEFG") * 3, rng.choice([0.5, 0.7, 1.0, 1.5])) for _ in range(rng.randint(1, 40))]
+        keep = rng.randint(0, 8)
+        path = tmp_path / f"{trial}.fasta"
+        write_proteinmpnn(path, designs)
+        selected = af2slurm_parallel.select_top_proteinmpnn(path, keep, deduplicate=deduplicate)
+        designs_kept = [(record.seq, int(record.id.split("|")[0])) for record in selected if record.id != "Original_sequence"]
+        assert designs_kept == reference_top(designs, keep, deduplicate)
+        if keep:
+            assert selected[0].id == "Original_sequence" and selected[0].seq == "MNATIVE"
+
+
+def test_selected_records_keep_the_whole_header(af2slurm_parallel, tmp_path):
+    path = tmp_path / "designs.fasta"
+    write_proteinmpnn(path, [("AAA", 0.5)])
+    native, design = af2slurm_parallel.select_top_proteinmpnn(path, 2)
+    assert (native.id, native.description) == ("Original_sequence", "")
+    assert design.id == "1|0.5"
+    assert design.description == "1|0.5 0.1 0.5"
@@ -0,0 +1,114 @@
+import zipfile
+
+import pytest
+
+import result_archive
+from job_journal import JobJournal
+from result_archive import (
+    ResultArchive, archive_path, compact, compact_completed, completed_journal_folders, finished_folders,
+)
+
+
+def make_folder(folder, files):
+    for name, text in files.items():
+        (folder / name).parent.mkdir(parents=True, exist_ok=True)
+        (folder / name).write_text(text)
+    return folder
+
+
+def test_compact_verifies_the_archive_before_removing_the_folder(tmp_path):
+    folder = make_folder(tmp_path / "g0001", {"a.done.txt": "", "a_scores.json": "{}", "msas/a.a3m": ">101\nMKV\n"})
+    assert compact(folder) == tmp_path / "g0001.outputs.zip"
+    assert not folder.exists()
+    with zipfile.ZipFile(archive_path(folder)) as archive:
+        assert sorted(archive.namelist()) == ["a.done.txt", "a_scores.json", "msas/a.a3m"]
+        assert archive.read("msas/a.a3m") == b">101\nMKV\n"
+
+
+def test_folder_is_kept_if_the_archive_can_not_be_verified(tmp_path, monkeypatch):
+    folder = make_folder(tmp_path / "g0001", {"a_scores.json": "{}"})
+    monkeypatch.setattr(zipfile.ZipFile, "testzip", lambda self: "a_scores.json")
+    with pytest.raises(OSError):
+        compact(folder)
+    assert (folder / "a_scores.json").exists()
+    assert list(tmp_path.iterdir()) == [folder]
+
+
+def test_new_files_are_merged_into_the_existing_archive(tmp_path):
+    folder = make_folder(tmp_path / "g0001", {"a.done.txt": "", "log.txt": "first"})
+    compact(folder)
+    # a query that was predicted again after the first compaction
+    make_folder(folder, {"b.done.txt": "", "log.txt": "second"})
+    compact(folder)
+    with zipfile.ZipFile(archive_path(folder)) as archive:
+        assert sorted(archive.namelist()) == ["a.done.txt", "b.done.txt", "log.txt"]
+        assert archive.read("log.txt") == b"second"
+
+
+def test_finished_folders(tmp_path):
+    # af2slurm-parallel: the queries are in out_dir/gNNNN.fasta
+    (tmp_path / "g0001.fasta").write_text(">1|0.9\nMKV\n>2|1.2\nMKL\n")
+    make_folder(tmp_path / "g0001", {"1_0.9.done.txt": "", "2_1.2.done.txt": ""})
+    (tmp_path / "g0002.fasta").write_text(">3|0.8\nMKV\n>4|1.0\nMKL\n")
+    make_folder(tmp_path / "g0002", {"3_0.8.done.txt": ""})
+    # af2slurm-watcher: the queries are in the copy of the input in its folder
+    make_folder(tmp_path / "single", {"single.a3m": "#3\t1\n>101\nMKV\n", "single.done.txt": ""})
+    make_folder(tmp_path / "design", {"design.fasta.txt": ">design\nMKV\n"})
+    # domesticator output is never compacted
+    make_folder(tmp_path / "protein", {"protein.pdb": "END\n", "protein.done.txt": ""})
+    assert finished_folders(tmp_path) == [tmp_path / "g0001", tmp_path / "single"]
+
+
+def test_completed_journal_folders(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.sqlite"))
+    folders = {name: make_folder(tmp_path / name, {"x": ""}) for name in ["done", "rerun", "running", "parallel"]}
+    journal.record("1", "done", "af2slurm-watcher", out_folder=str(folders["done"]))
+    journal.record("2", "rerun", "af2slurm-watcher", out_folder=str(folders["rerun"]))
+    journal.record("3", "rerun", "af2slurm-watcher", out_folder=str(folders["rerun"]))
+    journal.record("4", "running", "af2slurm-watcher", out_folder=str(folders["running"]))
+    journal.record("5", "parallel", "af2slurm-parallel", out_folder=str(folders["parallel"]))
+    journal.record("6", "gone", "af2slurm-watcher", out_folder=str(tmp_path / "gone"))
+    with journal.db:
+        journal.db.execute("UPDATE jobs SET state = 'COMPLETED' WHERE job_id IN ('1', '2', '5', '6')")
+        journal.db.execute("UPDATE jobs SET state = 'RUNNING' WHERE job_id IN ('3', '4')")
+    assert completed_journal_folders(str(tmp_path / "jobs.sqlite")) == [folders["done"]]
+
+    with journal.db:
+        journal.db.execute("UPDATE jobs SET state = 'COMPLETED' WHERE job_id = '3'")
+    assert sorted(completed_journal_folders(str(tmp_path / "jobs.sqlite"))) == [folders["done"], folders["rerun"]]
+
+
+def test_compact_completed_stops_after_the_budget(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.sqlite"))
+    for n in range(3):
+        folder = make_folder(tmp_path / f"job{n}", {"x": ""})
+        journal.record(str(n), folder.name, "dom2slurm-watcher", out_folder=str(folder))
+    with journal.db:
+        journal.db.execute("UPDATE jobs SET state = 'COMPLETED'")
+    assert compact_completed(str(tmp_path / "jobs.sqlite"), budget_s=0) == 1
+    assert compact_completed(str(tmp_path / "jobs.sqlite")) == 2
+    assert len(list(tmp_path.glob("job*.outputs.zip"))) == 3
+
+
+def test_model_pdb_is_read_lazily(tmp_path, monkeypatch):
+    folder = make_folder(tmp_path / "g0001", {
+        "a_unrelaxed_rank_001_alphafold2_ptm_model_3_seed_000.pdb": "unrelaxed 1",
+        "a_relaxed_rank_001_alphafold2_ptm_model_3_seed_000.pdb": "relaxed 1",
+        "a_unrelaxed_rank_002_alphafold2_ptm_model_1_seed_000.pdb": "unrelaxed 2",
+        "b_unrelaxed_rank_1_model_2.pdb": "old colabfold",
+    })
+    archive = ResultArchive(compact(folder))
+    assert archive._zip is None  # nothing is read before the first member is needed
+
+    opened = []
+    monkeypatch.setattr(result_archive.ResultArchive, "open", lambda self, member: opened.append(member) or self.zip.open(member))
+    assert archive.model_pdb("a") == "relaxed 1"
+    assert archive.model_pdb("a", rank=2) == "unrelaxed 2"
+    assert archive.model_pdb("b") == "old colabfold"
+    assert archive.model_pdb("c") is None
+    assert opened == [
+        "a_relaxed_rank_001_alphafold2_ptm_model_3_seed_000.pdb", "a_unrelaxed_rank_002_alphafold2_ptm_model_1_seed_000.pdb",
+        "b_unrelaxed_rank_1_model_2.pdb",
+    ]
+    archive.close()
+    assert archive._zip is None
@@ -0,0 +1,92 @@
+import pytest
+
+from result_archive import compact
+from result_cache import ResultCache, apply_result_cache, normalize_args, normalize_query
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), "colabfold_batch", "--num-recycle 3")
+    yield cache
+    cache.close()
+
+
+def predict(folder, jobname, done=True):
+    """The outputs colabfold_batch leaves for one query"""
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"{jobname}_scores_rank_001_alphafold2_ptm_model_1_seed_000.json").write_text(jobname)
+    (folder / f"{jobname}_unrelaxed_rank_001_alphafold2_ptm_model_1_seed_000.pdb").write_text(jobname)
+    (folder / f"{jobname}_env").mkdir()
+    (folder / f"{jobname}_env" / "uniref.a3m").write_text(jobname)
+    if done:
+        (folder / f"{jobname}.done.txt").write_text("")
+
+
+def test_normalize_args_ignores_the_option_order():
+    assert normalize_args("--num-recycle 3 --amber --msa-mode=single_sequence") == normalize_args(
+        "--msa-mode single_sequence --amber --num-recycle=3"
+    )
+    assert normalize_args("--num-recycle 3") != normalize_args("--num-recycle 6")
+    assert normalize_query("mkv lAG*:") == "MKVLAG"
+
+
+def test_arguments_are_part_of_the_key(cache, tmp_path):
+    assert cache.with_arguments("--amber --num-recycle=3").key("MKV") == cache.with_arguments("--num-recycle 3 --amber").key("mkv*")
+    assert cache.with_arguments("--amber").key("MKV") != cache.key("MKV")
+    other = ResultCache(str(tmp_path / "cache"), "other_colabfold", "--num-recycle 3")
+    assert other.key("MKV") != cache.key("MKV")
+    other.close()
+
+
+def test_only_finished_predictions_are_used(cache, tmp_path):
+    (tmp_path / "first.fasta").write_text(">a\nMKV\n")
+    cache.register(tmp_path / "first.fasta", tmp_path / "first")
+    assert cache.lookup("MKV") is None  # still running
+    predict(tmp_path / "first", "a", done=False)
+    assert cache.lookup("MKV") is None  # failed, or still writing
+    (tmp_path / "first" / "a.done.txt").write_text("")
+    assert cache.lookup("MKV") == (str((tmp_path / "first").resolve()), "a")
+
+
+def test_hits_are_linked_and_misses_predicted(cache, tmp_path):
+    (tmp_path / "first.fasta").write_text(">a\nMKV\n>b\nMLL\n")
+    cache.register(tmp_path / "first.fasta", tmp_path / "first")
+    predict(tmp_path / "first", "a")
+
+    (tmp_path / "second.fasta").write_text(">new|1.0\nmkv*\n>c\nMAA\n>b\nMLL\n")
+    misses = apply_result_cache(tmp_path / "second.fasta", tmp_path / "second", cache, tmp_path / "misses.fasta")
+    assert misses == tmp_path / "misses.fasta"
+    assert misses.read_text() == ">c\nMAA\n>b\nMLL\n"
+    # linked under the job name of the new query
+    linked = tmp_path / "second" / "new_1.0_scores_rank_001_alphafold2_ptm_model_1_seed_000.json"
+    assert linked.read_text() == "a"
+    assert linked.stat().st_ino == (tmp_path / "first" / "a_scores_rank_001_alphafold2_ptm_model_1_seed_000.json").stat().st_ino
+    assert (tmp_path / "second" / "new_1.0_env" / "uniref.a3m").read_text() == "a"
+    assert (tmp_path / "second" / "new_1.0.done.txt").exists()
+
+
+def test_all_hits_and_no_hits(cache, tmp_path):
+    (tmp_path / "first.fasta").write_text(">a\nMKV\n")
+    cache.register(tmp_path / "first.fasta", tmp_path / "first")
+    predict(tmp_path / "first", "a")
+    (tmp_path / "same.fasta").write_text(">again\nMKV\n")
+    assert apply_result_cache(tmp_path / "same.fasta", tmp_path / "same", cache, tmp_path / "misses.fasta") is None
+    (tmp_path / "other.fasta").write_text(">other\nMAA\n")
+    assert apply_result_cache(tmp_path / "other.fasta", tmp_path / "other", cache, tmp_path / "misses.fasta") == tmp_path / "other.fasta"
+    assert not (tmp_path / "misses.fasta").exists()
+
+
+def test_results_are_extracted_from_archives(cache, tmp_path):
+    (tmp_path / "first.fasta").write_text(">a\nMKV\n")
+    cache.register(tmp_path / "first.fasta", tmp_path / "first")
+    predict(tmp_path / "first", "a")
+    predict(tmp_path / "first", "unrelated")
+    compact(tmp_path / "first")
+
+    (tmp_path / "second.fasta").write_text(">renamed\nMKV\n")
+    assert apply_result_cache(tmp_path / "second.fasta", tmp_path / "second", cache, tmp_path / "misses.fasta") is None
+    assert sorted(path.name for path in (tmp_path / "second").iterdir()) == [
+        "renamed.done.txt", "renamed_env", "renamed_scores_rank_001_alphafold2_ptm_model_1_seed_000.json",
+        "renamed_unrelaxed_rank_001_alphafold2_ptm_model_1_seed_000.pdb",
+    ]
+    assert (tmp_path / "second" / "renamed_env" / "uniref.a3m").read_text() == "a"
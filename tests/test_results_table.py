@@ -0,0 +1,87 @@
+import json
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from results_table import ResultsTable, top_n  # noqa: E402
+
+
+def write_scores(folder, jobname, rank, model, plddt, ptm=0.5, max_pae=10.0):
+    folder.mkdir(exist_ok=True)
+    path = folder / f"{jobname}_scores_rank_{rank:03d}_alphafold2_ptm_model_{model}_seed_000.json"
+    path.write_text(json.dumps({"plddt": plddt, "ptm": ptm, "max_pae": max_pae}))
+    return path
+
+
+@pytest.fixture
+def run(tmp_path):
+    """af2slurm-parallel output with one group of two ProteinMPNN samples and two models each"""
+    (tmp_path / "g0001.fasta").write_text(">1|0.9\nMKV\n>2|1.2\nMKL\n")
+    group = tmp_path / "g0001"
+    write_scores(group, "1_0.9", 1, 3, [80, 90], ptm=0.7, max_pae=5.0)
+    write_scores(group, "1_0.9", 2, 1, [60, 70])
+    write_scores(group, "2_1.2", 1, 2, [50, 60], ptm=0.8, max_pae=20.0)
+    (group / "config.json").write_text("{}")
+    return tmp_path
+
+
+def test_ingest_maps_rows_to_the_sequence_ids(run):
+    results = ResultsTable(run)
+    assert results.ingest() == 3
+    table = results.load()
+    assert sorted(zip(table["id"], table["rank"])) == [("1|0.9", 1), ("1|0.9", 2), ("2|1.2", 1)]
+    row = table[(table["id"] == "1|0.9") & (table["rank"] == 1)][0]
+    assert (row["sample"], row["mpnn_score"], row["model"], row["length"]) == (1, 0.9, 3, 2)
+    assert row["plddt"] == 85 and row["ptm"] == 0.7 and math.isnan(row["iptm"])
+    assert len((run / "results" / "scores.csv").read_text().splitlines()) == 4
+
+
+def test_ingest_only_adds_new_files(run):
+    results = ResultsTable(run)
+    results.ingest()
+    assert results.ingest() == 0
+    write_scores(run / "g0001", "2_1.2", 2, 4, [40, 50])
+    assert results.ingest() == 1
+    assert len(results.load()) == 4
+    assert len(list((run / "results" / "chunks").glob("*.npy"))) == 2
+    assert len((run / "results" / "scores.csv").read_text().splitlines()) == 5
+    assert len(ResultsTable(run).load()) == 4
+
+
+def test_interrupted_ingest_leaves_the_table_as_it_was(run, monkeypatch):
+    results = ResultsTable(run)
+    results.ingest()
+    csv_text = (run / "results" / "scores.csv").read_text()
+    write_scores(run / "g0001", "2_1.2", 2, 4, [40, 50])
+
+    # killed after the chunk and the CSV rows were written, before the index was updated
+    def crash(rows):
+        ResultsTable.append_csv(results, rows)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(results, "append_csv", crash)
+    with pytest.raises(KeyboardInterrupt):
+        results.ingest()
+    assert len(results.load()) == 3
+
+    monkeypatch.undo()
+    assert results.ingest() == 1
+    assert len(results.load()) == 4
+    lines = (run / "results" / "scores.csv").read_text().splitlines()
+    assert lines[:4] == csv_text.splitlines() and len(lines) == 5
+
+
+def test_top_n(run):
+    results = ResultsTable(run)
+    results.ingest()
+    table = results.load()
+    assert list(top_n(table, by="plddt")["id"]) == ["1|0.9", "2|1.2"]
+    assert list(top_n(table, n=1, by="ptm")["id"]) == ["2|1.2"]
+    # lower is better for the PAE and the ProteinMPNN score
+    assert list(top_n(table, by="max_pae")["id"]) == ["1|0.9", "2|1.2"]
+    assert list(top_n(table, by="mpnn_score")["id"]) == ["1|0.9", "2|1.2"]
+    assert len(top_n(table, best_model_only=False)) == 3
+    # rows without the score (no ipTM for monomers) come last
+    assert len(top_n(table, by="iptm")) == 2
@@ -0,0 +1,39 @@
+from runtime_db import RuntimeDB, has_time_limit
+
+
+def add_job(db, job_id, settings, size, submitted, state, elapsed):
+    with db.db:
+        db.db.execute("INSERT INTO runtimes VALUES (?, ?, ?, ?, ?, ?)", (job_id, settings, size, submitted, state, elapsed))
+
+
+def test_no_limit_without_enough_completed_jobs(tmp_path):
+    db = RuntimeDB(str(tmp_path / "runtimes.sqlite"), min_samples=5)
+    for n in range(4):
+        add_job(db, str(n), "s", 100, n, "COMPLETED", 1000)
+    assert db.time_limit("--partition=gpu", [("s", 100)]) == ""
+
+
+def test_limit_covers_the_slowest_job(tmp_path):
+    db = RuntimeDB(str(tmp_path / "runtimes.sqlite"), margin=1.5, padding_s=600)
+    for n, elapsed in enumerate([1000, 1000, 1000, 1000, 1400]):
+        add_job(db, str(n), "s", 100, n, "COMPLETED", elapsed)
+    assert db.estimate("s", 100) == 1400 * 1.5 + 600
+    assert db.time_limit("--time=60", [("s", 100)]) == ""
+
+
+def test_timeouts_raise_the_limit(tmp_path):
+    db = RuntimeDB(str(tmp_path / "runtimes.sqlite"), margin=1.5, padding_s=600)
+    for n in range(5):
+        add_job(db, str(n), "s", 100, n, "COMPLETED", 1000)
+    limit = db.estimate("s", 100)
+    add_job(db, "t1", "s", 100, 10, "TIMEOUT", limit)
+    raised = db.estimate("s", 100)
+    assert raised >= (limit + 600) * 1.5 + 600
+    add_job(db, "t2", "s", 100, 11, "TIMEOUT", raised)
+    assert db.estimate("s", 100) > raised
+
+
+def test_has_time_limit():
+    assert has_time_limit("--partition=gpu --time=60")
+    assert has_time_limit("-t 60")
+    assert not has_time_limit("--partition=gpu --time-min=60")
@@ -0,0 +1,51 @@
+import pytest
+
+from scheduling import Scheduler, count_residues, read_priority, split_priority
+
+
+@pytest.mark.parametrize(
+    "arguments, expected",
+    [
+        ("--num-recycle 3", ("--num-recycle 3", 0)),
+        ("priority=5 --num-recycle 3", ("--num-recycle 3", 5)),
+        ("--num-recycle 3 priority=-2", ("--num-recycle 3", -2)),
+        ("pET29b.gb priority=1 --no_idt", ("pET29b.gb --no_idt", 1)),
+        ("--name my_priority=5", ("--name my_priority=5", 0)),
+        ("priority=high", ("priority=high", 0)),
+    ],
+)
+def test_split_priority(arguments, expected):
+    assert split_priority(arguments) == expected
+
+
+def test_read_priority_and_residues(tmp_path):
+    fasta = tmp_path / "q.fasta"
+    fasta.write_text("\n# --num-recycle 1 priority=4\n>a\nACDE\nFG\n>b\nAC:DE\n")
+    assert read_priority(fasta) == 4
+    assert count_residues(fasta) == 10
+
+    a3m = tmp_path / "q.a3m"
+    a3m.write_text(">query\nACDEF\n>hit\nACDEF\n")
+    assert read_priority(a3m) == 0
+    assert count_residues(a3m) == 5
+
+
+def test_priority_goes_before_the_policy(tmp_path):
+    paths = []
+    for name, priority, length in [("a", 0, 300), ("b", 0, 10), ("c", 2, 500)]:
+        path = tmp_path / f"{name}.fasta"
+        path.write_text(f"# priority={priority}\n>{name}\n{'A' * length}\n")
+        paths.append(str(path))
+    assert Scheduler("sjf").order(paths) == [paths[2], paths[1], paths[0]]
+    assert Scheduler("name").order(paths) == [paths[2], paths[0], paths[1]]
+
+
+def test_residues_are_only_counted_when_needed(tmp_path):
+    path = tmp_path / "a.fasta"
+    path.write_text(">a\nACDEF\n")
+    fifo = Scheduler("fifo")
+    fifo.order([str(path)])
+    assert fifo.inputs[str(path)][2] == 0
+    sjf = Scheduler("sjf")
+    sjf.order([str(path)])
+    assert sjf.inputs[str(path)][2] == 5
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from vector_catalogue import VectorCatalogue, check_genbank
+
+GENBANK = "LOCUS       pET29b                    60 bp    DNA     circular\nORIGIN\n        1 atgaaaatcg aagaaggtaa\n//\n"
+
+
+@pytest.mark.parametrize("text, error", [
+    (GENBANK, None),
+    ("\n" + GENBANK, None),
+    (">pET29b\nATGAAA\n", "does not start with a LOCUS line"),
+    ("LOCUS       pET29b\nFEATURES\n", "has no ORIGIN (sequence) section"),
+    ("LOCUS       pET29b\nORIGIN\n        1\n//\n        1 atg\n", "has no sequence after ORIGIN"),
+])
+def test_check_genbank(tmp_path, text, error):
+    (tmp_path / "vector.gb").write_text(text)
+    assert check_genbank(tmp_path / "vector.gb") == error
+
+
+def test_check_genbank_of_a_missing_file(tmp_path):
+    assert check_genbank(tmp_path / "missing.gb").startswith("can't be read")
+
+
+@pytest.fixture
+def vectors(tmp_path):
+    (tmp_path / "vectors").mkdir()
+    (tmp_path / "vectors" / "pET29b.gb").write_text(GENBANK)
+    (tmp_path / "vectors" / "pET28a.gb").write_text(GENBANK)
+    catalogue = VectorCatalogue(str(tmp_path / "vectors"))
+    catalogue.refresh()
+    return catalogue
+
+
+def test_valid_vectors(vectors):
+    assert vectors.validate("pET29b.gb --nstruct 2") is None
+    assert vectors.validate("./pET29b.gb") is None
+
+
+def test_missing_vector_gets_suggestions(vectors):
+    error = vectors.validate("pET29.gb")
+    assert error.startswith("vector pET29.gb is not in")
+    assert error.endswith("Did you mean pET29b.gb, pET28a.gb?")
+    assert vectors.validate("pUC19.gb").endswith("is not in " + str(vectors.folder) + ".")
+    assert vectors.validate("").startswith("no vector given")
+    assert "inside it" in vectors.validate("../pET29b.gb")
+
+
+def test_vectors_in_subfolders(vectors):
+    (vectors.folder / "sub").mkdir()
+    (vectors.folder / "sub" / "pUC19.gb").write_text(GENBANK)
+    assert vectors.validate("sub/pUC19.gb") is None
+    vectors.refresh()
+    assert vectors.validate("sub/pUC19.gb") is None
+
+
+def test_changed_vectors_are_parsed_again(vectors):
+    path = vectors.folder / "pET29b.gb"
+    path.write_text(">not genbank\n")
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert vectors.validate("pET29b.gb") == "vector pET29b.gb does not start with a LOCUS line"
+    path.write_text(GENBANK)
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 2 * 10**9))
+    assert vectors.validate("pET29b.gb") is None
+
+    (vectors.folder / "pET28a.gb").unlink()
+    (vectors.folder / "pUC19.gb").write_text(GENBANK)
+    vectors.refresh()
+    assert sorted(vectors.vectors) == ["pET29b.gb", "pUC19.gb"]
+
+
+def test_no_validation_without_the_folder(tmp_path):
+    vectors = VectorCatalogue(str(tmp_path / "only_on_the_nodes"))
+    vectors.refresh()
+    assert vectors.validate("pET29b.gb") is None
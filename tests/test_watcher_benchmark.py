@@ -0,0 +1,21 @@
+from watcher_benchmark import submitted_inputs
+
+
+def test_single_job_is_named_after_its_input():
+    assert submitted_inputs("bench_000007 1700000000.5 /out/bench_000007/bench_000007.fasta") == ["000007"]
+
+
+def test_array_tasks_are_read_from_the_task_list(tmp_path):
+    task_list = tmp_path / "batch_20240102_030405.tasks"
+    task_list.write_text(
+        "colabfold_batch /out/bench_000001/bench_000001.fasta /out/bench_000001\n"
+        "colabfold_batch /out/bench_000003/bench_000003.a3m /out/bench_000003\n"
+    )
+    assert submitted_inputs(f"batch_20240102_030405 1700000000.5 {task_list}") == ["000001", "000003"]
+
+
+def test_coalesced_members_are_read_from_the_script(tmp_path):
+    script = tmp_path / "coalesced_20240102_030405.sh"
+    script.write_text("#!/bin/bash\ncd /out/bench_000002 && domesticator bench_000002.fasta\ncd /out/bench_000004 && domesticator bench_000004.pdb\n")
+    assert submitted_inputs(f"coalesced_20240102_030405 1700000000.5 {script}") == ["000002", "000004"]
+    assert submitted_inputs(f"coalesced_20240102_030405 1700000000.5 {tmp_path / 'gone.sh'}") == []
@@ -0,0 +1,102 @@
+"""Index of the GenBank vectors in vectors_folder, so dom2slurm can reject inputs with a wrong vector before sbatch.
+
+The folder is listed once and then again only when its mtime changes; a vector is only parsed again when its own
+size or mtime changed. A vector is valid if it starts with a LOCUS line and has an ORIGIN section with sequence data.
+Vectors in subfolders (e.g. sub/pET29b.gb) are parsed when an input names them. While the folder does not exist (e.g.
+it is only mounted on the compute nodes), inputs are not validated at all.
+"""
+import difflib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# Directory mtimes on network filesystems can have coarse resolution (see FolderScanner)
+MTIME_RESOLUTION_S = 2
+
+
+def check_genbank(path) -> Optional[str]:
+    """Returns what is wrong with the GenBank file, or None if it is valid"""
+    try:
+        with open(path, errors="replace") as f:
+            if not next((line for line in f if line.strip()), "").startswith("LOCUS"):
+                return "does not start with a LOCUS line"
+            if not any(line.startswith("ORIGIN") for line in f):
+                return "has no ORIGIN (sequence) section"
+            for line in f:
+                if line.startswith("//"):
+                    break
+                if any(c.isalpha() for c in line):
+                    return None
+    except OSError as e:
+        return f"can't be read: {e}"
+    return "has no sequence after ORIGIN"
+
+
+class VectorCatalogue:
+    def __init__(self, folder: str):
+        self.folder = Path(folder)
+        self.vectors: Dict[str, Tuple[int, int, Optional[str]]] = {}  # name: (size, mtime, error)
+        self.listed_mtime = None
+        self.listed_at = 0
+        self.lock = threading.Lock()  # inputs are validated from several threads (pipeline)
+
+    def _parse(self, name: str, stat: os.stat_result):
+        cached = self.vectors.get(name)
+        if cached is None or cached[:2] != (stat.st_size, stat.st_mtime_ns):
+            error = check_genbank(self.folder / name)
+            if error is not None:
+                logging.warning(f"WARNING: vector {self.folder / name} {error}")
+            self.vectors[name] = (stat.st_size, stat.st_mtime_ns, error)
+
+    def refresh(self):
+        """Lists the folder again if it changed, and parses new and changed vectors"""
+        with self.lock:
+            try:
+                mtime = os.stat(self.folder).st_mtime_ns
+            except OSError as e:
+                logging.warning(f"WARNING: can't list vectors_folder {self.folder}, inputs are not validated: {e}")
+                self.vectors, self.listed_mtime = {}, None
+                return
+            if mtime == self.listed_mtime and time.time() - mtime / 1e9 > MTIME_RESOLUTION_S:
+                return
+            listed_at = time.time()
+            present = set()
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    present.add(entry.name)
+                    self._parse(entry.name, entry.stat())
+            for name in set(self.vectors) - present:
+                if Path(name).name == name:  # vectors in subfolders are checked when an input names them
+                    del self.vectors[name]
+            # a listing made right after a change may have missed part of it, so list again next time
+            self.listed_mtime = mtime if listed_at - mtime / 1e9 > MTIME_RESOLUTION_S else None
+            logging.debug(f"Indexed {len(self.vectors)} vectors in {self.folder}")
+
+    def validate(self, dom_args: str) -> Optional[str]:
+        """Returns why the vector (first argument of dom_args) can't be used, or None if it is a valid vector"""
+        tokens = dom_args.split()
+        if not tokens:
+            return "no vector given, the first line has to be # <vector>.gb [domesticator arguments]"
+        # the vector is a path relative to the folder (domesticator gets vectors_folder/<vector>)
+        name = os.path.normpath(tokens[0])
+        if os.path.isabs(name) or name == os.pardir or name.startswith(os.pardir + os.sep):
+            return f"vector {tokens[0]} has to be a path relative to {self.folder}, inside it"
+        if not self.folder.is_dir():  # warned about by refresh()
+            return None
+        with self.lock:
+            try:
+                # a vector that was changed in place does not change the folder mtime
+                self._parse(name, os.stat(self.folder / name))
+            except OSError:
+                self.vectors.pop(name, None)
+            if name not in self.vectors:
+                suggestions = difflib.get_close_matches(name, list(self.vectors), n=3)
+                hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+                return f"vector {tokens[0]} is not in {self.folder}.{hint}"
+            error = self.vectors[name][2]
+        return None if error is None else f"vector {tokens[0]} {error}"
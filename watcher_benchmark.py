@@ -0,0 +1,331 @@
+#!python
+"""Benchmark of af2slurm-watcher and dom2slurm-watcher, from dropped file to submitted job.
+
+Generates a synthetic in_folder (a mix of .fasta/.fasta.txt/.a3m or .fasta/.pdb files of varied sizes, with and
+without argument lines, missing headers, stars and spaces like the files in example/) and runs the watchers on it:
+
+* dry-run: the files are in in_folder before the watcher starts, the watcher processes them once and exits.
+* stub: a fake sbatch (with a configurable latency) is put on PATH, the files are dropped into in_folder while the
+  watcher is running, and every submission is timed against the moment its file was dropped.
+
+Reports files/s, p50/p99 drop-to-submit latency and peak RSS of the watcher, and stores everything as JSON so that
+results of different versions can be compared:
+
+    python watcher_benchmark.py --n-files 500 --output before.json
+    python watcher_benchmark.py --n-files 500 --output after.json --compare before.json
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import json
+import os
+import platform
+import random
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from statistics import quantiles
+from typing import Dict, List, Optional
+
+REPO_DIR = Path(__file__).resolve().parent
+WATCHER_SCRIPTS = {"af2slurm": REPO_DIR / "af2slurm-watcher.py", "dom2slurm": REPO_DIR / "dom2slurm-watcher.py"}
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+FILE_PREFIX = "bench_"
+# the vector named in the dom2slurm inputs, so that they pass the vector validation
+BENCHMARK_VECTOR = "pET29b.gb"
+VECTOR_GENBANK = """LOCUS       pET29b                    60 bp    DNA     circular
+ORIGIN
+        1 atgaaaatcg aagaaggtaa actggtaatc tggattaacg gcgataaagg ctataacggt
+//
+"""
+
+# Prints a job id and logs "<job name> <time> <script>" for every call, after sleeping for the configured latency. The
+# script is the last argument: the job script, or the task list of an array job
+STUB_SBATCH = """#!/bin/sh
+sleep {latency_s}
+for arg in "$@"; do
+    case "$arg" in --job-name=*) name="${{arg#--job-name=}}";; esac
+    script="$arg"
+done
+echo "$name $(date +%s.%N) $script" >> {log}
+echo $$
+"""
+INPUT_ID = re.compile(rf"{FILE_PREFIX}(\d{{6}})")
+
+
+def random_sequence(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def fasta_input(rng: random.Random, name: str, arguments: str) -> str:
+    """Fasta with 1-3 chains, sometimes without header, sometimes with stars and spaces like example/test-*.fasta"""
+    chains = [random_sequence(rng, rng.randint(50, 800)) for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+    if rng.random() < 0.2:
+        chains = [chain[:20] + " " + chain[20:] + "*" for chain in chains]
+    lines = [f"# {arguments}"] if arguments else []
+    if rng.random() > 0.1:
+        lines.append(f">{name}")
+    lines.append(":".join(chains))
+    return "\n".join(lines) + "\n"
+
+
+def a3m_input(rng: random.Random, arguments: str) -> str:
+    """Single chain colabfold a3m with up to a few thousand MSA rows"""
+    query = random_sequence(rng, rng.randint(50, 500))
+    lines = [f"# {arguments}"] if arguments else []
+    lines += [f"#{len(query)}\t1", ">101", query]
+    for n in range(int(rng.expovariate(1 / 300))):
+        homolog = "".join(c if rng.random() < 0.6 else rng.choice(AMINO_ACIDS + "-") for c in query)
+        lines += [f">UniRef100_{n}", homolog]
+    return "\n".join(lines) + "\n"
+
+
+def pdb_input(rng: random.Random, arguments: str) -> str:
+    lines = [f"# {arguments}"] if arguments else []
+    for n in range(rng.randint(50, 800)):
+        lines.append(f"ATOM  {n + 1:5d}  CA  ALA A{n + 1:4d}    {rng.uniform(-50, 50):8.3f}{rng.uniform(-50, 50):8.3f}"
+                     f"{rng.uniform(-50, 50):8.3f}  1.00  0.00           C")
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+
+def generate_inputs(watcher: str, n_files: int, folder: Path, seed: int) -> List[Path]:
+    """Writes n_files synthetic inputs for watcher to folder. Returns their paths"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(n_files):
+        name = f"{FILE_PREFIX}{i:06d}"
+        kind = rng.random()
+        if watcher == "af2slurm":
+            arguments = "--msa-mode single_sequence" if rng.random() < 0.5 else ""
+            if kind < 0.3:
+                path, text = folder / f"{name}.a3m", a3m_input(rng, arguments)
+            else:
+                path, text = folder / f"{name}{'.fasta.txt' if kind < 0.4 else '.fasta'}", fasta_input(rng, name, arguments)
+        else:
+            arguments = BENCHMARK_VECTOR + (" --nstruct 2" if rng.random() < 0.3 else "")
+            if kind < 0.3:
+                path, text = folder / f"{name}.pdb", pdb_input(rng, arguments)
+            else:
+                path, text = folder / f"{name}.fasta", fasta_input(rng, name, arguments)
+        path.write_text(text)
+        paths.append(path)
+    return paths
+
+
+def write_config(watcher: str, work_dir: Path, scan_interval_s: int, stability_interval_s: float) -> Path:
+    config = work_dir / f"{watcher}.config"
+    settings = {
+        "in_folder": work_dir / "in",
+        "out_folder": work_dir / "out",
+        "log_path_name": work_dir / f"{watcher}.log",
+        "scan_interval_s": scan_interval_s,
+        "stability_interval_s": stability_interval_s,
+        "env_setup_script": "/dev/null",
+        "colabfold_path": "true",
+        "slurm_args": "--partition=bench",
+    }
+    if watcher == "dom2slurm":
+        settings["vectors_folder"] = work_dir / "vectors"
+        settings["vector_validation"] = "true"
+        os.makedirs(work_dir / "vectors", exist_ok=True)
+        (work_dir / "vectors" / BENCHMARK_VECTOR).write_text(VECTOR_GENBANK)
+    config.write_text("".join(f"{key} = {value}\n" for key, value in settings.items()))
+    return config
+
+
+def wait_with_rusage(process: subprocess.Popen) -> float:
+    """Waits for process and returns its peak RSS in MB"""
+    _, _, rusage = os.wait4(process.pid, 0)
+    process.returncode = 0  # reaped by os.wait4, keep Popen from waiting again
+    return rusage.ru_maxrss / 1024
+
+
+def percentile(values: List[float], q: int) -> Optional[float]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def submitted_inputs(line: str) -> List[str]:
+    """Ids of the inputs submitted by a line of the sbatch log. A single input is named in the job name, the inputs of a
+    batch array job are read from its task list and the members of a coalesced job from its script
+    """
+    name, _, script = (line.split(" ", 2) + ["", ""])[:3]
+    match = INPUT_ID.search(name)
+    if match:
+        return [match.group(1)]
+    try:
+        with open(script) as f:
+            return list(dict.fromkeys(INPUT_ID.findall(f.read())))
+    except OSError:
+        return []
+
+
+def run_dry_run(watcher: str, args, work_dir: Path) -> Dict:
+    inputs = generate_inputs(watcher, args.n_files, work_dir / "in", args.seed)
+    input_mb = sum(path.stat().st_size for path in inputs) / 1e6
+    config = write_config(watcher, work_dir, args.scan_interval_s, args.stability_interval_s)
+    command = [sys.executable, str(WATCHER_SCRIPTS[watcher]), "--config", str(config), "--dry-run"]
+    command += shlex.split(args.watcher_args)
+
+    start = time.time()
+    process = subprocess.Popen(command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    peak_rss_mb = wait_with_rusage(process)
+    wall_s = time.time() - start
+    processed = sum(1 for _ in (work_dir / "out").glob(f"{FILE_PREFIX}*/*.original"))
+    return {
+        "processed": processed,
+        "input_mb": round(input_mb, 3),
+        "wall_s": round(wall_s, 3),
+        "files_per_s": round(processed / wall_s, 2),
+        "latency_p50_s": None,
+        "latency_p99_s": None,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def run_stub(watcher: str, args, work_dir: Path) -> Dict:
+    staging = work_dir / "staging"
+    inputs = generate_inputs(watcher, args.n_files, staging, args.seed)
+    input_mb = sum(path.stat().st_size for path in inputs) / 1e6
+    os.makedirs(work_dir / "in", exist_ok=True)
+    config = write_config(watcher, work_dir, args.scan_interval_s, args.stability_interval_s)
+
+    stub_dir = work_dir / "bin"
+    os.makedirs(stub_dir, exist_ok=True)
+    sbatch_log = work_dir / "sbatch.log"
+    sbatch_log.touch()
+    (stub_dir / "sbatch").write_text(STUB_SBATCH.format(latency_s=args.sbatch_latency_s, log=sbatch_log))
+    (stub_dir / "sbatch").chmod(0o755)
+    env = dict(os.environ, PATH=f"{stub_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+
+    command = [sys.executable, str(WATCHER_SCRIPTS[watcher]), "--config", str(config)] + shlex.split(args.watcher_args)
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(args.startup_s)  # let the watcher do its first (empty) scan
+
+    # files are moved in, the way finished files usually arrive; drop times are taken right after the rename
+    dropped = {}
+    start = time.time()
+    for n, path in enumerate(inputs):
+        if args.drop_rate > 0:
+            time.sleep(max(0.0, start + n / args.drop_rate - time.time()))
+        os.rename(path, work_dir / "in" / path.name)
+        dropped[path.name[len(FILE_PREFIX) : len(FILE_PREFIX) + 6]] = time.time()
+
+    submitted = {}
+    read_lines = 0
+    deadline = time.time() + args.timeout_s
+    while len(submitted) < len(dropped) and time.time() < deadline and process.poll() is None:
+        time.sleep(0.2)
+        lines = sbatch_log.read_text().split("\n")[:-1]  # without the line sbatch may still be writing
+        for line in lines[read_lines:]:
+            for key in submitted_inputs(line):
+                submitted.setdefault(key, float(line.split(" ")[1]))
+        read_lines = len(lines)
+    process.terminate()
+    peak_rss_mb = wait_with_rusage(process)
+
+    latencies = sorted(submitted[key] - dropped[key] for key in submitted if key in dropped)
+    wall_s = (max(submitted.values()) - start) if submitted else time.time() - start
+    return {
+        "processed": len(submitted),
+        "input_mb": round(input_mb, 3),
+        "wall_s": round(wall_s, 3),
+        "files_per_s": round(len(submitted) / wall_s, 2),
+        "latency_p50_s": None if not latencies else round(percentile(latencies, 50), 3),
+        "latency_p99_s": None if not latencies else round(percentile(latencies, 99), 3),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_value(value) -> str:
+    return "-" if value is None else f"{value:g}"
+
+
+def print_results(results: List[Dict], baseline: Optional[Dict] = None):
+    baseline_runs = {(r["watcher"], r["mode"]): r for r in (baseline or {}).get("results", [])}
+    print(f"{'watcher':10s} {'mode':8s} {'files':>6s} {'files/s':>9s} {'p50 s':>8s} {'p99 s':>8s} {'RSS MB':>8s}")
+    for r in results:
+        print(f"{r['watcher']:10s} {r['mode']:8s} {r['processed']:6d} {r['files_per_s']:9g} "
+              f"{format_value(r['latency_p50_s']):>8s} {format_value(r['latency_p99_s']):>8s} {r['peak_rss_mb']:8g}")
+        old = baseline_runs.get((r["watcher"], r["mode"]))
+        if old and old["files_per_s"]:
+            print(f"{'':19s} vs {baseline.get('commit')}: {r['files_per_s'] / old['files_per_s']:.2f}x files/s, "
+                  f"p50 {format_value(old['latency_p50_s'])} s, RSS {old['peak_rss_mb']:g} MB")
+
+
+def main():
+    parser = ArgumentParser(
+        prog="watcher_benchmark",
+        description="Measures how fast the watchers get from a dropped file to a submitted job",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--watchers", nargs="+", choices=list(WATCHER_SCRIPTS), default=list(WATCHER_SCRIPTS))
+    parser.add_argument("--modes", nargs="+", choices=["dry-run", "stub"], default=["dry-run", "stub"])
+    parser.add_argument("--n-files", help="Number of synthetic input files", type=int, default=200)
+    parser.add_argument("--seed", help="Seed of the input generator", type=int, default=0)
+    parser.add_argument("--sbatch-latency-s", help="Seconds the fake sbatch takes per call", type=float, default=0.05)
+    parser.add_argument("--drop-rate", help="Drop X files per second into in_folder (0: all at once)", type=float, default=0)
+    parser.add_argument("--scan-interval-s", help="scan_interval_s of the watchers", type=int, default=1)
+    parser.add_argument("--stability-interval-s", help="stability_interval_s of the watchers", type=float, default=0.5)
+    parser.add_argument("--startup-s", help="Seconds to give the watcher to start before dropping files", type=float, default=2)
+    parser.add_argument("--timeout-s", help="Give up waiting for submissions after X seconds", type=float, default=600)
+    parser.add_argument(
+        "--watcher-args", help='Extra arguments for the watchers, e.g. "--pipeline --watch-mode inotify"', default=""
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file", default="watcher_benchmark.json")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with", default=None)
+    parser.add_argument("--keep", help="Keep the benchmark folders", default=False, action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    for watcher in args.watchers:
+        for mode in args.modes:
+            work_dir = Path(tempfile.mkdtemp(prefix=f"{watcher}_{mode}_"))
+            print(f"Running {watcher} {mode} with {args.n_files} files in {work_dir}", flush=True)
+            run = run_dry_run if mode == "dry-run" else run_stub
+            results.append({"watcher": watcher, "mode": mode, **run(watcher, args, work_dir)})
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ["output", "compare", "keep"]},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"Results written to {args.output}")
+    failed = [f"{r['watcher']} {r['mode']}" for r in results if args.n_files and r["processed"] == 0]
+    if failed:
+        sys.exit(f"ERROR: no files were processed by {', '.join(failed)}, see the watcher logs (--keep)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Per-stage metrics of af2slurm-watcher and dom2slurm-watcher in the Prometheus text format.
+
+All stages record into the shared METRICS registry: scanning, preparing (normalising and copying) inputs, sbatch
+calls and the backlog. The watchers write it to a textfile (for the node_exporter textfile collector) and/or serve
+it on a local HTTP port, e.g. to alert on `watcher_sbatch_seconds` or `watcher_sbatch_failures_total`.
+"""
+import cProfile
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+METRIC_HELP = {
+    "scan_seconds": "Time to scan in_folder",
+    "files_found_total": "Input files found in in_folder",
+    "input_bytes_total": "Bytes of input files normalised into the output folders",
+    "prepare_seconds": "Time to prepare an input file for submission (copy, rewrite, caches)",
+    "originals_total": "Inputs kept as .original, by method (rename, reflink, copy)",
+    "rejected_inputs_total": "Input files rejected before submission (e.g. an unknown or broken vector)",
+    "sbatch_seconds": "Time an sbatch call took",
+    "sbatch_failures_total": "sbatch calls that failed",
+    "submitted_jobs_total": "Jobs (or array tasks) submitted",
+    "backlog_files": "Input files waiting for a free slot under max_in_flight",
+    "retry_queue_jobs": "Failed submissions waiting to be retried",
+    "in_flight_jobs": "Our pending and running jobs in the partition",
+    "loop_seconds": "Duration of one iteration of the watcher loop, without waiting for new files",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and histograms"""
+
+    def __init__(self, prefix: str = "watcher"):
+        self.prefix = prefix
+        self.const_labels: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, list]] = {}  # [bucket counts..., sum, count]
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self.counters.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self.histograms.setdefault(name, {})
+            histogram = samples.setdefault(key, [0] * (len(HISTOGRAM_BUCKETS) + 2))
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator that records the duration of every call of the function in the histogram name"""
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _labels(self, key: LabelKey, extra: Dict[str, str] = None) -> str:
+        labels = {**self.const_labels, **dict(key), **(extra or {})}
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+        return "{" + ",".join(f'{label}="{value}"' for label, value in zip(labels, escaped)) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for kind, metrics in [("counter", self.counters), ("gauge", self.gauges), ("histogram", self.histograms)]:
+                for name in sorted(metrics):
+                    full_name = f"{self.prefix}_{name}"
+                    if name in METRIC_HELP:
+                        lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for key, value in metrics[name].items():
+                        if kind != "histogram":
+                            lines.append(f"{full_name}{self._labels(key)} {value:g}")
+                            continue
+                        for bound, count in zip(HISTOGRAM_BUCKETS, value):
+                            lines.append(f"{full_name}_bucket{self._labels(key, {'le': f'{bound:g}'})} {count}")
+                        lines.append(f"{full_name}_bucket{self._labels(key, {'le': '+Inf'})} {value[-1]}")
+                        lines.append(f"{full_name}_sum{self._labels(key)} {value[-2]:g}")
+                        lines.append(f"{full_name}_count{self._labels(key)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Writes the metrics atomically, so the textfile collector never reads a half-written file"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serves the metrics on http://host:port/metrics from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # don't flood the watcher log with scrapes
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+METRICS = Metrics()
+
+
+class PeriodicProfiler:
+    """Profiles the watcher loop with cProfile and dumps the accumulated stats to path every interval_s
+    (view them with `python -m pstats path` or snakeviz). Only the main thread is profiled.
+    """
+
+    def __init__(self, path: str, interval_s: float = 600):
+        self.path = path
+        self.interval_s = interval_s
+        self.last_dump = time.time()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def maybe_dump(self, force: bool = False):
+        if not force and time.time() - self.last_dump < self.interval_s:
+            return
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        self.profile.enable()
+        self.last_dump = time.time()
+        logging.info(f"Wrote profile to {self.path}")
+
+
+class MetricsExporter:
+    """Exports METRICS as configured by the --metrics_file, --metrics_port and --profile options of the watchers"""
+
+    def __init__(self, args, watcher: str):
+        METRICS.const_labels = {"watcher": watcher}
+        self.metrics_file = args.metrics_file
+        if args.metrics_port:
+            METRICS.serve(args.metrics_port)
+        self.profiler = PeriodicProfiler(args.profile, args.profile_interval_s) if args.profile else None
+
+    def export(self, final: bool = False):
+        """Called once per loop iteration, with final on the last one"""
+        if self.metrics_file:
+            try:
+                METRICS.write_textfile(self.metrics_file)
+            except OSError as e:
+                logging.warning(f"WARNING: could not write metrics to {self.metrics_file}: {e}")
+        if self.profiler is not None:
+            self.profiler.maybe_dump(force=final)
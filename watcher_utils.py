@@ -0,0 +1,650 @@
+"""Helpers shared by af2slurm-watcher and dom2slurm-watcher."""
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import getpass
+import heapq
+import itertools
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import select
+import shutil
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Pattern
+
+from scheduling import Scheduler
+from watcher_metrics import METRICS
+
+# inotify event flags, see `man 7 inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+FICLONE = 0x40049409  # ioctl that makes a copy-on-write clone (reflink) of a file on btrfs, XFS, ...
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+_UNIQUE_FILE_COUNTER = itertools.count(1)
+
+
+def reflink(src: str, dst: str):
+    """Copy-on-write clone of src: no data is copied. Raises OSError if the filesystem does not support it"""
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def create_unique_file(folder, prefix: str, suffix: str) -> Path:
+    """Creates a new empty file folder/<prefix>_<time>_<pid>-<counter><suffix> and returns its path.
+    The counter keeps the names of files created in the same second apart, and the file is created with O_EXCL, so a
+    file that already exists (e.g. of another watcher instance) is never overwritten
+    """
+    os.makedirs(folder, exist_ok=True)
+    while True:
+        name = f"{prefix}_{datetime.now():%Y%m%d-%H%M%S}_{os.getpid()}-{next(_UNIQUE_FILE_COUNTER)}{suffix}"
+        try:
+            os.close(os.open(Path(folder) / name, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            return Path(folder) / name
+        except FileExistsError:
+            continue
+
+
+def keep_original(src: str, dst: str, move: bool) -> bool:
+    """Keeps the input file src as dst (the .original backup) with as little I/O as possible.
+    With move (the input is removed afterwards anyway) src is just renamed. Otherwise (dry run) src stays in the input
+    folder and may still be rewritten, so dst is a reflink (copy-on-write) of src, or a copy if reflinks are not
+    supported. A hardlink would change together with src. Across filesystems the data is copied as well.
+    Returns True if src was moved, i.e. the caller must not remove it anymore.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if move:
+        try:
+            os.rename(src, dst)
+            METRICS.inc("originals_total", method="rename")
+            return True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    else:
+        try:
+            reflink(src, dst)
+            METRICS.inc("originals_total", method="reflink")
+            return False
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    METRICS.inc("originals_total", method="copy")
+    return False
+
+
+def normalize_input(src_path, dst_path, args_line: Pattern, header: Optional[str]) -> Optional[str]:
+    """Writes a cleaned up copy of an input file line by line, so memory use does not depend on the file size.
+    Leading blank lines are skipped and a first line matching args_line is taken out.
+    With header (fasta inputs), ">header" is inserted if the file does not start with a fasta header and stars and
+    spaces are removed from the sequence lines. With header=None (.a3m, .pdb) the lines are copied unchanged.
+    Returns the arguments from the first line without the comment char ("" if there are none),
+    or None if the file is empty (dst_path is then not written).
+    """
+    start = time.time()
+    size_bytes = os.path.getsize(src_path)
+    with open(src_path) as source_file:
+        # skip empty lines at the start of the file
+        first_line = next((line.lstrip(" \n") for line in source_file if line.lstrip(" \n")), None)
+        if first_line is None:
+            return None
+        lines = itertools.chain([first_line], source_file)
+
+        arguments = ""
+        if args_line.match(first_line.strip()):
+            arguments = first_line.strip().lstrip("#").strip()  # Remove only the # symbol from the beginning of the line
+            next(lines)
+
+        with open(dst_path, "w") as target_file:
+            separator = ""
+            for line in lines:
+                line = line.rstrip("\n")
+                if header is not None and not separator and not line.startswith(">"):
+                    # add fasta header if it is missing
+                    target_file.write(">" + header)
+                    separator = "\n"
+                if header is not None and not line.startswith(">"):
+                    # get rid of stars and spaces in the sequence
+                    line = line.replace("*", "").replace(" ", "")
+                target_file.write(separator + line)
+                separator = "\n"
+            if header is not None and not separator:
+                target_file.write(">" + header)
+
+    elapsed_s = max(time.time() - start, 1e-6)
+    METRICS.inc("input_bytes_total", size_bytes)
+    size_mb = size_bytes / 1e6
+    logging.debug(f"Normalised {src_path}: {size_mb:.1f} MB in {elapsed_s:.2f} s ({size_mb / elapsed_s:.1f} MB/s)")
+    return arguments
+
+
+def read_input_args(src_path, args_line: Pattern) -> Optional[str]:
+    """Returns the arguments normalize_input would take out of the first line, without copying the file.
+    Returns None if the file is empty
+    """
+    with open(src_path) as source_file:
+        first_line = next((line.strip() for line in source_file if line.strip()), None)
+    if first_line is None:
+        return None
+    return first_line.lstrip("#").strip() if args_line.match(first_line) else ""
+
+
+class FolderScanner:
+    """Lists input files in a folder with a single os.scandir pass per scan.
+    If the folder mtime did not change since the last listing, the folder is not listed again, unless a file that was
+    already returned is still in the folder (e.g. its submission failed), so that it is returned again.
+    With wait_for_stable, a file is only returned once its size and mtime were the same in two consecutive scans,
+    so files that are still being copied into the folder are not picked up half-written.
+    """
+
+    # Directory mtimes on network filesystems can have coarse (1 s or worse) resolution, so a listing made shortly
+    # after the folder changed cannot be trusted to see every file of that change.
+    MTIME_RESOLUTION_S = 2
+
+    def __init__(self, folder: str, extensions: List[str], wait_for_stable: bool = True):
+        self.folder = folder
+        self.extensions = set(extensions)
+        self.max_dots = max(ext.count(".") for ext in self.extensions)
+        self.wait_for_stable = wait_for_stable
+        self.folder_mtime_ns = None
+        self.candidates = {}  # path -> (size, mtime_ns) when last seen, for files not yet returned
+        self.returned = set()  # files returned by the last scan, they are usually moved away before the next one
+
+    def has_extension(self, name: str) -> bool:
+        """True if name ends with one of the extensions (e.g. both .txt and .fasta.txt are checked for x.fasta.txt)"""
+        dot = len(name)
+        for _ in range(self.max_dots):
+            dot = name.rfind(".", 0, dot)
+            if dot <= 0:
+                return False
+            if name[dot:] in self.extensions:
+                return True
+        return False
+
+    @property
+    def pending(self) -> bool:
+        """True if some files were seen but are not stable yet"""
+        return len(self.candidates) > 0
+
+    def scan(self) -> List[str]:
+        """Returns a sorted list of new input files that are ready to be processed"""
+        with METRICS.timer("scan_seconds"):
+            ready = self._scan()
+        METRICS.inc("files_found_total", len(ready))
+        return ready
+
+    def _scan(self) -> List[str]:
+        try:
+            folder_mtime_ns = os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            logging.warning(f"WARNING: input folder {self.folder} does not exist")
+            return []
+
+        self.returned = {path for path in self.returned if os.path.exists(path)}
+        if folder_mtime_ns == self.folder_mtime_ns and not self.returned:
+            # Nothing was added or removed, only check up on the files that were still changing
+            observed = {}
+            for path in self.candidates:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                observed[path] = (stat.st_size, stat.st_mtime_ns)
+        else:
+            observed = {}
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if self.has_extension(entry.name) and entry.is_file():
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        observed[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            if time.time() - folder_mtime_ns / 1e9 > self.MTIME_RESOLUTION_S:
+                self.folder_mtime_ns = folder_mtime_ns
+            else:
+                self.folder_mtime_ns = None  # too recent to trust, list the folder again next time
+
+        if not self.wait_for_stable:
+            ready = sorted(observed)
+            self.candidates = {}
+        else:
+            ready = sorted(path for path, size_mtime in observed.items() if self.candidates.get(path) == size_mtime)
+            self.candidates = {path: size_mtime for path, size_mtime in observed.items() if path not in ready}
+        self.returned = set(ready)
+        return ready
+
+
+class InotifyWatcher:
+    """Minimal inotify wrapper (via ctypes, so no extra dependency) that watches a single folder.
+    Raises OSError if inotify is not available on this system.
+    """
+
+    def __init__(self, folder: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO):
+        self.folder = folder
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify is not available: {e}")
+
+        self.fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        if inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch on {folder} failed: {os.strerror(err)}")
+
+    def wait(self, timeout_s: float) -> Optional[List[str]]:
+        """Blocks until files were written/moved into the folder or until timeout_s passes.
+        Returns sorted full paths of the changed files, or None on timeout or event queue overflow
+        (the caller should then do a full rescan of the folder).
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout_s)
+        if not ready:
+            return None
+
+        names = set()
+        overflow = False
+        while True:  # drain everything that is queued, so a burst of files is handled in one go
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, name_len = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset : offset + name_len].rstrip(b"\0")
+                offset += name_len
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.add(os.path.join(self.folder, os.fsdecode(name)))
+
+        if overflow:
+            logging.warning("inotify event queue overflowed, falling back to a full rescan")
+            return None
+        return sorted(names)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ClaimDirectory:
+    """Lets several watchers (e.g. on different login nodes) serve the same in_folder without submitting a file twice.
+    A watcher claims a file by renaming it into in_folder/.claimed/<instance>/ before processing it. The rename is
+    atomic, so exactly one watcher gets every file and the others just skip it.
+    Every instance keeps renewing the mtime of its .lease file. Files claimed by an instance whose lease is older than
+    lease_timeout_s (because that watcher crashed) are moved back into in_folder and picked up by the next scan.
+    Files this instance claimed but failed to process are renamed to in_folder/<name>.error by reject_unprocessed.
+    """
+
+    LEASE_NAME = ".lease"
+
+    def __init__(self, in_folder: str, instance: str = "", lease_timeout_s: float = 600):
+        self.in_folder = in_folder
+        self.root = os.path.join(in_folder, ".claimed")
+        self.instance = instance or f"{socket.gethostname()}-{os.getpid()}"
+        self.folder = os.path.join(self.root, self.instance)
+        self.lease_timeout_s = lease_timeout_s
+        os.makedirs(self.folder, exist_ok=True)
+        self.renew()
+        # claims left over by an earlier run with the same instance name
+        released = self.release_all(self.folder)
+        if released:
+            logging.info(f"Released {released} files claimed by an earlier run of {self.instance}")
+        # lease times are compared with each other (not with the local clock), so clock skew between nodes does not matter
+        heartbeat = threading.Thread(target=self._keep_renewing, daemon=True)
+        heartbeat.start()
+
+    @property
+    def lease_path(self) -> str:
+        return os.path.join(self.folder, self.LEASE_NAME)
+
+    def renew(self):
+        with open(self.lease_path, "a"):
+            pass
+        os.utime(self.lease_path)
+
+    def _keep_renewing(self):
+        while True:
+            time.sleep(self.lease_timeout_s / 4)
+            try:
+                self.renew()
+            except OSError as e:
+                logging.warning(f"WARNING: could not renew the lease of {self.instance}: {e}")
+
+    def claim(self, path: str) -> Optional[str]:
+        """Moves path into the claim folder of this instance. Returns the new path or None if another watcher was faster"""
+        if os.path.dirname(path) == self.folder:
+            return path  # already claimed
+        claimed_path = os.path.join(self.folder, os.path.basename(path))
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def claim_all(self, paths: List[str]) -> List[str]:
+        claimed = [self.claim(path) for path in paths]
+        if None in claimed:
+            logging.info(f"{claimed.count(None)} files were claimed by another watcher")
+        return [path for path in claimed if path is not None]
+
+    def release_all(self, folder: str) -> int:
+        """Moves all claimed files in folder back into in_folder. Returns the number of files moved"""
+        released = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name == self.LEASE_NAME or not entry.is_file():
+                    continue
+                try:
+                    os.rename(entry.path, os.path.join(self.in_folder, entry.name))
+                except FileNotFoundError:
+                    continue  # another watcher is reclaiming the same folder
+                released += 1
+        return released
+
+    def reject_unprocessed(self) -> int:
+        """Renames the files that are still in the claim folder of this instance after they were processed (so
+        processing them raised) to in_folder/<name>.error. Returns the number of files renamed
+        """
+        rejected = 0
+        with os.scandir(self.folder) as entries:
+            paths = [entry.path for entry in entries if entry.name != self.LEASE_NAME and entry.is_file()]
+        for path in paths:
+            error_path = os.path.join(self.in_folder, os.path.basename(path) + ".error")
+            logging.error(f"Processing {path} failed, renaming it to {error_path}")
+            os.rename(path, error_path)
+            with open(error_path + ".txt", "w") as f:
+                f.write(
+                    f"Processing failed, see the log of watcher {self.instance}\n"
+                    f"Rename {os.path.basename(error_path)} back to {os.path.basename(path)} to try again\n"
+                )
+            rejected += 1
+        return rejected
+
+    def reclaim_expired(self) -> int:
+        """Releases the files of all instances whose lease expired. Returns the number of files released"""
+        own_lease = os.stat(self.lease_path).st_mtime
+        released = 0
+        with os.scandir(self.root) as entries:
+            folders = [entry.path for entry in entries if entry.is_dir() and entry.path != self.folder]
+        for folder in folders:
+            try:
+                try:
+                    lease = os.stat(os.path.join(folder, self.LEASE_NAME)).st_mtime
+                except FileNotFoundError:
+                    lease = os.stat(folder).st_mtime
+                if own_lease - lease < self.lease_timeout_s:
+                    continue
+                count = self.release_all(folder)
+            except FileNotFoundError:
+                continue  # removed by another watcher in the meantime
+            if count:
+                logging.warning(f"Lease of {os.path.basename(folder)} expired, moved {count} claimed files back to {self.in_folder}")
+            try:
+                os.remove(os.path.join(folder, self.LEASE_NAME))
+                os.rmdir(folder)
+            except OSError:
+                pass  # still has files or was removed by another watcher
+            released += count
+        return released
+
+
+def create_folder_watcher(in_folder: str, watch_mode: str) -> Optional[InotifyWatcher]:
+    """Returns an InotifyWatcher if watch_mode is inotify and it is available, None otherwise (= polling)"""
+    if watch_mode != "inotify":
+        return None
+    try:
+        watcher = InotifyWatcher(in_folder)
+    except OSError as e:
+        logging.warning(f"WARNING: could not set up inotify on {in_folder} ({e}), falling back to polling")
+        return None
+    logging.info(f"Watching {in_folder} with inotify")
+    return watcher
+
+
+def wait_for_files(
+    watcher: Optional[InotifyWatcher], scanner: FolderScanner, scan_interval_s: float, stability_interval_s: float
+) -> List[str]:
+    """Waits for the next batch of input files.
+    With inotify, returns as soon as matching files are closed/moved into the folder; a full rescan is still done
+    every scan_interval_s in case an event was missed. Without inotify just sleeps and rescans.
+    If some files are still being written, the folder is checked again after stability_interval_s already.
+    """
+    wait_s = min(scan_interval_s, stability_interval_s) if scanner.pending else scan_interval_s
+    if watcher is None:
+        time.sleep(wait_s)
+        return scanner.scan()
+
+    changed = watcher.wait(wait_s)
+    if changed is None:
+        return scanner.scan()
+    # inotify only reports files after they were closed (or moved in), so they don't need the stability check
+    found = [f for f in changed if scanner.has_extension(os.path.basename(f)) and os.path.isfile(f)]
+    METRICS.inc("files_found_total", len(found))
+    return found
+
+
+def run_pipeline(files: List[str], prepare: Callable, submit: Callable, prepare_workers: int, max_concurrent_submits: int):
+    """Prepares files in a pool of prepare_workers threads and submits the prepared jobs in the order of files (the order
+    of the scheduler), each as soon as it and the files before it are ready, with at most max_concurrent_submits
+    submissions running at the same time.
+    prepare(file) returns a job (or None if there is nothing to submit), submit(job) submits it.
+    Returns once all files were submitted.
+    """
+    with ThreadPoolExecutor(max_concurrent_submits) as submitters, ThreadPoolExecutor(prepare_workers) as preparers:
+        prepared = {preparers.submit(prepare, f): f for f in files}
+        submitted = {}
+        for future in prepared:  # in the order of files, not of completion
+            try:
+                job = future.result()
+            except Exception:
+                logging.exception(f"Preparing {prepared[future]} failed")
+                continue
+            if job is not None:
+                submitted[submitters.submit(submit, job)] = prepared[future]
+        for future in as_completed(submitted):
+            try:
+                future.result()
+            except Exception:
+                logging.exception(f"Submitting {submitted[future]} failed")
+
+
+def parse_partition(slurm_args: str) -> str:
+    """Returns the partition set in sbatch arguments, or "" for the default partition"""
+    tokens = shlex.split(slurm_args)
+    for i, token in enumerate(tokens):
+        if token.startswith("--partition="):
+            return token.split("=", 1)[1]
+        if token in ["--partition", "-p"] and i + 1 < len(tokens):
+            return tokens[i + 1]
+        if token.startswith("-p") and len(token) > 2:
+            return token[2:]
+    return ""
+
+
+def parse_in_flight_limits(max_in_flight: str, default_partition: str) -> Dict[str, int]:
+    """Parses "200" (limit for default_partition) or "gpu=200,amd=1000" into {partition: limit}"""
+    limits = {}
+    for item in max_in_flight.replace(" ", "").split(","):
+        if not item:
+            continue
+        partition, _, limit = item.rpartition("=")
+        limits[partition or default_partition] = int(limit)
+    return limits
+
+
+class AdmissionControl:
+    """Keeps the number of our pending and running jobs per partition under a limit (e.g. the account's MaxSubmitJobs)
+    and retries failed submissions.
+    The jobs in the queue are counted with one squeue call per scan (array tasks count individually, like for
+    MaxSubmitJobs). Input files that don't fit under the limit wait in an ordered backlog, in the order of the scheduler
+    (the order they were found without one). With partition_of, each input counts against the partition it will be
+    routed to instead of the partition of slurm_args. A submission that fails is retried after retry_backoff_s, doubling the
+    wait after every failed attempt up to max_retry_backoff_s.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, int],
+        partition: str = "",
+        squeue: str = "squeue",
+        retry_backoff_s: float = 30,
+        max_retry_backoff_s: float = 1800,
+        scheduler: Optional[Scheduler] = None,
+    ):
+        self.limits = limits
+        self.partition = partition  # partition the watcher submits to
+        self.squeue = squeue
+        self.retry_backoff_s = retry_backoff_s
+        self.max_retry_backoff_s = max_retry_backoff_s
+        self.scheduler = scheduler
+        self.in_flight: Dict[str, int] = {}  # jobs in the queue at the last refresh plus jobs submitted since
+        # input files in the order they were found (dicts keep insertion order): their partition, once it is known
+        self.backlog: Dict[str, Optional[str]] = {}
+        self.retries = []  # heap of (due time, counter, attempt, description, n_jobs, partition, submit)
+        self.retry_counter = 0
+        self.lock = threading.Lock()  # submissions can come from several threads (pipeline)
+
+    def refresh(self):
+        """Counts our pending and running jobs per partition with a single squeue call"""
+        if not self.limits:
+            return
+        command = shlex.split(self.squeue) + [
+            "-u", getpass.getuser(), "-r", "--noheader", "--states=PENDING,RUNNING,CONFIGURING,REQUEUED", "--format=%P"
+        ]
+        try:
+            output = subprocess.run(command, capture_output=True, text=True, timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"WARNING: could not count the jobs in the queue ({e}), using the previous count")
+            return
+        if output.returncode != 0:
+            logging.warning(f"WARNING: could not count the jobs in the queue ({output.stderr.strip()}), using the previous count")
+            return
+        in_flight = {}
+        for line in output.stdout.split():
+            for partition in line.split(","):  # pending jobs can list several partitions
+                in_flight[partition] = in_flight.get(partition, 0) + 1
+        with self.lock:
+            self.in_flight = in_flight
+        METRICS.set("in_flight_jobs", in_flight.get(self.partition, 0))
+
+    def free_slots(self, partition: Optional[str] = None) -> Optional[int]:
+        """Number of jobs that can still be submitted to partition, None if there is no limit"""
+        with self.lock:
+            return self._free_slots(partition)
+
+    def _free_slots(self, partition: Optional[str]) -> Optional[int]:
+        partition = self.partition if partition is None else partition
+        if partition not in self.limits:
+            return None
+        return max(0, self.limits[partition] - self.in_flight.get(partition, 0))
+
+    def admit(
+        self, paths: List[str], jobs_per_path: int = 1, partition_of: Optional[Callable[[str], str]] = None
+    ) -> List[str]:
+        """Adds new input files to the backlog and returns the first ones that may be submitted now.
+        partition_of returns the partition an input file will be routed to
+        """
+        for path in paths:
+            self.backlog.setdefault(path, None)
+        free_slots: Dict[str, Optional[int]] = {}  # partition: jobs that can still be submitted, None without a limit
+        admitted = []
+        for path in list(self.backlog) if self.scheduler is None else self.scheduler.order(list(self.backlog)):
+            partition = self.partition
+            if partition_of is not None and self.limits:
+                if self.backlog[path] is None:
+                    self.backlog[path] = partition_of(path)
+                partition = self.backlog[path]
+            if partition not in free_slots:
+                free = self.free_slots(partition)
+                free_slots[partition] = None if free is None else free - self.pending_retry_jobs(partition)
+            if free_slots[partition] is not None and free_slots[partition] < jobs_per_path:
+                if partition_of is None:
+                    break  # all files go to the same partition
+                continue
+            del self.backlog[path]
+            if os.path.exists(path):  # could have been removed (or claimed by another watcher) in the meantime
+                admitted.append(path)
+                if free_slots[partition] is not None:
+                    free_slots[partition] -= jobs_per_path
+        if self.scheduler is not None:
+            self.scheduler.charge(admitted)
+        METRICS.set("backlog_files", len(self.backlog))
+        METRICS.set("retry_queue_jobs", self.pending_retry_jobs())
+        if self.backlog:
+            logging.info(f"{len(self.backlog)} files wait in the backlog, {self.in_flight.get(self.partition, 0)} jobs in {self.partition or 'the queue'}")
+        return admitted
+
+    def submitted(self, n_jobs: int = 1, partition: Optional[str] = None):
+        partition = self.partition if partition is None else partition
+        with self.lock:
+            self.in_flight[partition] = self.in_flight.get(partition, 0) + n_jobs
+
+    def pending_retry_jobs(self, partition: Optional[str] = None) -> int:
+        """Jobs waiting to be retried, in partition or in all partitions if it is None"""
+        with self.lock:
+            return sum(
+                retry[4] for retry in self.retries
+                if partition is None or (self.partition if retry[5] is None else retry[5]) == partition
+            )
+
+    def submit(self, submit: Callable[[], bool], description: str, n_jobs: int = 1, partition: Optional[str] = None, attempt: int = 0):
+        """Calls submit(), which returns True if sbatch succeeded. If it failed, it is retried later by run_due_retries"""
+        if submit():
+            self.submitted(n_jobs, partition)
+            return
+        backoff_s = min(self.retry_backoff_s * 2**attempt, self.max_retry_backoff_s)
+        logging.warning(f"Submitting {description} failed (attempt {attempt + 1}), retrying in {backoff_s:g} s")
+        with self.lock:
+            self.retry_counter += 1
+            heapq.heappush(
+                self.retries, (time.time() + backoff_s, self.retry_counter, attempt + 1, description, n_jobs, partition, submit)
+            )
+
+    def run_due_retries(self):
+        """Retries the failed submissions whose backoff has passed, as long as the limit allows it"""
+        while True:
+            with self.lock:
+                if not self.retries or self.retries[0][0] > time.time():
+                    return
+                _, _, attempt, description, n_jobs, partition, submit = self.retries[0]
+                free_slots = self._free_slots(partition)
+                if free_slots is not None and free_slots < n_jobs:
+                    return
+                heapq.heappop(self.retries)
+            logging.info(f"Retrying submission of {description}")
+            self.submit(submit, description, n_jobs, partition, attempt)
+
+
+def submit_with_admission(
+    admission: Optional[AdmissionControl], submit: Callable[[], bool], description, n_jobs: int = 1, partition: Optional[str] = None
+):
+    """Calls submit() through admission (so it is counted and retried if it fails), or directly without admission.
+    partition is the partition the job was routed to, if it is not the one of slurm_args
+    """
+    if admission is None:
+        submit()
+    else:
+        admission.submit(submit, str(description), n_jobs, partition)